@@ -0,0 +1,353 @@
+# converters/animated_image_converter.py - Frame-streaming conversion between animated formats
+"""
+Converts animated GIF, WebP and APNG inputs to animated GIF, WebP, APNG or MP4
+one frame at a time. Pillow's save_all() keeps every frame of the animation
+in memory before writing, so the writers here emit each frame as soon as it
+is decoded and only hold the previous frame for comparison:
+
+- Consecutive identical frames are merged (their durations are added up)
+- GIF output uses one global palette built once from a sample of frames,
+  and only the changed region of each frame is written
+- APNG output writes changed regions as fcTL/fdAT chunks
+- WebP output is saved from the source image, which Pillow encodes frame
+  by frame
+- MP4 output pipes raw frames into FFmpeg
+"""
+import os
+import struct
+import subprocess
+import zlib
+from typing import Iterator, List, Optional, Tuple, TYPE_CHECKING
+
+from utils.config import ANIMATION_PALETTE_SAMPLES, ANIMATION_DEFAULT_FRAME_MS, ANIMATION_MP4_FPS
+from utils.dependencies import FFMPEG_AVAILABLE
+from converters.large_image_processor import png_chunk, filter_png_rows
+
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+ANIMATED_INPUT_EXTENSIONS = ('.gif', '.webp', '.png', '.apng')
+ANIMATED_OUTPUT_FORMATS = ('gif', 'webp', 'apng', 'mp4')
+
+# Palette index reserved for transparent pixels in GIF output
+GIF_TRANSPARENT_INDEX = 255
+
+# Longest edge of the frame thumbnails used to build the GIF palette
+PALETTE_SAMPLE_SIZE = 256
+
+# Loop count for sources without loop information (GIFs without a
+# NETSCAPE extension play once); 0 means forever
+PLAY_ONCE = 1
+
+# APNG dispose/blend operations
+APNG_DISPOSE_OP_NONE = 0
+APNG_BLEND_OP_SOURCE = 0
+
+
+def is_animated_image(img: 'PILImage.Image') -> bool:
+    """Check whether an opened image has more than one frame"""
+    return getattr(img, 'is_animated', False) and getattr(img, 'n_frames', 1) > 1
+
+
+def _has_alpha(img: 'PILImage.Image') -> bool:
+    """Check whether any of the sampled frames uses transparency"""
+    if img.mode not in ('RGBA', 'LA', 'PA', 'P') and 'transparency' not in img.info:
+        return False
+
+    for index in _sample_indices(img.n_frames):
+        img.seek(index)
+        if img.convert('RGBA').getextrema()[3][0] < 255:
+            return True
+    return False
+
+
+def _sample_indices(frame_count: int) -> List[int]:
+    count = min(frame_count, ANIMATION_PALETTE_SAMPLES)
+    if count <= 1:
+        return [0]
+    return sorted({round(i * (frame_count - 1) / (count - 1)) for i in range(count)})
+
+
+def _frame_duration(img: 'PILImage.Image') -> int:
+    return int(img.info.get('duration') or ANIMATION_DEFAULT_FRAME_MS)
+
+
+def iter_animation_frames(img: 'PILImage.Image', mode: str) -> Iterator[Tuple['PILImage.Image', int]]:
+    """
+    Yield (frame, duration_ms) for each distinct frame of an animation
+
+    Frames are decoded one at a time in ``mode``. A frame identical to the
+    previous one is dropped and its duration added to the previous frame.
+    """
+    pending = None
+    pending_bytes = None
+    pending_duration = 0
+
+    for index in range(img.n_frames):
+        img.seek(index)
+        frame = img.convert(mode)
+        duration = _frame_duration(img)
+        frame_bytes = frame.tobytes()
+
+        if pending is not None and frame_bytes == pending_bytes:
+            pending_duration += duration
+            continue
+
+        if pending is not None:
+            yield pending, pending_duration
+        pending, pending_bytes, pending_duration = frame, frame_bytes, duration
+
+    if pending is not None:
+        yield pending, pending_duration
+
+
+def build_global_palette(img: 'PILImage.Image', colors: int) -> List[int]:
+    """
+    Build one palette for the whole animation from a sample of its frames
+
+    Quantizing every frame separately makes colors flicker between frames
+    and costs a full median cut per frame. Instead, evenly spaced frames are
+    thumbnailed into one mosaic that is quantized once.
+    """
+    from PIL import Image
+
+    thumbnails = []
+    for index in _sample_indices(img.n_frames):
+        img.seek(index)
+        frame = img.convert('RGB')
+        frame.thumbnail((PALETTE_SAMPLE_SIZE, PALETTE_SAMPLE_SIZE))
+        thumbnails.append(frame)
+
+    mosaic = Image.new('RGB', (max(t.width for t in thumbnails), sum(t.height for t in thumbnails)))
+    y = 0
+    for thumbnail in thumbnails:
+        mosaic.paste(thumbnail, (0, y))
+        y += thumbnail.height
+
+    quantized = mosaic.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+    return quantized.getpalette()[:colors * 3]
+
+
+def _changed_bbox(current: 'np.ndarray', previous: Optional['np.ndarray']) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box (left, top, right, bottom) of pixels that differ from the previous frame"""
+    if previous is None:
+        return (0, 0, current.shape[1], current.shape[0])
+
+    changed = current != previous
+    if changed.ndim == 3:
+        changed = changed.any(axis=2)
+    rows = np.flatnonzero(changed.any(axis=1))
+    if not rows.size:
+        return None
+    cols = np.flatnonzero(changed.any(axis=0))
+    return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+
+def _write_gif(img: 'PILImage.Image', output_path: str, has_alpha: bool, loop: Optional[int]) -> int:
+    from PIL import Image, GifImagePlugin
+
+    colors = 255 if has_alpha else 256
+    palette = build_global_palette(img, colors)
+    palette_image = Image.new('P', (1, 1))
+    palette_image.putpalette(palette)
+
+    # Global color table must have 256 entries; the spare slot is transparency
+    color_table = bytes(palette) + bytes(768 - len(palette))
+    width, height = img.size
+    # Frames with transparency have to be fully redrawn (dispose to
+    # background), opaque frames are drawn over the previous one
+    disposal = 2 if has_alpha else 1
+
+    frame_count = 0
+    previous = None
+    with open(output_path, 'wb') as f:
+        f.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0xf7, 0, 0) + color_table)
+        if loop is not None:
+            f.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+        for frame, duration in iter_animation_frames(img, 'RGBA' if has_alpha else 'RGB'):
+            indexed = frame.convert('RGB').quantize(
+                palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG
+            )
+            pixels = np.asarray(indexed)
+            if has_alpha:
+                pixels = pixels.copy()
+                pixels[np.asarray(frame.getchannel('A')) < 128] = GIF_TRANSPARENT_INDEX
+
+            bbox = (0, 0, width, height) if has_alpha else _changed_bbox(pixels, previous)
+            if bbox is None:
+                # Quantization made this frame identical to the previous one;
+                # a 1px frame still carries its duration
+                bbox = (0, 0, 1, 1)
+            previous = pixels
+
+            region = Image.fromarray(pixels[bbox[1]:bbox[3], bbox[0]:bbox[2]], 'P')
+            params = {'duration': duration, 'disposal': disposal}
+            if has_alpha:
+                params['transparency'] = GIF_TRANSPARENT_INDEX
+            for data in GifImagePlugin.getdata(region, offset=bbox[:2], **params):
+                f.write(data)
+            frame_count += 1
+
+        f.write(b';')
+    return frame_count
+
+
+def _write_apng(img: 'PILImage.Image', output_path: str, has_alpha: bool, loop: Optional[int]) -> int:
+    mode = 'RGBA' if has_alpha else 'RGB'
+    channels = len(mode)
+    width, height = img.size
+    num_plays = PLAY_ONCE if loop is None else loop
+
+    sequence = 0
+    frame_count = 0
+    previous = None
+    with open(output_path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6 if has_alpha else 2, 0, 0, 0)))
+        # The frame count is only known at the end; acTL is patched then
+        actl_offset = f.tell()
+        f.write(png_chunk(b'acTL', struct.pack('>II', 0, num_plays)))
+
+        for frame, duration in iter_animation_frames(img, mode):
+            pixels = np.asarray(frame)
+            bbox = _changed_bbox(pixels, previous)
+            previous = pixels
+            left, top, right, bottom = bbox
+
+            f.write(png_chunk(b'fcTL', struct.pack(
+                '>IIIIIHHBB', sequence, right - left, bottom - top, left, top,
+                min(duration, 65535), 1000, APNG_DISPOSE_OP_NONE, APNG_BLEND_OP_SOURCE
+            )))
+            sequence += 1
+
+            region = np.ascontiguousarray(pixels[top:bottom, left:right]).reshape(bottom - top, -1)
+            data = zlib.compress(filter_png_rows(region, np.zeros(region.shape[1], dtype=np.uint8), channels))
+            if frame_count == 0:
+                # The first frame doubles as the default image
+                f.write(png_chunk(b'IDAT', data))
+            else:
+                f.write(png_chunk(b'fdAT', struct.pack('>I', sequence) + data))
+                sequence += 1
+            frame_count += 1
+
+        f.write(png_chunk(b'IEND', b''))
+        f.seek(actl_offset)
+        f.write(png_chunk(b'acTL', struct.pack('>II', frame_count, num_plays)))
+    return frame_count
+
+
+def _write_webp(img: 'PILImage.Image', output_path: str, loop: Optional[int], quality: int) -> int:
+    # Saving the source image itself (no append_images) makes Pillow seek
+    # and encode one frame at a time; libwebp merges unchanged frames
+    durations = []
+    for index in range(img.n_frames):
+        img.seek(index)
+        durations.append(_frame_duration(img))
+    img.seek(0)
+
+    img.save(
+        output_path, 'WEBP', save_all=True, duration=durations,
+        loop=PLAY_ONCE if loop is None else loop,
+        background=(0, 0, 0, 0), quality=quality, method=4
+    )
+    return len(durations)
+
+
+def _write_mp4(img: 'PILImage.Image', output_path: str) -> int:
+    """Pipe frames into FFmpeg at a constant frame rate, repeating frames to hold their duration"""
+    from PIL import Image
+    from converters import video_converter
+
+    width, height = img.size
+    cmd = [
+        video_converter.FFMPEG_PATH, '-y', '-loglevel', 'error',
+        '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', f'{width}x{height}',
+        '-r', str(ANIMATION_MP4_FPS), '-i', '-',
+        # yuv420p needs even dimensions
+        '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+        '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23',
+        '-pix_fmt', 'yuv420p', '-movflags', '+faststart',
+        output_path
+    ]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+    frame_count = 0
+    elapsed = 0
+    written = 0
+    try:
+        for frame, duration in iter_animation_frames(img, 'RGBA'):
+            # No alpha in MP4 - flatten onto white
+            background = Image.new('RGB', frame.size, (255, 255, 255))
+            background.paste(frame, mask=frame.getchannel('A'))
+            data = background.tobytes()
+
+            elapsed += duration
+            slots = max(1 if written == 0 else 0, round(elapsed * ANIMATION_MP4_FPS / 1000) - written)
+            for _ in range(slots):
+                process.stdin.write(data)
+            written += slots
+            frame_count += 1
+        process.stdin.close()
+    except BrokenPipeError:
+        pass
+
+    stderr = process.stderr.read().decode(errors='replace')
+    if process.wait() != 0:
+        raise RuntimeError(f"FFmpeg failed: {stderr.strip()[-500:]}")
+    return frame_count
+
+
+def convert_animation_sync(input_path: str, output_path: str, target_format: str, quality: int = 90) -> bool:
+    """
+    Convert an animated GIF/WebP/APNG to GIF, WebP, APNG or MP4 frame by frame
+
+    Returns False when the input is not animated so callers can fall back
+    to single-image conversion.
+    """
+    from PIL import Image
+
+    target_format = target_format.lower()
+    if target_format not in ANIMATED_OUTPUT_FORMATS or not NUMPY_AVAILABLE:
+        return False
+    if target_format == 'mp4' and not FFMPEG_AVAILABLE:
+        print("FFmpeg not available - cannot convert animation to MP4")
+        return False
+
+    if not input_path.lower().endswith(ANIMATED_INPUT_EXTENSIONS):
+        return False
+    try:
+        img = Image.open(input_path)
+    except Exception:
+        return False
+
+    with img:
+        if not is_animated_image(img):
+            return False
+
+        loop = img.info.get('loop')
+        loop = int(loop) if loop is not None else None
+        has_alpha = target_format in ('gif', 'apng') and _has_alpha(img)
+
+        try:
+            if target_format == 'gif':
+                frame_count = _write_gif(img, output_path, has_alpha, loop)
+            elif target_format == 'apng':
+                frame_count = _write_apng(img, output_path, has_alpha, loop)
+            elif target_format == 'webp':
+                frame_count = _write_webp(img, output_path, loop, quality)
+            else:
+                frame_count = _write_mp4(img, output_path)
+        except Exception:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+
+        print(f"Animated {img.format} -> {target_format.upper()}: {img.n_frames} frames in, {frame_count} written")
+        return True
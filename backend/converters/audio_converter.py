@@ -1,10 +1,17 @@
 # converters/audio_converter.py - FIXED VERSION
 import os
+import io
 import subprocess
 import shlex
-from typing import Optional
+from typing import Optional, Dict, AsyncIterator, Callable, BinaryIO
+from collections import deque
 import logging
 import threading
+import asyncio
+
+from converters.media_analysis import analyze_media_async, cap_bitrates
+from converters.loudness import measure_loudness_async, loudness_filter
+from converters.waveform import PeakAccumulator, peaks_output_args
 
 logger = logging.getLogger(__name__)
 
@@ -54,15 +61,297 @@ def check_ffmpeg():
 
 FFMPEG_AVAILABLE = check_ffmpeg()
 
+# Bitrate settings
+AUDIO_BITRATES = {
+    "96": "96k",
+    "128": "128k", 
+    "192": "192k",
+    "256": "256k",
+    "320": "320k"
+}
+
+def audio_format_args(target_format: str, bitrate: str = "320") -> list:
+    """Encoder arguments for one output format"""
+    audio_bitrate = AUDIO_BITRATES.get(bitrate, "320k")
+    
+    # FIXED: Comprehensive format settings with proper indentation
+    format_settings = {
+        # Lossy formats
+        'mp3': ["-c:a", "libmp3lame", "-b:a", audio_bitrate],
+        'aac': ["-c:a", "aac", "-b:a", audio_bitrate],
+        'm4a': ["-c:a", "aac", "-b:a", audio_bitrate],
+        'ogg': ["-c:a", "libvorbis", "-b:a", audio_bitrate],
+        'opus': ["-c:a", "libopus", "-b:a", audio_bitrate],
+        'wma': ["-c:a", "wmav2", "-b:a", audio_bitrate],
+        'ac3': ["-c:a", "ac3", "-b:a", audio_bitrate],
+        
+        # Lossless formats
+        'wav': ["-c:a", "pcm_s16le"],
+        'flac': ["-c:a", "flac"],
+        'aiff': ["-c:a", "pcm_s16be"],
+        'alac': ["-c:a", "alac"]
+    }
+    
+    target_format_lower = target_format.lower()
+    if target_format_lower in format_settings:
+        return format_settings[target_format_lower]
+    print(f"⚠️  Unknown format {target_format}, using default AAC settings")
+    return ["-c:a", "aac", "-b:a", "320k"]
+
+def _run_ffmpeg(cmd: list, input_path: str, output_paths: list,
+                stdout_consumer: Optional[Callable[[BinaryIO], None]] = None) -> bool:
+    """
+    Run an FFmpeg audio command, logging progress, and check every output (blocking)
+
+    stdout_consumer, if given, reads FFmpeg's stdout (an output written to
+    pipe:1) in a thread while the command runs.
+    """
+    # Log the complete command
+    cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
+    print(f"FFmpeg command: {cmd_str}")
+    logger.info(f"FFmpeg command: {cmd_str}")
+    
+    # Execute conversion
+    print("[*] Starting FFmpeg audio conversion...")
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    )
+    
+    # Read output in real-time
+    stderr_lines = []
+    # stdout may carry binary data, so only stderr is read as (universal newline) text
+    stderr_text = io.TextIOWrapper(process.stderr, errors='replace')
+    
+    def read_stderr():
+        for line in iter(stderr_text.readline, ''):
+            if line.strip():
+                # Encode-safe version for Windows console
+                safe_line = line.strip().encode('ascii', errors='ignore').decode('ascii')
+                stderr_lines.append(safe_line)
+                # Print progress and important messages
+                if any(keyword in safe_line.lower() for keyword in ['time=', 'error', 'warning']):
+                    print(f"FFmpeg: {safe_line}")
+    
+    # Start reading thread
+    stderr_thread = threading.Thread(target=read_stderr)
+    stderr_thread.start()
+    
+    stdout_thread = None
+    if stdout_consumer:
+        stdout_thread = threading.Thread(target=stdout_consumer, args=(process.stdout,))
+        stdout_thread.start()
+    
+    # Wait for completion with timeout
+    try:
+        return_code = process.wait(timeout=600)  # 10 minutes for audio
+        
+        # Wait for thread to finish
+        stderr_thread.join(timeout=5)
+        if stdout_thread:
+            stdout_thread.join(timeout=5)
+        
+        print(f"FFmpeg finished with return code: {return_code}")
+        
+        if return_code == 0:
+            missing = [path for path in output_paths
+                       if not os.path.exists(path) or os.path.getsize(path) == 0]
+            if not missing:
+                for output_path in output_paths:
+                    output_size = os.path.getsize(output_path)
+                    print(f"[OK] Audio conversion successful: {os.path.basename(output_path)}")
+                    print(f"Output file size: {output_size} bytes ({output_size/1024/1024:.2f} MB)")
+                    logger.info(f"Audio conversion successful: {input_path} -> {output_path}")
+                return True
+            else:
+                print(f"[FAILED] Output file is missing or empty: {', '.join(missing)}")
+                logger.error("Output file missing or empty")
+                return False
+        else:
+            print(f"[FAILED] FFmpeg failed with return code: {return_code}")
+            if stderr_lines:
+                print("Last error messages:")
+                for line in stderr_lines[-5:]:
+                    print(f"  {line}")
+            logger.error(f"FFmpeg failed: {return_code}")
+            return False
+            
+    except subprocess.TimeoutExpired:
+        print("[FAILED] Audio conversion timed out after 10 minutes")
+        process.kill()
+        stderr_thread.join(timeout=2)
+        if stdout_thread:
+            stdout_thread.join(timeout=2)
+        logger.error("Audio conversion timed out")
+        return False
+
+def _write_peaks(peaks: PeakAccumulator, waveform_path: str) -> None:
+    """Write a peaks file, logging rather than raising on failure"""
+    try:
+        if peaks.write(waveform_path):
+            print(f"[OK] Waveform peaks written: {os.path.basename(waveform_path)}")
+    except Exception as e:
+        print(f"Waveform peaks failed: {e}")
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+async def stream_ffmpeg_output(cmd: list, chunk_size: int = STREAM_CHUNK_SIZE,
+                               stdin_chunks: Optional[AsyncIterator[bytes]] = None) -> AsyncIterator[bytes]:
+    """
+    Run an FFmpeg command that writes to pipe:1 and yield its output as produced
+
+    stdin_chunks, if given, is fed to FFmpeg's stdin (for an input of
+    pipe:0) while the output is read. Only one chunk is held in memory at a
+    time. FFmpeg is killed if the consumer stops early (e.g. the client
+    disconnected); a failed encode raises after the last chunk, which
+    aborts a streaming response.
+    """
+    cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
+    print(f"FFmpeg streaming command: {cmd_str}")
+    
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if stdin_chunks is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    )
+    
+    # Drain stderr so FFmpeg never blocks on it; keep the tail for errors
+    stderr_tail = deque(maxlen=5)
+    
+    def read_stderr():
+        for line in iter(process.stderr.readline, b''):
+            if line.strip():
+                stderr_tail.append(line.decode('ascii', errors='ignore').strip())
+    
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+    
+    async def feed_stdin():
+        try:
+            async for chunk in stdin_chunks:
+                await asyncio.to_thread(process.stdin.write, chunk)
+        except OSError:
+            # FFmpeg stopped reading (it finished early or failed)
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+    
+    feeder = asyncio.create_task(feed_stdin()) if stdin_chunks is not None else None
+    
+    try:
+        while True:
+            # read1 returns whatever FFmpeg has written so far (up to
+            # chunk_size); read() would wait for a full chunk
+            chunk = await asyncio.to_thread(process.stdout.read1, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        
+        return_code = await asyncio.to_thread(process.wait)
+        stderr_thread.join(timeout=5)
+        if return_code != 0:
+            print(f"[FAILED] FFmpeg stream failed with return code: {return_code}")
+            for line in stderr_tail:
+                print(f"  {line}")
+            raise RuntimeError(f"FFmpeg failed with return code {return_code}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        if feeder:
+            await feeder
+        process.stdout.close()
+
+# Output formats that can be written to a pipe and played while downloading
+STREAM_MUXERS = {
+    'mp3': ["-f", "mp3"],
+    'ogg': ["-f", "ogg"],
+    'aac': ["-f", "adts"],
+    # Fragmented MP4 (header first, no seeking back). One-second fragments:
+    # frag_keyframe would cut one per audio packet, since every packet is a keyframe
+    'm4a': ["-f", "ipod", "-movflags", "empty_moov+default_base_moof", "-frag_duration", "1000000"]
+}
+
+STREAM_MEDIA_TYPES = {'mp3': 'audio/mpeg', 'ogg': 'audio/ogg', 'aac': 'audio/aac', 'm4a': 'audio/mp4'}
+
+# Input formats FFmpeg can demux from a pipe (no seeking); others are read from a file
+PIPE_INPUT_FORMATS = {'mp3', 'wav', 'flac', 'ogg', 'opus', 'aac', 'ac3', 'mp2', 'amr', 'au'}
+
+async def stream_audio(input_source, target_format: str, bitrate: str = "320",
+                       loudness: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    Transcode and yield the output as FFmpeg produces it (nothing is written to disk)
+
+    input_source is a file path, or an async iterator of the input bytes
+    (one of PIPE_INPUT_FORMATS) that is piped into FFmpeg. loudness names
+    a LOUDNESS_TARGETS entry; piped input can't be measured ahead of
+    time, so it gets loudnorm's one-pass dynamic mode.
+    """
+    target_format = target_format.lower()
+    if target_format not in STREAM_MUXERS:
+        raise ValueError(f"{target_format} can't be streamed")
+    
+    media_info = None
+    measurement = None
+    if isinstance(input_source, str):
+        media_info = await analyze_media_async(input_source)
+        if media_info is not None and media_info.get("audio") is None:
+            raise ValueError("Input has no audio stream")
+        if loudness:
+            measurement = await measure_loudness_async(input_source)
+    
+    cmd = [FFMPEG_PATH, "-v", "error", "-i", input_source if isinstance(input_source, str) else "pipe:0", "-vn"]
+    if loudness:
+        cmd.extend(["-af", loudness_filter(loudness, measurement)])
+    cmd.extend(cap_bitrates(audio_format_args(target_format, bitrate), media_info))
+    cmd.extend(["-ar", "44100"])
+    cmd.extend(STREAM_MUXERS[target_format])
+    cmd.append("pipe:1")
+    
+    stdin_chunks = None if isinstance(input_source, str) else input_source
+    async for chunk in stream_ffmpeg_output(cmd, stdin_chunks=stdin_chunks):
+        yield chunk
+
 async def convert_audio(input_path: str, output_path: str, target_format: str, 
-                       bitrate: str = "320") -> bool:
+                       bitrate: str = "320", loudness: Optional[str] = None,
+                       waveform_path: Optional[str] = None) -> bool:
     """Convert audio with comprehensive format support"""
+    return await convert_audio_multi(input_path, {target_format: output_path}, bitrate, loudness, waveform_path)
+
+async def convert_audio_multi(input_path: str, outputs: Dict[str, str],
+                              bitrate: str = "320", loudness: Optional[str] = None,
+                              waveform_path: Optional[str] = None) -> bool:
+    """
+    Convert audio to several formats from a single decode
+
+    outputs maps target format -> output path. All outputs are written by
+    one FFmpeg process: the input is decoded once and the decoded audio is
+    fed to every output's encoder.
+
+    loudness names a LOUDNESS_TARGETS entry (e.g. "podcast") to normalize
+    to. The first-pass measurement is cached per content, so converting
+    the same source again only runs this encode. The filter runs once and
+    its output is split to every encoder.
+
+    waveform_path: also write a waveform peaks file there, computed from
+    the same decode (see converters/waveform.py). Failing to write it
+    doesn't fail the conversion.
+    """
     
     print(f"Starting audio conversion:")
     print(f"   Input: {input_path}")
-    print(f"   Output: {output_path}")
-    print(f"   Format: {target_format}")
+    for target_format, output_path in outputs.items():
+        print(f"   Output ({target_format}): {output_path}")
     print(f"   Bitrate: {bitrate}")
+    if loudness:
+        print(f"   Loudness: {loudness}")
     
     if not FFMPEG_AVAILABLE:
         print("[FAILED] FFmpeg not available - cannot convert audio")
@@ -73,123 +362,65 @@ async def convert_audio(input_path: str, output_path: str, target_format: str,
         return False
     
     try:
-        # Bitrate settings
-        bitrate_settings = {
-            "96": "96k",
-            "128": "128k", 
-            "192": "192k",
-            "256": "256k",
-            "320": "320k"
-        }
+        # Cached probe: reject inputs without audio before spawning an encode
+        media_info = await analyze_media_async(input_path)
+        if media_info is not None and media_info.get("audio") is None:
+            print("[FAILED] Input has no audio stream")
+            return False
         
-        # FIXED: Comprehensive format settings with proper indentation
-        format_settings = {
-            # Lossy formats
-            'mp3': ["-c:a", "libmp3lame", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'aac': ["-c:a", "aac", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'm4a': ["-c:a", "aac", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'ogg': ["-c:a", "libvorbis", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'opus': ["-c:a", "libopus", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'wma': ["-c:a", "wmav2", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            'ac3': ["-c:a", "ac3", "-b:a", bitrate_settings.get(bitrate, "320k")],
-            
-            # Lossless formats
-            'wav': ["-c:a", "pcm_s16le"],
-            'flac': ["-c:a", "flac"],
-            'aiff': ["-c:a", "pcm_s16be"],
-            'alac': ["-c:a", "alac"]
-        }
+        audio_filter = None
+        if loudness:
+            measurement = await measure_loudness_async(input_path)
+            audio_filter = loudness_filter(loudness, measurement)
         
         # Build FFmpeg command
         cmd = [FFMPEG_PATH, "-y", "-i", input_path]
         
-        # Add format-specific encoding settings
-        target_format_lower = target_format.lower()
-        
-        if target_format_lower in format_settings:
-            cmd.extend(format_settings[target_format_lower])
-        else:
-            print(f"⚠️  Unknown format {target_format}, using default AAC settings")
-            cmd.extend(["-c:a", "aac", "-b:a", "320k"])
-        
-        # Essential audio settings
-        cmd.extend([
-            "-ar", "44100",  # Sample rate
-            "-threads", "0",  # Use all cores
-            "-avoid_negative_ts", "make_zero"
-        ])
-        
-        # Add output file
-        cmd.append(output_path)
-        
-        # Log the complete command
-        cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
-        print(f"FFmpeg command: {cmd_str}")
-        logger.info(f"FFmpeg command: {cmd_str}")
-        
-        # Execute conversion
-        print("[*] Starting FFmpeg audio conversion...")
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        )
-        
-        # Read output in real-time
-        stderr_lines = []
-        
-        def read_stderr():
-            for line in iter(process.stderr.readline, ''):
-                if line.strip():
-                    # Encode-safe version for Windows console
-                    safe_line = line.strip().encode('ascii', errors='ignore').decode('ascii')
-                    stderr_lines.append(safe_line)
-                    # Print progress and important messages
-                    if any(keyword in safe_line.lower() for keyword in ['time=', 'error', 'warning']):
-                        print(f"FFmpeg: {safe_line}")
+        # Filter once and split the result to every output (and the peaks
+        # output) instead of repeating the filter per output
+        labels = None
+        if audio_filter:
+            count = len(outputs) + (1 if waveform_path else 0)
+            labels = [f"[o{i}]" for i in range(count)]
+            cmd.extend([
+                "-filter_complex",
+                f"[0:a:0]{audio_filter},asplit={count}{''.join(labels)}"
+            ])
         
-        # Start reading thread
-        stderr_thread = threading.Thread(target=read_stderr)
-        stderr_thread.start()
-        
-        # Wait for completion with timeout
-        try:
-            return_code = process.wait(timeout=600)  # 10 minutes for audio
+        for index, (target_format, output_path) in enumerate(outputs.items()):
+            # Options apply per output: drop video (cover art) from each one
+            if labels:
+                cmd.extend(["-map", labels[index]])
+            else:
+                cmd.append("-vn")
             
-            # Wait for thread to finish
-            stderr_thread.join(timeout=5)
+            # Don't encode above the source bitrate (e.g. 128k MP3 -> 320k AAC)
+            cmd.extend(cap_bitrates(audio_format_args(target_format, bitrate), media_info))
             
-            print(f"FFmpeg finished with return code: {return_code}")
+            # Essential audio settings (per output)
+            cmd.extend([
+                "-ar", "44100",  # Sample rate
+                "-threads", "0",  # Use all cores
+                "-avoid_negative_ts", "make_zero"
+            ])
             
-            if return_code == 0:
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    output_size = os.path.getsize(output_path)
-                    print(f"[OK] Audio conversion successful!")
-                    print(f"Output file size: {output_size} bytes ({output_size/1024/1024:.2f} MB)")
-                    logger.info(f"Audio conversion successful: {input_path} -> {output_path}")
-                    return True
-                else:
-                    print("[FAILED] Output file is missing or empty")
-                    logger.error("Output file missing or empty")
-                    return False
+            # Add output file
+            cmd.append(output_path)
+        
+        peaks = None
+        if waveform_path:
+            peaks = PeakAccumulator()
+            if labels:
+                cmd.extend(peaks_output_args(source=labels[-1]))
             else:
-                print(f"[FAILED] FFmpeg failed with return code: {return_code}")
-                if stderr_lines:
-                    print("Last error messages:")
-                    for line in stderr_lines[-5:]:
-                        print(f"  {line}")
-                logger.error(f"FFmpeg failed: {return_code}")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            print("[FAILED] Audio conversion timed out after 10 minutes")
-            process.kill()
-            stderr_thread.join(timeout=2)
-            logger.error("Audio conversion timed out")
-            return False
+                cmd.extend(peaks_output_args())
+        
+        success = await asyncio.to_thread(
+            _run_ffmpeg, cmd, input_path, list(outputs.values()), peaks.consume if peaks else None
+        )
+        if success and peaks:
+            _write_peaks(peaks, waveform_path)
+        return success
             
     except Exception as e:
         # Sanitize error message for Windows console
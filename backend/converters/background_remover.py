@@ -5,33 +5,71 @@ Intelligent dual-model system:
 - isnet-general-use for objects/cars (92-95% accuracy)
 Auto-detects subject type for optimal results
 """
-from PIL import Image, ImageFilter, ImageEnhance
-from rembg import remove, new_session
+from PIL import Image, ImageFilter, ImageEnhance, ImageOps
 import io
 import numpy as np
-from typing import Tuple, Optional, Literal
+from typing import Tuple, Optional, Literal, List
+from collections import OrderedDict
+import hashlib
+import re
+import threading
 import cv2
 
+from utils.cache import LRUCache, DiskCache
+from utils.config import BG_MASK_CACHE_DIR, BG_MASK_MEMORY_BYTES, BG_MASK_DISK_BYTES
+from utils.image_helpers import draft_for_size, fit_dimensions, resize_image
+from converters.segmentation_pool import get_pooled_session
+
 
 class BackgroundRemover:
     """Advanced background removal with intelligent dual-model system"""
 
-    # Class-level session caching for performance
+    # Pooled, micro-batched sessions (see converters/segmentation_pool.py)
     _human_session = None
     _object_session = None
 
+    # Concurrent images in batch_remove_backgrounds; enough to fill batches
+    BATCH_CONCURRENCY = 8
+
+    # Model masks are upsampled with a guided filter computed at this long
+    # side and applied at full resolution
+    MASK_GUIDE_SIZE = 1024
+    GUIDED_FILTER_RADIUS = 8
+    GUIDED_FILTER_EPS = 1e-4
+
+    # Tile size for filters that only run around the subject boundary
+    EDGE_BAND_TILE = 256
+
+    # Recently generated gradients, keyed by size/type/angle/stops (LRU)
+    _gradient_cache: "OrderedDict[tuple, Image.Image]" = OrderedDict()
+    _gradient_lock = threading.Lock()
+    GRADIENT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    GRADIENT_LUT_SIZE = 1024
+
+    # Full-resolution masks keyed by model and image content hash; the disk
+    # tier also keeps the source images behind mask handles
+    _mask_memory = LRUCache(BG_MASK_MEMORY_BYTES, sizeof=lambda mask: mask.width * mask.height)
+    _mask_disk = DiskCache(BG_MASK_CACHE_DIR, BG_MASK_DISK_BYTES)
+    MASK_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+    # Human/object routing runs on a thumbnail with this long side; the
+    # decision is cached by image content hash (up to 4096 images)
+    ROUTING_THUMBNAIL_SIZE = 256
+    _routing_cache = LRUCache(4096, sizeof=lambda _: 1)
+    MODEL_CHOICES = ("auto", "isnet-general-use", "u2net_human_seg")
+
     @classmethod
     def _get_human_session(cls):
-        """Get or create u2net_human_seg session for humans"""
+        """Get the pooled u2net_human_seg session for humans"""
         if cls._human_session is None:
-            cls._human_session = new_session("u2net_human_seg")
+            cls._human_session = get_pooled_session("u2net_human_seg")
         return cls._human_session
 
     @classmethod
     def _get_object_session(cls):
-        """Get or create isnet-general-use session for objects/cars"""
+        """Get the pooled isnet-general-use session for objects/cars"""
         if cls._object_session is None:
-            cls._object_session = new_session("isnet-general-use")
+            cls._object_session = get_pooled_session("isnet-general-use")
         return cls._object_session
 
     @staticmethod
@@ -39,12 +77,20 @@ class BackgroundRemover:
         """
         Detect if image contains a human using advanced skin tone detection
 
+        Skin percentage and saturation are averages, so they are measured
+        on a small point-sampled thumbnail of the already decoded image
+        (nearest-neighbour sampling only touches the sampled pixels).
+
         Returns:
             True if human detected, False for objects/cars
         """
         try:
             # Convert to RGB and then HSV for skin detection
-            img_array = np.array(image.convert('RGB'))
+            limit = BackgroundRemover.ROUTING_THUMBNAIL_SIZE
+            thumbnail = image
+            if image.width > limit or image.height > limit:
+                thumbnail = image.resize(fit_dimensions(image.size, limit, limit), Image.Resampling.NEAREST)
+            img_array = np.array(thumbnail.convert('RGB'))
             hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
 
             # More strict skin tone ranges to avoid false positives (cars, objects)
@@ -110,6 +156,198 @@ class BackgroundRemover:
             print(f"[Detection] Error: {e}, defaulting to OBJECT model (isnet-general-use)")
             return False
 
+    @classmethod
+    def _detect_subject(cls, image: Image.Image, image_hash: str) -> str:
+        """Return "human" or "object" for an image, cached by content hash"""
+        subject = cls._routing_cache.get(image_hash)
+        if subject is None:
+            subject = "human" if cls._detect_human(image) else "object"
+            cls._routing_cache.put(image_hash, subject)
+        return subject
+
+    @staticmethod
+    def _open_rgba(path: str) -> Image.Image:
+        """Open an image upright (EXIF orientation applied) as RGBA"""
+        return ImageOps.exif_transpose(Image.open(path)).convert("RGBA")
+
+    @staticmethod
+    def hash_image_file(path: str) -> str:
+        """Content hash identifying an image file (used as its mask id)"""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                digest.update(chunk)
+        return digest.hexdigest()[:32]
+
+    @classmethod
+    def _get_mask(cls, image: Image.Image, image_hash: str, session) -> Tuple[Image.Image, bool]:
+        """
+        Return the full-resolution alpha mask for an image and whether it was cached
+
+        Segmentation runs at the model's native resolution; the prediction
+        is brought back to full size with a guided filter so edges follow
+        the full-resolution image instead of a blurry upscale.
+        """
+        key = f"{session.model_name}-{image_hash}"
+
+        mask = cls._mask_memory.get(key)
+        if mask is None:
+            cached_path = cls._mask_disk.get_path(key, ".png")
+            if cached_path:
+                try:
+                    mask = Image.open(cached_path)
+                    mask.load()
+                    cls._mask_memory.put(key, mask)
+                except Exception as e:
+                    print(f"[Mask] Ignoring unreadable cached mask {key}: {e}")
+                    mask = None
+
+        if mask is not None and mask.size == image.size:
+            print(f"[Mask] Cache hit for {key}")
+            return mask, True
+
+        rgb = image.convert("RGB")
+        prediction = session.predict_array(rgb)
+        mask = BackgroundRemover._upsample_mask(prediction, rgb)
+
+        cls._mask_memory.put(key, mask)
+        try:
+            buffer = io.BytesIO()
+            # Masks are mostly flat; fast compression is already small
+            mask.save(buffer, format="PNG", compress_level=1)
+            cls._mask_disk.put_bytes(key, buffer.getvalue(), ".png")
+        except Exception as e:
+            print(f"[Mask] Could not write mask {key} to disk cache: {e}")
+
+        return mask, False
+
+    @classmethod
+    def _load_with_mask(cls, path: str, session) -> Tuple[Image.Image, Image.Image]:
+        """Open an image as RGBA together with its (possibly cached) alpha mask"""
+        image = cls._open_rgba(path)
+        mask, _ = cls._get_mask(image, cls.hash_image_file(path), session)
+        return image, mask
+
+    @staticmethod
+    def _cut_out(image: Image.Image, mask: Image.Image) -> Image.Image:
+        """Apply a mask to an RGBA image, fully transparent outside it (same as rembg's naive cutout)"""
+        return Image.composite(image, Image.new("RGBA", image.size, 0), mask)
+
+    @classmethod
+    def create_mask_handle(cls, input_path: str) -> dict:
+        """
+        Segment an image once and keep it for later background operations
+
+        The returned mask_id can be passed to the other endpoints instead of
+        uploading the image again; they reuse the cached mask.
+        """
+        try:
+            mask_id = cls.hash_image_file(input_path)
+            if cls._mask_disk.get_path(f"source-{mask_id}") is None:
+                cls._mask_disk.put_file(f"source-{mask_id}", input_path)
+
+            image = cls._open_rgba(input_path)
+            _, cached = cls._get_mask(image, mask_id, cls._get_object_session())
+
+            return {
+                "success": True,
+                "mask_id": mask_id,
+                "width": image.width,
+                "height": image.height,
+                "cached": cached,
+                "subject": cls._detect_subject(image, mask_id)
+            }
+
+        except Exception as e:
+            raise Exception(f"Mask generation failed: {str(e)}")
+
+    @classmethod
+    def get_mask_source(cls, mask_id: str) -> Optional[str]:
+        """Path of the source image behind a mask handle, or None if unknown/evicted"""
+        if not cls.MASK_ID_PATTERN.match(mask_id or ""):
+            return None
+        return cls._mask_disk.get_path(f"source-{mask_id}")
+
+    @classmethod
+    def get_mask_cache_stats(cls) -> dict:
+        return {"memory": cls._mask_memory.stats(), "disk": cls._mask_disk.stats()}
+
+    @staticmethod
+    def _upsample_mask(prediction: np.ndarray, guide: Image.Image) -> Image.Image:
+        """
+        Upsample a low-resolution 0-1 prediction to the guide's size
+
+        Fast guided filter: the linear coefficients (a, b) that map guide
+        intensity to mask value are fitted at MASK_GUIDE_SIZE, then
+        bilinearly upsampled and applied to the full-resolution guide.
+        """
+        width, height = guide.size
+        scale = min(1.0, BackgroundRemover.MASK_GUIDE_SIZE / max(width, height))
+        low_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+
+        gray = guide.convert("L")
+        guide_low = np.asarray(resize_image(gray, low_size), dtype=np.float32) / 255
+        mask_low = cv2.resize(prediction.astype(np.float32), low_size, interpolation=cv2.INTER_LINEAR)
+
+        kernel = (2 * BackgroundRemover.GUIDED_FILTER_RADIUS + 1,) * 2
+
+        def box(values: np.ndarray) -> np.ndarray:
+            return cv2.boxFilter(values, -1, kernel)
+
+        mean_guide = box(guide_low)
+        mean_mask = box(mask_low)
+        covariance = box(guide_low * mask_low) - mean_guide * mean_mask
+        variance = box(guide_low * guide_low) - mean_guide * mean_guide
+
+        a = covariance / (variance + BackgroundRemover.GUIDED_FILTER_EPS)
+        b = mean_mask - a * mean_guide
+        mean_a = box(a)
+        mean_b = box(b)
+
+        if low_size != (width, height):
+            guide_low = np.asarray(gray, dtype=np.float32) / 255
+            mean_a = cv2.resize(mean_a, (width, height), interpolation=cv2.INTER_LINEAR)
+            mean_b = cv2.resize(mean_b, (width, height), interpolation=cv2.INTER_LINEAR)
+
+        alpha = mean_a * guide_low
+        alpha += mean_b
+        alpha *= 255
+        return Image.fromarray(np.clip(alpha + 0.5, 0, 255).astype(np.uint8), "L")
+
+    @staticmethod
+    def _filter_edge_band(alpha: np.ndarray, filter_fn, pad: int) -> np.ndarray:
+        """
+        Apply filter_fn to the alpha channel only around the subject boundary
+
+        Filters like bilateral smoothing cost the same per pixel everywhere,
+        but only change pixels near the edge. The alpha is split into tiles;
+        tiles that don't touch the edge band are skipped, and only band
+        pixels are copied back from the filtered tiles.
+        """
+        height, width = alpha.shape
+        solid = (alpha > 127).astype(np.uint8)
+        neighbourhood = np.ones((3, 3), np.uint8)
+        edge = cv2.dilate(solid, neighbourhood) != cv2.erode(solid, neighbourhood)
+        band = edge | ((alpha > 2) & (alpha < 253))
+        band = cv2.dilate(band.astype(np.uint8), np.ones((2 * pad + 1, 2 * pad + 1), np.uint8)).astype(bool)
+
+        result = alpha.copy()
+        tile = BackgroundRemover.EDGE_BAND_TILE
+        for y in range(0, height, tile):
+            for x in range(0, width, tile):
+                tile_band = band[y:y + tile, x:x + tile]
+                if not tile_band.any():
+                    continue
+
+                # Filter with a margin so tile borders see their neighbours
+                y0, x0 = max(0, y - pad), max(0, x - pad)
+                y1, x1 = min(height, y + tile + pad), min(width, x + tile + pad)
+                filtered = filter_fn(np.ascontiguousarray(alpha[y0:y1, x0:x1]))
+                inner = filtered[y - y0:y - y0 + tile_band.shape[0], x - x0:x - x0 + tile_band.shape[1]]
+                result[y:y + tile, x:x + tile][tile_band] = inner[tile_band]
+
+        return result
+
     @staticmethod
     def remove_background(
         input_path: str,
@@ -117,7 +355,8 @@ class BackgroundRemover:
         output_format: Literal["png", "jpg", "webp"] = "png",
         background_color: Optional[Tuple[int, int, int, int]] = None,
         edge_refinement: int = 0,
-        quality: int = 95
+        quality: int = 95,
+        model: str = "isnet-general-use"
     ) -> dict:
         """
         Remove background from image with advanced options
@@ -129,23 +368,36 @@ class BackgroundRemover:
             background_color: RGBA tuple for background color (None = transparent)
             edge_refinement: Edge refinement level 0-10
             quality: Output quality 1-100
+            model: Segmentation model, or "auto" to pick by detected subject
 
         Returns:
             dict with processing info
         """
         try:
             # Open original image
-            input_image = Image.open(input_path).convert("RGBA")
+            input_image = BackgroundRemover._open_rgba(input_path)
             original_size = input_image.size
+            image_hash = BackgroundRemover.hash_image_file(input_path)
 
-            # Use ONLY isnet-general-use model for everything
-            session = BackgroundRemover._get_object_session()
-            model_used = "isnet-general-use"
+            # Subject detection is cheap (thumbnail, cached) and always reported
+            subject = BackgroundRemover._detect_subject(input_image, image_hash)
 
-            print(f"[Model] Using isnet-general-use for all images")
+            # isnet-general-use is used for everything unless the caller asks
+            # for the human model or automatic routing
+            if model == "u2net_human_seg" or (model == "auto" and subject == "human"):
+                session = BackgroundRemover._get_human_session()
+                model_used = "u2net_human_seg"
+            else:
+                session = BackgroundRemover._get_object_session()
+                model_used = "isnet-general-use"
 
-            # Remove background with isnet-general-use model
-            output_image = remove(input_image, session=session)
+            print(f"[Model] Using {model_used} (subject: {subject})")
+
+            # Segment (or reuse the cached mask)
+            mask, _ = BackgroundRemover._get_mask(input_image, image_hash, session)
+
+            # Remove background with the selected model
+            output_image = BackgroundRemover._cut_out(input_image, mask)
 
             # Apply edge refinement if requested
             if edge_refinement > 0:
@@ -184,7 +436,9 @@ class BackgroundRemover:
                 "original_size": original_size,
                 "output_size": output_image.size,
                 "format": output_format,
-                "has_transparency": output_format in ["png", "webp"] and not background_color
+                "has_transparency": output_format in ["png", "webp"] and not background_color,
+                "subject": subject,
+                "model_used": model_used
             }
 
         except Exception as e:
@@ -199,9 +453,14 @@ class BackgroundRemover:
         # Apply slight blur to alpha channel to smooth edges
         alpha = img_array[:, :, 3]
 
-        # Use bilateral filter to preserve edges while smoothing
+        # Use bilateral filter to preserve edges while smoothing, only
+        # around the subject boundary
         kernel_size = min(level * 2 + 1, 9)
-        refined_alpha = cv2.bilateralFilter(alpha, kernel_size, 75, 75)
+        refined_alpha = BackgroundRemover._filter_edge_band(
+            alpha,
+            lambda tile: cv2.bilateralFilter(tile, kernel_size, 75, 75),
+            pad=kernel_size
+        )
 
         # Apply back to image
         img_array[:, :, 3] = refined_alpha
@@ -214,25 +473,27 @@ class BackgroundRemover:
         img_array = np.array(image)
         alpha = img_array[:, :, 3]
 
-        # Apply morphological operations to clean edges
-        # Erosion to remove small artifacts
-        kernel = np.ones((2, 2), np.uint8)
-        alpha_eroded = cv2.erode(alpha, kernel, iterations=1)
+        def clean(tile: np.ndarray) -> np.ndarray:
+            # Apply morphological operations to clean edges
+            # Erosion to remove small artifacts
+            kernel = np.ones((2, 2), np.uint8)
+            alpha_eroded = cv2.erode(tile, kernel, iterations=1)
 
-        # Dilation to restore proper edges
-        alpha_dilated = cv2.dilate(alpha_eroded, kernel, iterations=1)
+            # Dilation to restore proper edges
+            alpha_dilated = cv2.dilate(alpha_eroded, kernel, iterations=1)
 
-        # Apply Gaussian blur for smooth transition
-        alpha_smooth = cv2.GaussianBlur(alpha_dilated, (3, 3), 0)
+            # Apply Gaussian blur for smooth transition
+            alpha_smooth = cv2.GaussianBlur(alpha_dilated, (3, 3), 0)
 
-        # Threshold to remove semi-transparent artifacts
-        _, alpha_clean = cv2.threshold(alpha_smooth, 10, 255, cv2.THRESH_BINARY)
+            # Threshold to remove semi-transparent artifacts
+            _, alpha_clean = cv2.threshold(alpha_smooth, 10, 255, cv2.THRESH_BINARY)
 
-        # Apply bilateral filter to preserve edges while smoothing
-        alpha_final = cv2.bilateralFilter(alpha_clean, 5, 50, 50)
+            # Apply bilateral filter to preserve edges while smoothing
+            return cv2.bilateralFilter(alpha_clean, 5, 50, 50)
 
-        # Update alpha channel
-        img_array[:, :, 3] = alpha_final
+        # Only pixels around the subject boundary change; the erode/dilate,
+        # blur and bilateral steps reach at most 5 pixels
+        img_array[:, :, 3] = BackgroundRemover._filter_edge_band(alpha, clean, pad=5)
 
         return Image.fromarray(img_array)
 
@@ -268,15 +529,15 @@ class BackgroundRemover:
             output_format: Output format
         """
         try:
-            # Open and process
-            input_image = Image.open(input_path).convert("RGBA")
-
             # Use ONLY isnet-general-use model
             session = BackgroundRemover._get_object_session()
             print(f"[Model] Using isnet-general-use for blur background")
 
+            # Open and segment (or reuse the cached mask)
+            input_image, mask = BackgroundRemover._load_with_mask(input_path, session)
+
             # Remove background with isnet-general-use model
-            foreground = remove(input_image, session=session)
+            foreground = BackgroundRemover._cut_out(input_image, mask)
 
             # Extract alpha mask
             mask = foreground.split()[3]
@@ -320,14 +581,16 @@ class BackgroundRemover:
         """
         try:
             # Load foreground and remove background with isnet-general-use model
-            foreground_img = Image.open(foreground_path).convert("RGBA")
             session = BackgroundRemover._get_object_session()
             print(f"[Model] Using isnet-general-use for replace background")
-            foreground = remove(foreground_img, session=session)
+            foreground_img, mask = BackgroundRemover._load_with_mask(foreground_path, session)
+            foreground = BackgroundRemover._cut_out(foreground_img, mask)
 
-            # Load and resize background to match foreground
-            background = Image.open(background_path).convert("RGBA")
-            background = background.resize(foreground.size, Image.Resampling.LANCZOS)
+            # Load and resize background to match foreground, decoding large
+            # JPEG backgrounds at reduced resolution
+            background = Image.open(background_path)
+            draft_for_size(background, foreground.size, respect_exif=False)
+            background = resize_image(background.convert("RGBA"), foreground.size)
 
             # Extract alpha mask
             mask = foreground.split()[3]
@@ -357,7 +620,9 @@ class BackgroundRemover:
         gradient_type: Literal["linear", "radial"] = "linear",
         color_start: Tuple[int, int, int] = (138, 43, 226),  # Purple
         color_end: Tuple[int, int, int] = (75, 0, 130),  # Indigo
-        output_format: str = "png"
+        output_format: str = "png",
+        angle: Optional[float] = None,
+        color_stops: Optional[List[Tuple[float, Tuple[int, int, int]]]] = None
     ) -> dict:
         """
         Add gradient background to image
@@ -369,18 +634,21 @@ class BackgroundRemover:
             color_start: RGB start color
             color_end: RGB end color
             output_format: Output format
+            angle: Linear gradient angle in degrees (default 180, top to bottom)
+            color_stops: Optional (position, RGB) stops, overrides start/end colors
         """
         try:
             # Remove background with isnet-general-use model
-            input_image = Image.open(input_path).convert("RGBA")
             session = BackgroundRemover._get_object_session()
             print(f"[Model] Using isnet-general-use for gradient background")
-            foreground = remove(input_image, session=session)
+            input_image, mask = BackgroundRemover._load_with_mask(input_path, session)
+            foreground = BackgroundRemover._cut_out(input_image, mask)
 
             # Create gradient background
             width, height = foreground.size
             gradient = BackgroundRemover._create_gradient(
-                width, height, gradient_type, color_start, color_end
+                width, height, gradient_type, color_start, color_end,
+                angle=angle, color_stops=color_stops
             )
 
             # Composite
@@ -408,34 +676,75 @@ class BackgroundRemover:
         height: int,
         gradient_type: str,
         color_start: Tuple[int, int, int],
-        color_end: Tuple[int, int, int]
+        color_end: Tuple[int, int, int],
+        angle: Optional[float] = None,
+        color_stops: Optional[List[Tuple[float, Tuple[int, int, int]]]] = None
     ) -> Image.Image:
-        """Create gradient image"""
-        gradient = Image.new("RGBA", (width, height))
-        pixels = gradient.load()
+        """
+        Create gradient image (cached per size, colors and type)
 
+        Args:
+            width, height: Gradient size
+            gradient_type: "linear" or "radial"
+            color_start, color_end: RGB colors used when no color_stops are given
+            angle: Linear gradient direction in degrees, CSS style
+                   (0 = bottom to top, 90 = left to right, 180 = top to bottom)
+            color_stops: Optional list of (position 0-1, RGB) for multi-stop gradients
+
+        The returned image is shared with the cache and must not be modified.
+        """
+        stops = tuple(sorted(
+            (float(position), tuple(color))
+            for position, color in (color_stops or [(0.0, color_start), (1.0, color_end)])
+        ))
         if gradient_type == "linear":
-            # Vertical linear gradient
-            for y in range(height):
-                ratio = y / height
-                r = int(color_start[0] * (1 - ratio) + color_end[0] * ratio)
-                g = int(color_start[1] * (1 - ratio) + color_end[1] * ratio)
-                b = int(color_start[2] * (1 - ratio) + color_end[2] * ratio)
-                for x in range(width):
-                    pixels[x, y] = (r, g, b, 255)
+            angle = 180.0 if angle is None else float(angle) % 360
         else:
-            # Radial gradient
-            center_x, center_y = width // 2, height // 2
-            max_distance = np.sqrt(center_x**2 + center_y**2)
+            angle = None
 
-            for y in range(height):
-                for x in range(width):
-                    distance = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-                    ratio = min(distance / max_distance, 1.0)
-                    r = int(color_start[0] * (1 - ratio) + color_end[0] * ratio)
-                    g = int(color_start[1] * (1 - ratio) + color_end[1] * ratio)
-                    b = int(color_start[2] * (1 - ratio) + color_end[2] * ratio)
-                    pixels[x, y] = (r, g, b, 255)
+        key = (width, height, gradient_type, angle, stops)
+        cache = BackgroundRemover._gradient_cache
+        with BackgroundRemover._gradient_lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+
+        # Position of every pixel along the gradient (0-1), built by broadcasting
+        # a row vector of x against a column vector of y
+        x = np.arange(width, dtype=np.float32)[np.newaxis, :]
+        y = np.arange(height, dtype=np.float32)[:, np.newaxis]
+
+        if gradient_type == "linear":
+            radians = np.deg2rad(angle)
+            dx, dy = np.sin(radians), -np.cos(radians)
+            # Length of the gradient line so both corners map to 0 and 1
+            length = abs(width * dx) + abs(height * dy)
+            t = ((x - width / 2) * dx + (y - height / 2) * dy) / length + 0.5
+        else:
+            center_x, center_y = width // 2, height // 2
+            max_distance = max(np.sqrt(center_x**2 + center_y**2), 1.0)
+            t = np.hypot(x - center_x, y - center_y) / max_distance
+
+        # Map positions through a color lookup table instead of interpolating
+        # every pixel
+        lut_positions = np.linspace(0.0, 1.0, BackgroundRemover.GRADIENT_LUT_SIZE)
+        positions = [stop[0] for stop in stops]
+        lut = np.stack([
+            np.interp(lut_positions, positions, [stop[1][channel] for stop in stops])
+            for channel in range(3)
+        ], axis=1).astype(np.uint8)
+        lut = np.concatenate([lut, np.full((len(lut), 1), 255, dtype=np.uint8)], axis=1)
+
+        indices = np.clip(t, 0.0, 1.0)
+        indices *= BackgroundRemover.GRADIENT_LUT_SIZE - 1
+        gradient = Image.fromarray(lut[indices.astype(np.uint16)], "RGBA")
+
+        with BackgroundRemover._gradient_lock:
+            cache[key] = gradient
+            cache_bytes = sum(img.width * img.height * 4 for img in cache.values())
+            while len(cache) > 1 and cache_bytes > BackgroundRemover.GRADIENT_CACHE_MAX_BYTES:
+                _, evicted = cache.popitem(last=False)
+                cache_bytes -= evicted.width * evicted.height * 4
 
         return gradient
 
@@ -456,30 +765,32 @@ class BackgroundRemover:
         Returns:
             List of processing results
         """
-        results = []
+        import os
+        from concurrent.futures import ThreadPoolExecutor
 
-        for i, input_path in enumerate(input_paths):
+        def process(index: int, input_path: str) -> dict:
+            filename = os.path.basename(input_path)
             try:
-                import os
-                filename = os.path.basename(input_path)
                 output_path = os.path.join(output_dir, f"nobg_{filename}")
-
                 result = BackgroundRemover.remove_background(
                     input_path,
                     output_path,
                     **kwargs
                 )
-                result["index"] = i
+                result["index"] = index
                 result["filename"] = filename
-                results.append(result)
-
+                return result
             except Exception as e:
-                results.append({
-                    "index": i,
-                    "filename": os.path.basename(input_path),
+                return {
+                    "index": index,
+                    "filename": filename,
                     "success": False,
                     "error": str(e)
-                })
+                }
+
+        # Images run concurrently so the inference scheduler can batch them
+        with ThreadPoolExecutor(max_workers=BackgroundRemover.BATCH_CONCURRENCY) as executor:
+            results = list(executor.map(process, range(len(input_paths)), input_paths))
 
         return results
 
@@ -488,7 +799,8 @@ class BackgroundRemover:
         input_path: str,
         output_path: str,
         size: Literal["small", "medium", "original"] = "original",
-        maintain_aspect: bool = True
+        maintain_aspect: bool = True,
+        cut_out: bool = False
     ) -> dict:
         """
         Resize processed image to different sizes
@@ -498,9 +810,15 @@ class BackgroundRemover:
             output_path: Path to save resized image
             size: Size preset
             maintain_aspect: Maintain aspect ratio
+            cut_out: Remove the background first (reuses the cached mask)
         """
         try:
-            image = Image.open(input_path)
+            if cut_out:
+                session = BackgroundRemover._get_object_session()
+                input_image, mask = BackgroundRemover._load_with_mask(input_path, session)
+                image = BackgroundRemover._cut_out(input_image, mask)
+            else:
+                image = Image.open(input_path)
             original_size = image.size
 
             # Define size presets
@@ -512,11 +830,16 @@ class BackgroundRemover:
 
             target_size = size_map.get(size, original_size)
 
-            if size != "original" and maintain_aspect:
-                # Calculate aspect ratio
-                image.thumbnail(target_size, Image.Resampling.LANCZOS)
-            elif size != "original":
-                image = image.resize(target_size, Image.Resampling.LANCZOS)
+            if size != "original":
+                if maintain_aspect:
+                    # Fit within the preset box, never upscaling (same as thumbnail)
+                    target_size = fit_dimensions(original_size, *target_size)
+                    if target_size[0] > original_size[0] or target_size[1] > original_size[1]:
+                        target_size = original_size
+
+                # Decode JPEGs at reduced resolution before the final resize
+                draft_for_size(image, target_size, respect_exif=False)
+                image = resize_image(image, target_size)
 
             # Save
             image.save(output_path, quality=95, optimize=True)
@@ -4,6 +4,9 @@ from PIL import Image, ImageOps
 import io
 from typing import Optional, Dict, Any, Tuple
 
+from utils.image_helpers import fit_dimensions, draft_for_size, is_exif_transposed, resize_image
+from converters.large_image_processor import get_large_image_info, shrink_large_image, convert_large_image
+
 class ImageCompressor:
     """Advanced image compression with quality control and format conversion"""
 
@@ -48,6 +51,16 @@ class ImageCompressor:
             Dict with compression results
         """
         try:
+            # Very large images are handled band by band when possible
+            large_info = get_large_image_info(input_path)
+            if large_info:
+                result = await self._compress_large_image(
+                    input_path, output_path, large_info, quality, format,
+                    width, height, maintain_aspect_ratio, optimize, progressive
+                )
+                if result is not None:
+                    return result
+
             # Open and process image
             with Image.open(input_path) as img:
                 # Get original info
@@ -55,6 +68,17 @@ class ImageCompressor:
                 original_width, original_height = img.size
                 original_format = img.format or 'UNKNOWN'
 
+                # Work out the final size before decoding so large JPEGs can be
+                # decoded at reduced resolution instead of full size
+                target_size = None
+                if width or height:
+                    display_size = (
+                        (original_height, original_width) if is_exif_transposed(img)
+                        else (original_width, original_height)
+                    )
+                    target_size = fit_dimensions(display_size, width, height, maintain_aspect_ratio)
+                    draft_for_size(img, target_size)
+
                 # Handle EXIF orientation
                 img = ImageOps.exif_transpose(img)
 
@@ -62,10 +86,8 @@ class ImageCompressor:
                 processed_img = await self._prepare_image_for_format(img, format)
 
                 # Resize if dimensions specified
-                if width or height:
-                    processed_img = await self._resize_image(
-                        processed_img, width, height, maintain_aspect_ratio
-                    )
+                if target_size:
+                    processed_img = await self._resize_image(processed_img, target_size)
 
                 # Validate and adjust quality
                 quality = self._validate_quality(quality, format)
@@ -104,6 +126,69 @@ class ImageCompressor:
                 'error': str(e)
             }
 
+    async def _compress_large_image(
+        self,
+        input_path: str,
+        output_path: str,
+        info: Dict[str, Any],
+        quality: int,
+        format: str,
+        width: Optional[int],
+        height: Optional[int],
+        maintain_aspect_ratio: bool,
+        optimize: bool,
+        progressive: bool
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Compress an image above LARGE_IMAGE_PIXELS without a full decode
+
+        Resizes are band-reduced (or drafted for JPEG) before the regular
+        encode; full-size PNG output is re-encoded band by band. Returns None
+        when neither applies so the caller can use the regular path.
+        """
+        original_size = os.path.getsize(input_path)
+        quality = self._validate_quality(quality, format)
+        loop = asyncio.get_running_loop()
+
+        if width or height:
+            target_size = fit_dimensions((info['width'], info['height']), width, height, maintain_aspect_ratio)
+            if not info['streamable'] and info['format'] != 'JPEG':
+                return None
+
+            img = await loop.run_in_executor(None, shrink_large_image, input_path, info, target_size)
+            processed_img = await self._prepare_image_for_format(img, format)
+            await self._save_compressed_image(
+                processed_img, output_path, format, quality, optimize, progressive
+            )
+            final_width, final_height = processed_img.size
+        elif format == 'png' and info['streamable']:
+            result = await loop.run_in_executor(
+                None, convert_large_image, input_path, output_path, 'png', info, quality
+            )
+            if not result['success']:
+                return {'success': False, 'error': result['error']}
+            final_width, final_height = info['width'], info['height']
+        else:
+            return None
+
+        compressed_size = os.path.getsize(output_path)
+        compression_ratio = ((original_size - compressed_size) / original_size) * 100
+
+        return {
+            'success': True,
+            'original_size': original_size,
+            'compressed_size': compressed_size,
+            'compression_ratio': round(compression_ratio, 2),
+            'size_reduction': original_size - compressed_size,
+            'original_dimensions': {'width': info['width'], 'height': info['height']},
+            'final_dimensions': {'width': final_width, 'height': final_height},
+            'original_format': info['format'],
+            'output_format': format.upper(),
+            'quality_used': quality,
+            'optimized': optimize,
+            'progressive': progressive if format == 'jpeg' else None
+        }
+
     async def _prepare_image_for_format(self, img: Image.Image, format: str) -> Image.Image:
         """Prepare image for specific output format"""
         format = format.lower()
@@ -136,42 +221,10 @@ class ImageCompressor:
     async def _resize_image(
         self,
         img: Image.Image,
-        width: Optional[int],
-        height: Optional[int],
-        maintain_aspect_ratio: bool
+        target_size: Tuple[int, int]
     ) -> Image.Image:
-        """Resize image with optional aspect ratio maintenance"""
-        original_width, original_height = img.size
-
-        if maintain_aspect_ratio:
-            # Calculate new dimensions maintaining aspect ratio
-            if width and height:
-                # Use the smaller ratio to fit within bounds
-                width_ratio = width / original_width
-                height_ratio = height / original_height
-                ratio = min(width_ratio, height_ratio)
-                new_width = int(original_width * ratio)
-                new_height = int(original_height * ratio)
-            elif width:
-                ratio = width / original_width
-                new_width = width
-                new_height = int(original_height * ratio)
-            elif height:
-                ratio = height / original_height
-                new_width = int(original_width * ratio)
-                new_height = height
-            else:
-                return img
-        else:
-            # Use exact dimensions (may distort image)
-            new_width = width or original_width
-            new_height = height or original_height
-
-        # Ensure minimum size
-        new_width = max(1, new_width)
-        new_height = max(1, new_height)
-
-        return img.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        """Resize image to the dimensions calculated by fit_dimensions"""
+        return resize_image(img, target_size)
 
     def _validate_quality(self, quality: int, format: str) -> int:
         """Validate and adjust quality value for format"""
@@ -222,6 +275,19 @@ class ImageCompressor:
     def get_image_info(self, image_path: str) -> Dict[str, Any]:
         """Get detailed information about an image file"""
         try:
+            # Read large images from the header only
+            large_info = get_large_image_info(image_path)
+            if large_info:
+                return {
+                    'width': large_info['width'],
+                    'height': large_info['height'],
+                    'format': large_info['format'],
+                    'mode': {1: 'L', 2: 'LA', 3: 'RGB', 4: 'RGBA'}.get(large_info['channels']),
+                    'file_size': os.path.getsize(image_path),
+                    'has_transparency': large_info['channels'] in (2, 4),
+                    'is_animated': False
+                }
+
             with Image.open(image_path) as img:
                 file_size = os.path.getsize(image_path)
 
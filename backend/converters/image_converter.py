@@ -3,187 +3,235 @@ from utils.dependencies import PIL_AVAILABLE, PDF2IMAGE_AVAILABLE, POPPLER_PATH
 import os
 import base64
 import io
-from typing import Optional, TYPE_CHECKING
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Optional, List, Dict, AsyncIterator, TYPE_CHECKING
+
+from utils.config import IMAGE_BATCH_WORKERS, IMAGE_VARIANT_QUALITY
+from utils.helpers import generate_unique_filename
+from utils.image_helpers import draft_for_size, fit_dimensions, is_exif_transposed, resize_image
+from converters.large_image_processor import get_large_image_info, convert_large_image
+from converters.animated_image_converter import ANIMATED_OUTPUT_FORMATS, convert_animation_sync
 
 if TYPE_CHECKING:
     from PIL import Image as PILImage
 
-async def convert_image(input_path: str, output_path: str, target_format: str) -> bool:
-    """Convert image from one format to another, including PDF input"""
-    if not PIL_AVAILABLE:
-        print("PIL/Pillow not available")
-        return False
+# Icon sizes embedded in ICO output
+ICO_SIZES = [(16, 16), (32, 32), (48, 48)]
 
-    try:
-        from PIL import Image
+def load_source_image(input_path: str) -> Optional['PILImage.Image']:
+    """
+    Open any supported input (raster, PDF, SVG, HEIC, PSD, AI) as a PIL image
 
-        # Register AVIF and HEIF plugins at the start
-        try:
-            import pillow_avif
-            print("AVIF plugin loaded")
-        except ImportError:
-            print("AVIF plugin not available")
+    Returns None when the input cannot be handled and raises with a helpful
+    message for formats that need extra system software. Standard raster
+    formats are opened lazily, so callers can still request reduced decoding.
+    """
+    from PIL import Image
 
-        try:
-            import pillow_heif
-            pillow_heif.register_heif_opener()
-            print("HEIF plugin registered")
-        except ImportError:
-            print("HEIF plugin not available")
+    # Register AVIF and HEIF plugins at the start
+    try:
+        import pillow_avif
+        print("AVIF plugin loaded")
+    except ImportError:
+        print("AVIF plugin not available")
+
+    try:
+        import pillow_heif
+        pillow_heif.register_heif_opener()
+        print("HEIF plugin registered")
+    except ImportError:
+        print("HEIF plugin not available")
+    
+    # Handle PDF input (requires pdf2image)
+    if input_path.lower().endswith('.pdf'):
+        if not PDF2IMAGE_AVAILABLE:
+            print("pdf2image not available - PDF conversion not supported")
+            return None
         
-        # Handle PDF input (requires pdf2image)
-        if input_path.lower().endswith('.pdf'):
-            if not PDF2IMAGE_AVAILABLE:
-                print("pdf2image not available - PDF conversion not supported")
-                return False
+        try:
+            from pdf2image import convert_from_path
+            
+            # Convert PDF to images
+            convert_kwargs = {
+                'dpi': 300,
+                'fmt': 'png'  # Always convert to PNG first for processing
+            }
+            
+            if POPPLER_PATH:
+                convert_kwargs['poppler_path'] = POPPLER_PATH
             
             try:
-                from pdf2image import convert_from_path
-                
-                # Convert PDF to images
-                convert_kwargs = {
-                    'dpi': 300,
-                    'fmt': 'png'  # Always convert to PNG first for processing
-                }
-                
+                images = convert_from_path(input_path, **convert_kwargs)
+            except Exception as e:
+                print(f"PDF conversion failed with poppler path: {e}")
+                # Try without poppler path
                 if POPPLER_PATH:
-                    convert_kwargs['poppler_path'] = POPPLER_PATH
-                
-                try:
+                    convert_kwargs.pop('poppler_path', None)
                     images = convert_from_path(input_path, **convert_kwargs)
-                except Exception as e:
-                    print(f"PDF conversion failed with poppler path: {e}")
-                    # Try without poppler path
-                    if POPPLER_PATH:
-                        convert_kwargs.pop('poppler_path', None)
-                        images = convert_from_path(input_path, **convert_kwargs)
-                    else:
-                        raise e
-                
-                if not images:
-                    print("No images generated from PDF")
-                    return False
-                
-                # Use the first page
-                img = images[0]
-                print(f"Converted PDF to image: {img.size} pixels")
-                
-            except ImportError:
-                print("pdf2image not installed - PDF conversion not available")
-                return False
-            except Exception as e:
-                print(f"PDF processing error: {e}")
-                return False
-        
-        # Handle SVG input - Use multiple fallback methods
-        elif input_path.lower().endswith('.svg'):
-            print(f"Converting SVG file: {input_path}")
+                else:
+                    raise e
+            
+            if not images:
+                print("No images generated from PDF")
+                return None
+            
+            # Use the first page
+            img = images[0]
+            print(f"Converted PDF to image: {img.size} pixels")
+            
+        except ImportError:
+            print("pdf2image not installed - PDF conversion not available")
+            return None
+        except Exception as e:
+            print(f"PDF processing error: {e}")
+            return None
+    
+    # Handle SVG input - Use multiple fallback methods
+    elif input_path.lower().endswith('.svg'):
+        print(f"Converting SVG file: {input_path}")
+
+        svg_converted = False
+
+        # Method 1: Try using Wand (ImageMagick wrapper) - most reliable if ImageMagick is installed
+        try:
+            from wand.image import Image as WandImage
+
+            print("Trying Wand/ImageMagick for SVG conversion...")
+            with WandImage(filename=input_path, resolution=300) as wand_img:
+                # Convert to PNG
+                wand_img.format = 'png'
+                wand_img.background_color = 'white'
+                wand_img.alpha_channel = 'remove'
+
+                # Get the image data
+                png_blob = wand_img.make_blob('png')
 
-            svg_converted = False
+                # Load with PIL
+                from io import BytesIO
+                img = Image.open(BytesIO(png_blob))
+                img.load()
 
-            # Method 1: Try using Wand (ImageMagick wrapper) - most reliable if ImageMagick is installed
+                print(f"[OK] SVG converted using Wand: {img.size} pixels")
+                svg_converted = True
+
+        except (ImportError, Exception) as e:
+            print(f"Wand/ImageMagick not available or failed: {e}")
+
+        # Method 2: Try CairoSVG if Cairo DLLs are available
+        if not svg_converted:
             try:
-                from wand.image import Image as WandImage
+                import cairosvg
+                import tempfile
+                from io import BytesIO
 
-                print("Trying Wand/ImageMagick for SVG conversion...")
-                with WandImage(filename=input_path, resolution=300) as wand_img:
-                    # Convert to PNG
-                    wand_img.format = 'png'
-                    wand_img.background_color = 'white'
-                    wand_img.alpha_channel = 'remove'
+                print("Trying CairoSVG for SVG conversion...")
 
-                    # Get the image data
-                    png_blob = wand_img.make_blob('png')
+                # Convert SVG to PNG bytes
+                png_data = cairosvg.svg2png(url=input_path, dpi=300)
 
-                    # Load with PIL
-                    from io import BytesIO
-                    img = Image.open(BytesIO(png_blob))
-                    img.load()
+                # Load with PIL
+                img = Image.open(BytesIO(png_data))
+                img.load()
 
-                    print(f"[OK] SVG converted using Wand: {img.size} pixels")
-                    svg_converted = True
+                print(f"[OK] SVG converted using CairoSVG: {img.size} pixels")
+                svg_converted = True
 
             except (ImportError, Exception) as e:
-                print(f"Wand/ImageMagick not available or failed: {e}")
+                print(f"CairoSVG not available or failed: {e}")
 
-            # Method 2: Try CairoSVG if Cairo DLLs are available
-            if not svg_converted:
-                try:
-                    import cairosvg
-                    import tempfile
-                    from io import BytesIO
+        # Method 3: Fallback - Return error message as SVG conversion requires system libraries
+        if not svg_converted:
+            print("ERROR: SVG conversion failed - no suitable library available")
+            print("SVG conversion requires either:")
+            print("  1. ImageMagick (https://imagemagick.org/script/download.php)")
+            print("  2. Cairo DLL (GTK runtime for Windows)")
+            raise Exception("SVG conversion requires ImageMagick or Cairo to be installed on the system. Please install ImageMagick and try again.")
+    
+    # Handle HEIC input (requires pillow-heif)
+    elif input_path.lower().endswith('.heic'):
+        try:
+            from pillow_heif import register_heif_opener
+            register_heif_opener()
+            img = Image.open(input_path)
+        except ImportError:
+            print("pillow-heif not installed - HEIC conversion not available")
+            return None
+    
+    # Handle PSD input (basic support with psd-tools)
+    elif input_path.lower().endswith('.psd'):
+        try:
+            from psd_tools import PSDImage
+            psd = PSDImage.open(input_path)
+            img = psd.composite()
+            if img is None:
+                print("Could not extract image from PSD file")
+                return None
+        except ImportError:
+            print("psd-tools not installed - PSD conversion not available")
+            return None
+    
+    # Handle AI input (Adobe Illustrator - very limited support)
+    elif input_path.lower().endswith('.ai'):
+        try:
+            # AI files are complex vector files that PIL cannot handle properly
+            # Try basic PIL support (works only for very simple AI files)
+            img = Image.open(input_path)
+            print("AI file opened with basic PIL support")
+        except Exception as e:
+            print(f"AI file conversion failed: {e}")
+            # Return False with a specific error message that will be caught
+            raise Exception("AI files contain complex vector data that requires specialized software. For best results: 1) Open in Adobe Illustrator and export as PNG/JPG, 2) Use Inkscape (free) to convert AI files, 3) Try online converters with proper Adobe support, or 4) Convert to SVG first if the file is simple.")
+    
+    # Handle standard image formats
+    else:
+        try:
+            img = Image.open(input_path)
+        except Exception as e:
+            print(f"Failed to open image {input_path}: {e}")
+            return None
 
-                    print("Trying CairoSVG for SVG conversion...")
+    return img
 
-                    # Convert SVG to PNG bytes
-                    png_data = cairosvg.svg2png(url=input_path, dpi=300)
+async def convert_image(input_path: str, output_path: str, target_format: str) -> bool:
+    """Convert image from one format to another, including PDF input"""
+    if not PIL_AVAILABLE:
+        print("PIL/Pillow not available")
+        return False
 
-                    # Load with PIL
-                    img = Image.open(BytesIO(png_data))
-                    img.load()
+    try:
+        from PIL import Image
 
-                    print(f"[OK] SVG converted using CairoSVG: {img.size} pixels")
-                    svg_converted = True
+        # Animated inputs are converted frame by frame; returns False for
+        # still images, which continue through the normal path
+        if target_format.lower() in ANIMATED_OUTPUT_FORMATS:
+            loop = asyncio.get_running_loop()
+            if await loop.run_in_executor(None, convert_animation_sync, input_path, output_path, target_format):
+                return True
 
-                except (ImportError, Exception) as e:
-                    print(f"CairoSVG not available or failed: {e}")
+        # Very large TIFF/PNG inputs are converted band by band instead of
+        # being decoded whole
+        if target_format.lower() in ('tiff', 'tif', 'png'):
+            large_info = get_large_image_info(input_path)
+            if large_info and large_info['streamable']:
+                result = convert_large_image(input_path, output_path, target_format, large_info)
+                return result['success']
 
-            # Method 3: Fallback - Return error message as SVG conversion requires system libraries
-            if not svg_converted:
-                print("ERROR: SVG conversion failed - no suitable library available")
-                print("SVG conversion requires either:")
-                print("  1. ImageMagick (https://imagemagick.org/script/download.php)")
-                print("  2. Cairo DLL (GTK runtime for Windows)")
-                raise Exception("SVG conversion requires ImageMagick or Cairo to be installed on the system. Please install ImageMagick and try again.")
-        
-        # Handle HEIC input (requires pillow-heif)
-        elif input_path.lower().endswith('.heic'):
-            try:
-                from pillow_heif import register_heif_opener
-                register_heif_opener()
-                img = Image.open(input_path)
-            except ImportError:
-                print("pillow-heif not installed - HEIC conversion not available")
-                return False
-        
-        # Handle PSD input (basic support with psd-tools)
-        elif input_path.lower().endswith('.psd'):
-            try:
-                from psd_tools import PSDImage
-                psd = PSDImage.open(input_path)
-                img = psd.composite()
-                if img is None:
-                    print("Could not extract image from PSD file")
-                    return False
-            except ImportError:
-                print("psd-tools not installed - PSD conversion not available")
-                return False
-        
-        # Handle AI input (Adobe Illustrator - very limited support)
-        elif input_path.lower().endswith('.ai'):
-            try:
-                # AI files are complex vector files that PIL cannot handle properly
-                # Try basic PIL support (works only for very simple AI files)
-                img = Image.open(input_path)
-                print("AI file opened with basic PIL support")
-            except Exception as e:
-                print(f"AI file conversion failed: {e}")
-                # Return False with a specific error message that will be caught
-                raise Exception("AI files contain complex vector data that requires specialized software. For best results: 1) Open in Adobe Illustrator and export as PNG/JPG, 2) Use Inkscape (free) to convert AI files, 3) Try online converters with proper Adobe support, or 4) Convert to SVG first if the file is simple.")
-        
-        # Handle standard image formats
-        else:
-            try:
-                img = Image.open(input_path)
-            except Exception as e:
-                print(f"Failed to open image {input_path}: {e}")
-                return False
+        img = load_source_image(input_path)
+        if img is None:
+            return False
+
+        # ICO output only needs small icon sizes, so large JPEGs can be
+        # decoded at reduced resolution
+        if target_format.lower() == 'ico':
+            draft_for_size(img, max(ICO_SIZES), respect_exif=False)
         
         # Format mapping
         format_mapping = {
             'jpg': 'JPEG',
             'jpeg': 'JPEG',
             'png': 'PNG',
+            'apng': 'PNG',
             'webp': 'WEBP',
             'avif': 'AVIF',
             'gif': 'GIF',
@@ -247,8 +295,7 @@ async def convert_image(input_path: str, output_path: str, target_format: str) -
                 print("Warning: HEIC support requires pillow-heif")
                 return False
         elif output_format == 'ICO':
-            sizes = [(16, 16), (32, 32), (48, 48)]
-            save_kwargs = {'sizes': sizes}
+            save_kwargs = {'sizes': ICO_SIZES}
         elif output_format == 'TIFF':
             save_kwargs = {'compression': 'lzw'}
         elif output_format == 'GIF':
@@ -268,6 +315,205 @@ async def convert_image(input_path: str, output_path: str, target_format: str) -
         print(f"Image conversion error: {e}")
         return False
 
+def convert_image_sync(input_path: str, output_path: str, target_format: str) -> dict:
+    """Blocking convert_image wrapper used as the process pool entry point"""
+    try:
+        success = asyncio.run(convert_image(input_path, output_path, target_format))
+        return {
+            "success": success,
+            "error": None if success else "Image conversion failed"
+        }
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+# Shared process pool for batch conversions (created on first use)
+_batch_pool = None
+
+def _get_batch_pool() -> ProcessPoolExecutor:
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(max_workers=IMAGE_BATCH_WORKERS)
+        print(f"Started image batch pool with {IMAGE_BATCH_WORKERS} workers")
+    return _batch_pool
+
+async def batch_convert_images(jobs: List[Dict[str, str]], target_format: str) -> AsyncIterator[dict]:
+    """
+    Convert many images in parallel across the process pool
+
+    Each job is a dict with at least 'input_path' and 'output_path'; extra
+    keys are passed through. Results are yielded as soon as each image
+    finishes, not in submission order.
+    """
+    loop = asyncio.get_running_loop()
+    pool = _get_batch_pool()
+
+    async def run_job(job: Dict[str, str]) -> dict:
+        global _batch_pool
+        try:
+            result = await loop.run_in_executor(
+                pool, convert_image_sync, job['input_path'], job['output_path'], target_format
+            )
+        except Exception as e:
+            # A crashed worker breaks the whole pool - shut it down (cancelling
+            # queued jobs) and replace it for the next batch
+            print(f"Batch worker error for {job['input_path']}: {e}")
+            pool.shutdown(wait=False, cancel_futures=True)
+            if _batch_pool is pool:
+                _batch_pool = None
+            result = {"success": False, "error": str(e)}
+        return {**job, **result}
+
+    tasks = [asyncio.ensure_future(run_job(job)) for job in jobs]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Web formats available for responsive variants
+VARIANT_FORMATS = {
+    'webp': {'pil_format': 'WEBP', 'extension': 'webp', 'mime_type': 'image/webp'},
+    'avif': {'pil_format': 'AVIF', 'extension': 'avif', 'mime_type': 'image/avif'},
+    'jpg': {'pil_format': 'JPEG', 'extension': 'jpg', 'mime_type': 'image/jpeg'},
+    'jpeg': {'pil_format': 'JPEG', 'extension': 'jpg', 'mime_type': 'image/jpeg'},
+    'png': {'pil_format': 'PNG', 'extension': 'png', 'mime_type': 'image/png'},
+}
+
+# Threads are enough for variant encoding - Pillow releases the GIL while
+# resizing and encoding
+_variant_pool = ThreadPoolExecutor(max_workers=IMAGE_BATCH_WORKERS)
+
+def _encode_variant(img: 'PILImage.Image', output_path: str, variant_format: str, quality: int) -> int:
+    """Encode one variant and return the output size in bytes"""
+    from PIL import Image
+
+    pil_format = VARIANT_FORMATS[variant_format]['pil_format']
+    save_kwargs = {}
+
+    if pil_format == 'JPEG':
+        if img.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            img = background
+        save_kwargs = {'quality': quality, 'optimize': True, 'progressive': True}
+    elif pil_format == 'WEBP':
+        save_kwargs = {'quality': quality, 'method': 4}
+    elif pil_format == 'AVIF':
+        try:
+            import pillow_avif
+        except ImportError:
+            pass
+        save_kwargs = {'quality': quality}
+    elif pil_format == 'PNG':
+        save_kwargs = {'optimize': True}
+
+    img.save(output_path, format=pil_format, **save_kwargs)
+    return os.path.getsize(output_path)
+
+async def generate_image_variants(
+    input_path: str,
+    output_dir: str,
+    base_name: str,
+    widths: List[int],
+    formats: List[str],
+    quality: int = IMAGE_VARIANT_QUALITY
+) -> dict:
+    """
+    Generate a widths x formats matrix of web variants from a single decode
+
+    The source is decoded once (at reduced resolution for JPEGs when the
+    largest width allows it), each width is resized once from that decode
+    and shared by all formats, and the resizes and encodes run in parallel. Widths larger than the source
+    are skipped rather than upscaled. Returns the variants plus a srcset
+    string per format.
+    """
+    if not PIL_AVAILABLE:
+        return {'success': False, 'error': 'PIL/Pillow not available'}
+
+    try:
+        from PIL import ImageOps
+
+        img = load_source_image(input_path)
+        if img is None:
+            return {'success': False, 'error': 'Could not open source image'}
+
+        # Decode once, just large enough for the biggest variant
+        display_size = (img.height, img.width) if is_exif_transposed(img) else img.size
+        largest = min(max(widths), display_size[0])
+        draft_for_size(img, fit_dimensions(display_size, width=largest))
+
+        img = ImageOps.exif_transpose(img)
+        has_alpha = img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        source_width, source_height = display_size
+
+        # Never upscale; fall back to the source width if every width is too big
+        target_widths = sorted({w for w in widths if w <= source_width}) or [source_width]
+
+        loop = asyncio.get_running_loop()
+
+        # Resize every width from the decoded source, in parallel: chaining
+        # resizes through smaller images would compound their resampling blur
+        resized_images = await asyncio.gather(*[
+            loop.run_in_executor(
+                _variant_pool, resize_image, img,
+                fit_dimensions((source_width, source_height), width=width)
+            )
+            for width in target_widths
+        ])
+        resized = dict(zip(target_widths, resized_images))
+
+        jobs = []
+        for width in target_widths:
+            for variant_format in formats:
+                extension = VARIANT_FORMATS[variant_format]['extension']
+                filename = generate_unique_filename(f"{base_name}_{width}w.{extension}")
+                jobs.append((width, variant_format, filename))
+
+        sizes = await asyncio.gather(*[
+            loop.run_in_executor(
+                _variant_pool, _encode_variant, resized[width],
+                os.path.join(output_dir, filename), variant_format, quality
+            )
+            for width, variant_format, filename in jobs
+        ], return_exceptions=True)
+
+        variants = []
+        errors = []
+        for (width, variant_format, filename), size in zip(jobs, sizes):
+            if isinstance(size, Exception):
+                errors.append({'width': width, 'format': variant_format, 'error': str(size)})
+                continue
+            variant_width, variant_height = resized[width].size
+            variants.append({
+                'width': variant_width,
+                'height': variant_height,
+                'format': VARIANT_FORMATS[variant_format]['extension'],
+                'mime_type': VARIANT_FORMATS[variant_format]['mime_type'],
+                'filename': filename,
+                'size': size,
+                'download_url': f"/download/{filename}"
+            })
+
+        # srcset per format, ordered by width
+        srcset = {}
+        for variant in sorted(variants, key=lambda v: v['width']):
+            entry = f"{variant['download_url']} {variant['width']}w"
+            srcset.setdefault(variant['format'], []).append(entry)
+
+        return {
+            'success': bool(variants),
+            'source_dimensions': {'width': source_width, 'height': source_height},
+            'variants': variants,
+            'srcset': {fmt: ', '.join(entries) for fmt, entries in srcset.items()},
+            'errors': errors
+        }
+
+    except Exception as e:
+        print(f"Image variant generation error: {e}")
+        return {'success': False, 'error': str(e)}
+
 async def create_svg_from_image(img: 'PILImage.Image', output_path: str) -> bool:
     """Create an SVG file that embeds the raster image as base64 data"""
     try:
@@ -0,0 +1,431 @@
+# converters/large_image_processor.py - Bounded-memory processing for very large raster images
+"""
+Very large scans and panoramas (hundreds of megapixels) do not fit the normal
+"decode everything, then process" flow: a single RGB decode of a 500 MP TIFF
+needs 1.5 GB and trips Pillow's decompression-bomb guard. This module reads
+such images in horizontal bands instead:
+
+- TIFF: strips/tiles are decoded one tile row at a time with tifffile
+- PNG: rows are streamed with pypng
+- JPEG: decoded at 1/2-1/8 scale in the DCT domain (Pillow draft mode)
+
+Bands can be written straight back out as tiled TIFF or PNG (full-resolution
+conversion/recompression) or box-reduced on the fly for downscaling, so peak
+memory depends on the band height and the output size, not the input size.
+"""
+import itertools
+import os
+import struct
+import zlib
+from typing import Any, Dict, Iterator, Optional, Tuple, TYPE_CHECKING
+
+from utils.config import (
+    IMAGE_REDUCING_GAP, LARGE_IMAGE_PIXELS, MAX_LARGE_IMAGE_PIXELS, LARGE_IMAGE_BAND_ROWS
+)
+from utils.image_helpers import draft_for_size, is_exif_transposed, resize_image
+
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import tifffile
+    TIFFFILE_AVAILABLE = True
+except ImportError:
+    TIFFFILE_AVAILABLE = False
+
+try:
+    import png
+    PYPNG_AVAILABLE = True
+except ImportError:
+    PYPNG_AVAILABLE = False
+
+# Tile size used for TIFF output
+TIFF_TILE_SIZE = 256
+
+# Rows filtered together when writing PNG
+PNG_FILTER_ROWS = 16
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TIFF_SIGNATURES = (b'II*\x00', b'MM\x00*', b'II+\x00', b'MM\x00+')
+JPEG_SIGNATURE = b'\xff\xd8'
+
+
+def _read_tiff_header(path: str) -> Optional[Dict[str, Any]]:
+    """Read TIFF dimensions and sample layout without decoding pixel data"""
+    if not TIFFFILE_AVAILABLE:
+        return None
+
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages.first
+        samples = page.samplesperpixel
+        streamable = (
+            page.bitspersample in (8, 16)
+            and page.dtype is not None and page.dtype.kind == 'u'
+            and page.planarconfig == tifffile.PLANARCONFIG.CONTIG
+            and page.photometric in (tifffile.PHOTOMETRIC.MINISBLACK, tifffile.PHOTOMETRIC.RGB)
+            and samples in (1, 2, 3, 4)
+            # LZW/JPEG/etc. need the optional imagecodecs package
+            and page.compression in tifffile.TIFF.DECOMPRESSORS
+        )
+        return {
+            'format': 'TIFF',
+            'width': page.imagewidth,
+            'height': page.imagelength,
+            'channels': samples,
+            'streamable': streamable
+        }
+
+
+def _read_png_header(path: str) -> Optional[Dict[str, Any]]:
+    """Read PNG dimensions from the IHDR chunk"""
+    with open(path, 'rb') as f:
+        header = f.read(29)
+    if len(header) < 29 or header[12:16] != b'IHDR':
+        return None
+
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', header[16:29])
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(color_type, 3)
+    return {
+        'format': 'PNG',
+        'width': width,
+        'height': height,
+        'channels': channels,
+        # Interlaced PNGs can only be de-interlaced with the whole image in memory
+        'streamable': PYPNG_AVAILABLE and interlace == 0
+    }
+
+
+def _open_jpeg(path: str) -> 'PILImage.Image':
+    """
+    Open a JPEG without Pillow's decompression-bomb check
+
+    Image.open() rejects very large images before we get a chance to decode
+    them at reduced size, so the JPEG plugin class is used directly. Only
+    call this for images that will be drafted down before loading.
+    """
+    from PIL import JpegImagePlugin
+
+    return JpegImagePlugin.JpegImageFile(path)
+
+
+def get_large_image_info(path: str) -> Optional[Dict[str, Any]]:
+    """
+    Return header info for TIFF/PNG/JPEG images above LARGE_IMAGE_PIXELS
+
+    Width and height are in display orientation. Returns None for smaller
+    images and formats without a band-wise decode path, so callers can fall
+    back to the regular Pillow pipeline.
+    """
+    if not NUMPY_AVAILABLE:
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            signature = f.read(8)
+
+        if signature.startswith(PNG_SIGNATURE):
+            info = _read_png_header(path)
+        elif signature[:4] in TIFF_SIGNATURES:
+            info = _read_tiff_header(path)
+        elif signature.startswith(JPEG_SIGNATURE):
+            with _open_jpeg(path) as img:
+                width, height = img.size
+                if is_exif_transposed(img):
+                    width, height = height, width
+                info = {
+                    'format': 'JPEG',
+                    'width': width,
+                    'height': height,
+                    'channels': len(img.getbands()),
+                    'streamable': False
+                }
+        else:
+            info = None
+    except Exception as e:
+        print(f"Could not read image header for {path}: {e}")
+        return None
+
+    if not info or info['width'] * info['height'] <= LARGE_IMAGE_PIXELS:
+        return None
+
+    info['pixels'] = info['width'] * info['height']
+    if info['pixels'] > MAX_LARGE_IMAGE_PIXELS:
+        raise ValueError(
+            f"Image is too large ({info['width']}x{info['height']}). "
+            f"Maximum supported size is {MAX_LARGE_IMAGE_PIXELS // 1_000_000} megapixels."
+        )
+    return info
+
+
+def _to_uint8(band: 'np.ndarray') -> 'np.ndarray':
+    """Scale 16-bit samples down to 8-bit"""
+    if band.dtype == np.uint8:
+        return band
+    if band.dtype == np.uint16:
+        return (band >> 8).astype(np.uint8)
+    raise ValueError(f"Unsupported sample type: {band.dtype}")
+
+
+def _iter_tiff_bands(path: str) -> Iterator['np.ndarray']:
+    """Yield (rows, width, channels) uint8 bands, one strip or tile row at a time"""
+    with tifffile.TiffFile(path) as tif:
+        page = tif.pages.first
+        height, width = page.imagelength, page.imagewidth
+        samples = page.samplesperpixel
+
+        band = None
+        band_y = None
+        for data, index, shape in page.segments():
+            _, _, y, x, _ = index
+            rows = min(shape[1], height - y)
+            cols = min(shape[2], width - x)
+
+            if page.is_tiled:
+                # Tiles arrive in row-major order; flush the band when a new
+                # tile row starts
+                if band_y != y:
+                    if band is not None:
+                        yield band
+                    band = np.zeros((rows, width, samples), dtype=np.uint8)
+                    band_y = y
+                if data is not None:
+                    band[:, x:x + cols] = _to_uint8(data[0, :rows, :cols])
+            else:
+                if data is None:
+                    yield np.zeros((rows, width, samples), dtype=np.uint8)
+                else:
+                    yield _to_uint8(data[0, :rows, :cols])
+
+        if band is not None:
+            yield band
+
+
+def _iter_png_bands(path: str, band_rows: int) -> Iterator['np.ndarray']:
+    """Yield (rows, width, channels) uint8 bands streamed row by row"""
+    reader = png.Reader(filename=path)
+    width, height, rows, info = reader.asDirect()
+    planes = info['planes']
+    bitdepth = info['bitdepth']
+    dtype = np.uint16 if bitdepth > 8 else np.uint8
+
+    pending = []
+    for row in rows:
+        pending.append(np.frombuffer(row, dtype=dtype))
+        if len(pending) == band_rows:
+            yield _png_rows_to_band(pending, width, planes, bitdepth)
+            pending = []
+    if pending:
+        yield _png_rows_to_band(pending, width, planes, bitdepth)
+
+
+def _png_rows_to_band(rows: list, width: int, planes: int, bitdepth: int) -> 'np.ndarray':
+    band = np.stack(rows).reshape(len(rows), width, planes)
+    if bitdepth < 8:
+        # Low bit depth greyscale is returned unscaled (e.g. 0-1 for 1-bit)
+        band = (band.astype(np.uint16) * 255 // ((1 << bitdepth) - 1)).astype(np.uint8)
+    return _to_uint8(band)
+
+
+def iter_image_bands(path: str, info: Dict[str, Any], band_rows: int = LARGE_IMAGE_BAND_ROWS) -> Iterator['np.ndarray']:
+    """Yield the image as uint8 (rows, width, channels) bands, top to bottom"""
+    if info['format'] == 'TIFF':
+        return _iter_tiff_bands(path)
+    if info['format'] == 'PNG':
+        return _iter_png_bands(path, band_rows)
+    raise ValueError(f"{info['format']} images cannot be read in bands")
+
+
+def _rebanded(bands: Iterator['np.ndarray'], rows: int) -> Iterator['np.ndarray']:
+    """Re-slice bands of arbitrary height into bands of exactly ``rows`` rows (last may be shorter)"""
+    pending = []
+    pending_rows = 0
+    for band in bands:
+        pending.append(band)
+        pending_rows += band.shape[0]
+        if pending_rows < rows:
+            continue
+
+        merged = np.concatenate(pending) if len(pending) > 1 else pending[0]
+        full = (merged.shape[0] // rows) * rows
+        for y in range(0, full, rows):
+            yield merged[y:y + rows]
+        remainder = merged[full:]
+        pending = [remainder] if remainder.shape[0] else []
+        pending_rows = remainder.shape[0]
+
+    if pending_rows:
+        yield np.concatenate(pending) if len(pending) > 1 else pending[0]
+
+
+def _box_reduce(band: 'np.ndarray', factor: int) -> 'np.ndarray':
+    """Average factor x factor blocks, padding ragged edges by replication"""
+    rows, width, channels = band.shape
+    pad_rows = -rows % factor
+    pad_cols = -width % factor
+    if pad_rows or pad_cols:
+        band = np.pad(band, ((0, pad_rows), (0, pad_cols), (0, 0)), mode='edge')
+
+    blocks = band.reshape(band.shape[0] // factor, factor, band.shape[1] // factor, factor, channels)
+    return (blocks.mean(axis=(1, 3), dtype=np.float32) + 0.5).astype(np.uint8)
+
+
+def shrink_large_image(path: str, info: Dict[str, Any], target_size: Tuple[int, int]) -> 'PILImage.Image':
+    """
+    Downscale a large image to ``target_size`` without decoding it at full size
+
+    TIFF and PNG bands are box-reduced by an integer factor as they are read
+    (keeping the intermediate at least IMAGE_REDUCING_GAP times the target),
+    then the small intermediate gets the usual LANCZOS pass. JPEGs use
+    DCT-domain reduced decoding instead. The result is in display orientation.
+    """
+    from PIL import Image, ImageOps
+
+    if info['format'] == 'JPEG':
+        img = _open_jpeg(path)
+        draft_for_size(img, target_size)
+        img = ImageOps.exif_transpose(img)
+        return resize_image(img, target_size)
+
+    target_width, target_height = target_size
+    factor = max(1, int(min(
+        info['width'] / (target_width * IMAGE_REDUCING_GAP),
+        info['height'] / (target_height * IMAGE_REDUCING_GAP)
+    )))
+
+    # Band height is a multiple of the factor so blocks never straddle bands
+    band_rows = max(factor, (LARGE_IMAGE_BAND_ROWS // factor) * factor)
+    reduced = [
+        _box_reduce(band, factor)
+        for band in _rebanded(iter_image_bands(path, info, band_rows), band_rows)
+    ]
+    data = np.concatenate(reduced)
+    if data.shape[2] == 1:
+        data = data[:, :, 0]
+
+    img = Image.fromarray(data)
+    print(f"Band-reduced {info['format']}: {info['width']}x{info['height']} -> {img.size} (factor {factor})")
+    return resize_image(img, target_size)
+
+
+def _write_tiff(path: str, info: Dict[str, Any], bands: Iterator['np.ndarray'], channels: int) -> None:
+    def tiles():
+        for band in _rebanded(bands, TIFF_TILE_SIZE):
+            for x in range(0, info['width'], TIFF_TILE_SIZE):
+                yield band[:, x:x + TIFF_TILE_SIZE]
+
+    tifffile.imwrite(
+        path,
+        data=tiles(),
+        shape=(info['height'], info['width'], channels),
+        dtype=np.uint8,
+        photometric='minisblack' if channels <= 2 else 'rgb',
+        extrasamples=('unassalpha',) if channels in (2, 4) else None,
+        tile=(TIFF_TILE_SIZE, TIFF_TILE_SIZE),
+        compression='zlib',
+        bigtiff=info['pixels'] * channels > 2 ** 32 - 2 ** 25
+    )
+
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+
+def filter_png_rows(rows: 'np.ndarray', previous: 'np.ndarray', bpp: int) -> bytes:
+    """
+    Apply PNG scanline filters, picking the best filter per row
+
+    Uses the libpng heuristic (minimum sum of absolute signed residuals)
+    across None/Sub/Up/Average/Paeth, vectorized over a block of rows.
+    """
+    x = rows.astype(np.int16)
+    up = np.concatenate([previous[np.newaxis].astype(np.int16), x[:-1]])
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up_left = np.zeros_like(x)
+    up_left[:, bpp:] = up[:, :-bpp]
+
+    p = left + up - up_left
+    pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - up_left)
+    paeth = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, up_left))
+
+    candidates = np.stack([x, x - left, x - up, x - (left + up) // 2, x - paeth]) & 0xff
+    scores = np.abs(((candidates + 128) & 0xff) - 128).sum(axis=2)
+    best = scores.argmin(axis=0)
+
+    filtered = candidates[best, np.arange(len(best))].astype(np.uint8)
+    return np.concatenate([best.astype(np.uint8)[:, np.newaxis], filtered], axis=1).tobytes()
+
+
+def _write_png(path: str, info: Dict[str, Any], bands: Iterator['np.ndarray'], channels: int, compress_level: int) -> None:
+    """Write an 8-bit PNG row block by row block with adaptive filtering"""
+    color_type = {1: 0, 2: 4, 3: 2, 4: 6}[channels]
+    row_bytes = info['width'] * channels
+    compressor = zlib.compressobj(compress_level)
+    previous = np.zeros(row_bytes, dtype=np.uint8)
+
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b'IHDR', struct.pack('>IIBBBBB', info['width'], info['height'], 8, color_type, 0, 0, 0)))
+
+        for band in bands:
+            flat = band.reshape(band.shape[0], row_bytes)
+            # Filter a few rows at a time; the candidate arrays are 10x the input
+            for y in range(0, flat.shape[0], PNG_FILTER_ROWS):
+                block = flat[y:y + PNG_FILTER_ROWS]
+                data = compressor.compress(filter_png_rows(block, previous, channels))
+                if data:
+                    f.write(png_chunk(b'IDAT', data))
+                previous = block[-1]
+
+        f.write(png_chunk(b'IDAT', compressor.flush()))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def convert_large_image(
+    input_path: str,
+    output_path: str,
+    target_format: str,
+    info: Dict[str, Any],
+    compress_level: int = 6
+) -> Dict[str, Any]:
+    """
+    Convert a large TIFF/PNG to TIFF/PNG at full resolution, band by band
+
+    Only one band is held in memory at a time. TIFF output is tiled and
+    zlib-compressed (BigTIFF when needed); PNG output uses ``compress_level``.
+    """
+    target_format = target_format.lower()
+    if target_format == 'tif':
+        target_format = 'tiff'
+
+    if not info.get('streamable') or target_format not in ('tiff', 'png'):
+        return {'success': False, 'error': f"{info['format']} to {target_format.upper()} cannot be processed in bands"}
+    if target_format == 'tiff' and not TIFFFILE_AVAILABLE:
+        return {'success': False, 'error': 'tifffile is not installed'}
+
+    try:
+        # Palette PNGs expand to RGB or RGBA, so take the channel count from
+        # the decoded data rather than the header
+        bands = iter_image_bands(input_path, info)
+        first_band = next(bands)
+        channels = first_band.shape[2]
+        bands = itertools.chain([first_band], bands)
+
+        if target_format == 'tiff':
+            _write_tiff(output_path, info, bands, channels)
+        else:
+            _write_png(output_path, info, bands, channels, compress_level)
+    except Exception as e:
+        print(f"Band-wise conversion failed: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return {'success': False, 'error': str(e)}
+
+    print(f"Band-wise {info['format']} -> {target_format.upper()}: {info['width']}x{info['height']}")
+    return {'success': True}
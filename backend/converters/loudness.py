@@ -0,0 +1,168 @@
+# converters/loudness.py - Two-pass EBU R128 loudness normalization
+"""
+Loudness normalization with FFmpeg's loudnorm filter
+
+The first pass decodes the whole input and measures its integrated
+loudness, true peak, loudness range and gating threshold. These values
+describe the source only (not the target), so they are cached by content
+hash in memory and on disk: converting the same source again, to any
+target, skips straight to the second pass.
+
+The second pass is just a filter (`loudness_filter`) added to the encode
+that was going to run anyway. With measurements available it normalizes
+linearly (a constant gain, no pumping) whenever the target true peak
+allows it; without them loudnorm falls back to its one-pass dynamic mode.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+from typing import Optional, Union
+
+from utils.cache import LRUCache, DiskCache
+from utils.config import (
+    LOUDNESS_TARGETS, LOUDNESS_CACHE_DIR, LOUDNESS_MEMORY_ENTRIES, LOUDNESS_DISK_BYTES
+)
+
+MEASURE_TIMEOUT = 600
+MEASURED_FIELDS = ("input_i", "input_tp", "input_lra", "input_thresh")
+
+_memory_cache = LRUCache(LOUDNESS_MEMORY_ENTRIES, sizeof=lambda _: 1)
+_disk_cache = DiskCache(LOUDNESS_CACHE_DIR, LOUDNESS_DISK_BYTES)
+measure_count = 0
+
+
+def _content_hash(source: Union[str, bytes]) -> str:
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()[:32]
+    from converters.media_analysis import media_fingerprint
+    return media_fingerprint(source)
+
+
+def _target_args(target: dict) -> str:
+    return f"I={target['I']}:TP={target['TP']}:LRA={target['LRA']}"
+
+
+def _parse_measurement(stderr: str) -> Optional[dict]:
+    """Pull the JSON block loudnorm prints at the end of the first pass"""
+    match = re.search(r"\{[^{}]*\"input_i\"[^{}]*\}", stderr)
+    if not match:
+        return None
+    try:
+        values = json.loads(match.group(0))
+        measurement = {field: float(values[field]) for field in MEASURED_FIELDS}
+    except (KeyError, ValueError, json.JSONDecodeError):
+        return None
+    # Silence measures as -inf / -70, which no gain can normalize
+    if measurement["input_i"] <= -70:
+        return None
+    return measurement
+
+
+def _run_measurement(source: Union[str, bytes]) -> Optional[dict]:
+    global measure_count
+    from converters import audio_converter
+
+    if not audio_converter.FFMPEG_AVAILABLE:
+        return None
+
+    target = LOUDNESS_TARGETS['podcast']  # only input_* are used, which don't depend on the target
+    cmd = [
+        audio_converter.FFMPEG_PATH, "-hide_banner", "-nostats",
+        "-i", "pipe:0" if isinstance(source, bytes) else source,
+        "-vn", "-af", f"loudnorm={_target_args(target)}:print_format=json",
+        "-f", "null", "-"
+    ]
+    try:
+        measure_count += 1
+        result = subprocess.run(
+            cmd,
+            input=source if isinstance(source, bytes) else None,
+            capture_output=True,
+            timeout=MEASURE_TIMEOUT,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        )
+    except Exception as e:
+        print(f"[Loudness] Measurement failed: {e}")
+        return None
+
+    stderr = result.stderr.decode("utf-8", errors="replace")
+    if result.returncode != 0:
+        print(f"[Loudness] Measurement failed: {stderr.strip()[-300:]}")
+        return None
+    return _parse_measurement(stderr)
+
+
+def measure_loudness(source: Union[str, bytes]) -> Optional[dict]:
+    """
+    First-pass loudness measurement of a file path or in-memory audio file (blocking)
+
+    Returns {input_i, input_tp, input_lra, input_thresh}, or None if the
+    input can't be measured (no FFmpeg, no audio, or digital silence).
+    Measured at most once per content.
+    """
+    if isinstance(source, str) and not os.path.exists(source):
+        return None
+
+    content_hash = _content_hash(source)
+    measurement = _memory_cache.get(content_hash)
+    if measurement is not None:
+        return measurement
+
+    cached_path = _disk_cache.get_path(content_hash, ".json")
+    if cached_path:
+        try:
+            with open(cached_path, "rb") as f:
+                measurement = json.loads(f.read())
+            _memory_cache.put(content_hash, measurement)
+            return measurement
+        except Exception:
+            pass
+
+    measurement = _run_measurement(source)
+    if measurement is None:
+        return None
+
+    _memory_cache.put(content_hash, measurement)
+    try:
+        _disk_cache.put_bytes(content_hash, json.dumps(measurement).encode("utf-8"), ".json")
+    except Exception as e:
+        print(f"[Loudness] Could not write measurement cache: {e}")
+    print(f"[Loudness] Measured {measurement['input_i']:.1f} LUFS, "
+          f"{measurement['input_tp']:.1f} dBTP, LRA {measurement['input_lra']:.1f}")
+    return measurement
+
+
+async def measure_loudness_async(source: Union[str, bytes]) -> Optional[dict]:
+    """measure_loudness without blocking the event loop"""
+    return await asyncio.to_thread(measure_loudness, source)
+
+
+def loudness_filter(target_name: str, measurement: Optional[dict] = None) -> str:
+    """
+    Second-pass loudnorm filter for one of LOUDNESS_TARGETS
+
+    loudnorm resamples to 192 kHz internally, so callers should set the
+    output sample rate (-ar) explicitly.
+    """
+    if target_name not in LOUDNESS_TARGETS:
+        raise ValueError(f"Unknown loudness target: {target_name}")
+
+    target = LOUDNESS_TARGETS[target_name]
+    if measurement is None:
+        return f"loudnorm={_target_args(target)}"
+
+    # loudnorm refuses LRA targets below the measured range in linear mode
+    target = {**target, "LRA": max(target["LRA"], measurement["input_lra"])}
+    return (
+        f"loudnorm={_target_args(target)}"
+        f":measured_I={measurement['input_i']}:measured_TP={measurement['input_tp']}"
+        f":measured_LRA={measurement['input_lra']}:measured_thresh={measurement['input_thresh']}"
+        f":linear=true"
+    )
+
+
+def get_loudness_stats() -> dict:
+    return {"measurements_run": measure_count, "memory": _memory_cache.stats(), "disk": _disk_cache.stats()}
@@ -0,0 +1,236 @@
+# converters/media_analysis.py - Cached ffprobe media analysis
+"""
+One ffprobe per file content, shared by video, audio and voice features
+
+Results are keyed by a content fingerprint (a hash of the whole file up
+to FINGERPRINT_FULL_BYTES; larger files hash FINGERPRINT_SAMPLES evenly
+spaced megabytes plus their inode and mtime - hashing a multi-GB video
+in full would cost more than probing it), cached in memory and on disk,
+and summarized into the fields planners need: duration, bitrate,
+resolution, frame rate and codecs.
+
+The raw ffprobe "format" and "streams" sections are kept in the result,
+so it is a drop-in replacement for plain `ffprobe -show_format
+-show_streams` output.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+from typing import List, Optional
+
+from utils.cache import LRUCache, DiskCache
+from utils.config import (
+    MEDIA_ANALYSIS_CACHE_DIR, MEDIA_ANALYSIS_MEMORY_ENTRIES, MEDIA_ANALYSIS_DISK_BYTES
+)
+
+FINGERPRINT_CHUNK = 1024 * 1024
+FINGERPRINT_FULL_BYTES = 64 * 1024 * 1024
+FINGERPRINT_SAMPLES = 32
+FFPROBE_TIMEOUT = 30
+
+_memory_cache = LRUCache(MEDIA_ANALYSIS_MEMORY_ENTRIES, sizeof=lambda _: 1)
+_disk_cache = DiskCache(MEDIA_ANALYSIS_CACHE_DIR, MEDIA_ANALYSIS_DISK_BYTES)
+probe_count = 0
+
+
+def media_fingerprint(path: str) -> str:
+    """
+    Content fingerprint: size plus a hash of the content
+
+    Files up to FINGERPRINT_FULL_BYTES are hashed in full. Larger files
+    hash FINGERPRINT_SAMPLES chunks spread evenly from the first to the
+    last FINGERPRINT_CHUNK bytes, plus the file's device, inode and mtime:
+    a sample can't tell apart two files that differ only between chunks,
+    so large files are only shared by repeated probes of the same file.
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= FINGERPRINT_FULL_BYTES:
+            while chunk := f.read(FINGERPRINT_CHUNK):
+                digest.update(chunk)
+        else:
+            digest.update(f"{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}".encode())
+            last = size - FINGERPRINT_CHUNK
+            for i in range(FINGERPRINT_SAMPLES):
+                f.seek(last * i // (FINGERPRINT_SAMPLES - 1))
+                digest.update(f.read(FINGERPRINT_CHUNK))
+    return digest.hexdigest()[:32]
+
+
+def _run_ffprobe(args: List[str], timeout: int = FFPROBE_TIMEOUT) -> Optional[str]:
+    """Run ffprobe and return its stdout, or None if it is unavailable or fails"""
+    global probe_count
+    from converters import video_converter
+
+    if not video_converter.FFMPEG_AVAILABLE:
+        return None
+    try:
+        probe_count += 1
+        result = subprocess.run(
+            [video_converter.FFPROBE_PATH, "-v", "quiet"] + args,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        )
+        if result.returncode == 0 and result.stdout.strip():
+            return result.stdout
+    except Exception as e:
+        print(f"[Probe] ffprobe failed: {e}")
+    return None
+
+
+def _to_float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value) -> Optional[int]:
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _frame_rate(rate: Optional[str]) -> Optional[float]:
+    """Parse ffprobe's '30000/1001' style frame rates"""
+    if not rate or rate in ("0/0", "0"):
+        return None
+    numerator, _, denominator = rate.partition("/")
+    try:
+        return round(float(numerator) / float(denominator or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def summarize_probe(probe: dict) -> dict:
+    """Planner-friendly summary of raw ffprobe JSON (raw sections are kept)"""
+    fmt = probe.get("format", {})
+    streams = probe.get("streams", [])
+
+    video_stream = next((
+        s for s in streams
+        if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")
+    ), None)
+    audio_stream = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    video = None
+    if video_stream:
+        video = {
+            "codec": video_stream.get("codec_name"),
+            "width": video_stream.get("width"),
+            "height": video_stream.get("height"),
+            "fps": _frame_rate(video_stream.get("avg_frame_rate")) or _frame_rate(video_stream.get("r_frame_rate")),
+            "bit_rate": _to_int(video_stream.get("bit_rate")),
+            "pix_fmt": video_stream.get("pix_fmt"),
+            "frames": _to_int(video_stream.get("nb_frames"))
+        }
+
+    audio = None
+    if audio_stream:
+        audio = {
+            "codec": audio_stream.get("codec_name"),
+            "sample_rate": _to_int(audio_stream.get("sample_rate")),
+            "channels": audio_stream.get("channels"),
+            "bit_rate": _to_int(audio_stream.get("bit_rate"))
+        }
+
+    return {
+        "format": fmt,
+        "streams": streams,
+        "container": fmt.get("format_name"),
+        "duration": _to_float(fmt.get("duration")),
+        "bit_rate": _to_int(fmt.get("bit_rate")),
+        "size": _to_int(fmt.get("size")),
+        "video": video,
+        "audio": audio
+    }
+
+
+def _store(content_hash: str, analysis: dict) -> None:
+    _memory_cache.put(content_hash, analysis)
+    try:
+        _disk_cache.put_bytes(content_hash, json.dumps(analysis).encode("utf-8"), ".json")
+    except Exception as e:
+        print(f"[Probe] Could not write analysis cache: {e}")
+
+
+def analyze_media(path: str) -> Optional[dict]:
+    """
+    Analyze a media file, probing it at most once per content
+
+    Returns None if the file can't be probed.
+    """
+    if not os.path.exists(path):
+        return None
+
+    content_hash = media_fingerprint(path)
+    analysis = _memory_cache.get(content_hash)
+    if analysis is None:
+        cached_path = _disk_cache.get_path(content_hash, ".json")
+        if cached_path:
+            try:
+                with open(cached_path, "rb") as f:
+                    analysis = json.loads(f.read())
+                _memory_cache.put(content_hash, analysis)
+            except Exception:
+                analysis = None
+
+    if analysis is None:
+        output = _run_ffprobe(["-print_format", "json", "-show_format", "-show_streams", path])
+        if output is None:
+            return None
+        try:
+            analysis = summarize_probe(json.loads(output))
+        except json.JSONDecodeError:
+            return None
+        analysis["content_hash"] = content_hash
+        _store(content_hash, analysis)
+
+    return analysis
+
+
+def cap_bitrates(args: list, analysis: Optional[dict]) -> list:
+    """
+    Never ask for more bits than the source has
+
+    Lowers -b:v/-b:a targets to the probed source stream bitrate, so a
+    low-bitrate input isn't inflated by a fixed preset.
+    """
+    if not analysis:
+        return args
+    source_rates = {
+        "-b:v": (analysis.get("video") or {}).get("bit_rate"),
+        "-b:a": (analysis.get("audio") or {}).get("bit_rate")
+    }
+    capped = list(args)
+    for i, flag in enumerate(capped[:-1]):
+        source_rate = source_rates.get(flag)
+        target_rate = parse_bitrate(capped[i + 1]) if source_rate else None
+        if target_rate and source_rate < target_rate:
+            capped[i + 1] = f"{max(source_rate // 1000, 32)}k"
+            print(f"Capped {flag} {args[i + 1]} -> {capped[i + 1]} (source {source_rate // 1000}k)")
+    return capped
+
+
+def parse_bitrate(value: str) -> Optional[int]:
+    """'1M' / '320k' / '128000' -> bits per second"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)([kKmM]?)", str(value).strip())
+    if not match:
+        return None
+    number, unit = float(match.group(1)), match.group(2).lower()
+    return int(number * {"": 1, "k": 1000, "m": 1000000}[unit])
+
+
+async def analyze_media_async(path: str) -> Optional[dict]:
+    """analyze_media without blocking the event loop"""
+    return await asyncio.to_thread(analyze_media, path)
+
+
+def get_analysis_stats() -> dict:
+    return {"probes_run": probe_count, "memory": _memory_cache.stats(), "disk": _disk_cache.stats()}
@@ -8,6 +8,8 @@ import numpy as np
 import zipfile
 import time
 
+from utils.image_helpers import fit_dimensions, draft_for_size, resize_image
+
 # Try importing OCR libraries
 try:
     import pytesseract
@@ -36,6 +38,10 @@ class OCRProcessor:
     def __init__(self):
         self.supported_formats = ['jpeg', 'jpg', 'png', 'tiff', 'bmp', 'webp', 'pdf']
 
+        # Longest side used for OCR; larger photos are downscaled first (an A4
+        # page at this size is still well above 300 DPI)
+        self.max_image_dimension = 4000
+
         # Check which language files are actually available
         self.tessdata_dir = os.path.join(os.path.dirname(__file__), '..', 'tessdata')
         self.available_languages = self._get_available_languages()
@@ -186,6 +192,11 @@ class OCRProcessor:
         """Preprocess image for better OCR results"""
         try:
             with Image.open(image_path) as img:
+                # Oversized JPEG photos are decoded at reduced resolution
+                target_size = self._get_ocr_target_size(img.size)
+                if target_size:
+                    draft_for_size(img, target_size, respect_exif=False)
+
                 # Convert to RGB if necessary
                 if img.mode not in ('RGB', 'L'):
                     img = img.convert('RGB')
@@ -207,6 +218,11 @@ class OCRProcessor:
                     except:
                         pass
 
+                # Downscale oversized images before the enhancement filters
+                target_size = self._get_ocr_target_size(img.size)
+                if target_size:
+                    img = resize_image(img, target_size)
+
                 # Image enhancement
                 if enhance:
                     img = await self._enhance_image_quality(img)
@@ -221,6 +237,15 @@ class OCRProcessor:
             print(f"Image preprocessing error: {e}")
             return image_path  # Return original if preprocessing fails
 
+    def _get_ocr_target_size(self, size: Tuple[int, int]) -> Optional[Tuple[int, int]]:
+        """Get the downscaled OCR size for an image, or None if it is small enough"""
+        width, height = size
+        if max(width, height) <= self.max_image_dimension:
+            return None
+        if width >= height:
+            return fit_dimensions(size, width=self.max_image_dimension)
+        return fit_dimensions(size, height=self.max_image_dimension)
+
     async def _enhance_image_quality(self, img: Image.Image) -> Image.Image:
         """Enhance image quality for better OCR"""
         try:
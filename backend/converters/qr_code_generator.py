@@ -7,6 +7,8 @@ import asyncio
 from typing import Optional, Dict, Any
 import base64
 
+from utils.image_helpers import open_image_for_size, resize_image
+
 # Try importing advanced styling modules, fall back to basic if not available
 try:
     from qrcode.image.styledpil import StyledPilImage
@@ -252,14 +254,13 @@ class QRCodeGenerator:
     async def _add_logo(self, qr_img: Image.Image, logo_path: str) -> Image.Image:
         """Add logo to center of QR code"""
         try:
-            logo = Image.open(logo_path)
-
             # Calculate logo size (10% of QR code)
             qr_width, qr_height = qr_img.size
             logo_size = min(qr_width, qr_height) // 10
 
-            # Resize logo
-            logo = logo.resize((logo_size, logo_size), Image.LANCZOS)
+            # Resize logo, decoding large JPEG logos at reduced resolution
+            logo = open_image_for_size(logo_path, (logo_size, logo_size))
+            logo = resize_image(logo, (logo_size, logo_size))
 
             # Create mask for circular logo
             mask = Image.new('L', (logo_size, logo_size), 0)
@@ -0,0 +1,269 @@
+"""
+Pooled, micro-batched segmentation inference for background removal
+
+rembg sessions wrap a single ONNX Runtime InferenceSession. Sharing one
+session between all request threads serializes every request on it, and
+running each image separately wastes the throughput a CPU gets from batched
+matrix multiplies. Each model here gets:
+
+- A pool of sessions with tuned intra/inter-op thread counts
+- A dispatcher that groups requests arriving while all sessions are busy
+  into one batched model run (for models with a dynamic batch dimension)
+- Optional warm-up at startup, so the first request does not pay for model
+  download, session creation and arena allocation
+"""
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import onnxruntime as ort
+from PIL import Image
+from rembg.sessions import sessions_class
+
+from utils.image_helpers import resize_image
+from utils.config import (
+    BG_REMOVAL_SESSIONS, BG_REMOVAL_INTRA_OP_THREADS, BG_REMOVAL_INTER_OP_THREADS,
+    BG_REMOVAL_MAX_BATCH, BG_REMOVAL_BATCH_WAIT_MS, BG_REMOVAL_WARMUP_MODELS
+)
+
+# Input size, mean and std used by rembg's predict() for each model
+MODEL_PREPROCESSING = {
+    "isnet-general-use": ((1024, 1024), (0.5, 0.5, 0.5), (1.0, 1.0, 1.0)),
+    "u2net_human_seg": ((320, 320), (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+    "u2net": ((320, 320), (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+
+
+def preprocess_image(image: Image.Image, model_name: str) -> np.ndarray:
+    """Resize and normalize an image into a (3, H, W) float32 model input"""
+    size, mean, std = MODEL_PREPROCESSING[model_name]
+    # reducing_gap keeps the downscale from multi-megapixel photos cheap
+    array = np.asarray(resize_image(image.convert("RGB"), size), dtype=np.float32)
+    array /= max(float(array.max()), 1e-6)
+    array -= np.array(mean, dtype=np.float32)
+    array /= np.array(std, dtype=np.float32)
+    return array.transpose(2, 0, 1)
+
+
+def normalize_prediction(prediction: np.ndarray) -> np.ndarray:
+    """Min-max normalize a raw model prediction to 0-1"""
+    low, high = float(prediction.min()), float(prediction.max())
+    return ((prediction - low) / max(high - low, 1e-6)).astype(np.float32)
+
+
+def prediction_to_mask(prediction: np.ndarray, size: Tuple[int, int]) -> Image.Image:
+    """Turn a normalized prediction into an L mask of ``size``"""
+    mask = Image.fromarray((prediction * 255).astype(np.uint8), mode="L")
+    return mask.resize(size, Image.Resampling.LANCZOS)
+
+
+class SegmentationModel:
+    """Session pool plus micro-batching scheduler for one rembg model"""
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self.pool_size = BG_REMOVAL_SESSIONS
+        self.supports_batching: Optional[bool] = None
+
+        self._sessions: "queue.Queue" = queue.Queue()
+        self._session_count = 0
+        self._session_lock = threading.Lock()
+
+        # One slot per session; the dispatcher only forms a batch once a
+        # session is free, so requests queue up (and batch) while all are busy
+        self._slots = threading.Semaphore(self.pool_size)
+        self._requests: "queue.Queue" = queue.Queue()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix=f"{model_name}-inference"
+        )
+        self._dispatcher: Optional[threading.Thread] = None
+        self._dispatcher_lock = threading.Lock()
+
+        self.images_processed = 0
+        self.batches_run = 0
+
+    def _create_session(self):
+        session_class = next((sc for sc in sessions_class if sc.name() == self.model_name), None)
+        if session_class is None:
+            raise ValueError(f"No rembg session found for model '{self.model_name}'")
+
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = BG_REMOVAL_INTRA_OP_THREADS
+        sess_opts.inter_op_num_threads = BG_REMOVAL_INTER_OP_THREADS
+        sess_opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        session = session_class(self.model_name, sess_opts)
+
+        if self.supports_batching is None:
+            batch_dim = session.inner_session.get_inputs()[0].shape[0]
+            self.supports_batching = not isinstance(batch_dim, int)
+            print(f"[Model] {self.model_name}: batched inference {'enabled' if self.supports_batching else 'not supported'}")
+        return session
+
+    def _acquire_session(self):
+        try:
+            return self._sessions.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._session_lock:
+            if self._session_count < self.pool_size:
+                session = self._create_session()
+                self._session_count += 1
+                print(f"[Model] Created {self.model_name} session {self._session_count}/{self.pool_size}")
+                return session
+        return self._sessions.get()
+
+    def _release_session(self, session) -> None:
+        self._sessions.put(session)
+
+    def _ensure_dispatcher(self) -> None:
+        if self._dispatcher is None:
+            with self._dispatcher_lock:
+                if self._dispatcher is None:
+                    self._dispatcher = threading.Thread(
+                        target=self._dispatch_loop, name=f"{self.model_name}-dispatcher", daemon=True
+                    )
+                    self._dispatcher.start()
+
+    def _dispatch_loop(self) -> None:
+        while True:
+            batch = [self._requests.get()]
+            self._slots.acquire()
+
+            # Anything that queued up while we waited for a session joins
+            # this batch; then give stragglers a few milliseconds
+            max_batch = BG_REMOVAL_MAX_BATCH if self.supports_batching is not False else 1
+            while len(batch) < max_batch:
+                try:
+                    batch.append(self._requests.get(timeout=BG_REMOVAL_BATCH_WAIT_MS / 1000))
+                except queue.Empty:
+                    break
+
+            self._executor.submit(self._run_batch, batch)
+
+    def _run_batch(self, batch: List[Tuple[np.ndarray, Future]]) -> None:
+        try:
+            session = self._acquire_session()
+            try:
+                predictions = self._infer(session, [tensor for tensor, _ in batch])
+            finally:
+                self._release_session(session)
+
+            self.batches_run += 1
+            self.images_processed += len(batch)
+            for (_, future), prediction in zip(batch, predictions):
+                future.set_result(prediction)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._slots.release()
+
+    def _infer(self, session, tensors: List[np.ndarray]) -> List[np.ndarray]:
+        inner = session.inner_session
+        input_name = inner.get_inputs()[0].name
+
+        if self.supports_batching and len(tensors) > 1:
+            return list(inner.run(None, {input_name: np.stack(tensors)})[0][:, 0])
+        return [inner.run(None, {input_name: tensor[np.newaxis]})[0][0, 0] for tensor in tensors]
+
+    def predict_array(self, image: Image.Image) -> np.ndarray:
+        """
+        Return the 0-1 foreground prediction at the model's native resolution
+
+        Blocks until inference finishes. Callers decide how to bring the
+        prediction back to the image size.
+        """
+        if self.model_name not in MODEL_PREPROCESSING:
+            # Unknown preprocessing - use the rembg session directly
+            session = self._acquire_session()
+            try:
+                return np.asarray(session.predict(image)[0], dtype=np.float32) / 255
+            finally:
+                self._release_session(session)
+
+        tensor = preprocess_image(image, self.model_name)
+        future: Future = Future()
+        self._ensure_dispatcher()
+        self._requests.put((tensor, future))
+        return normalize_prediction(future.result())
+
+    def predict(self, image: Image.Image) -> Image.Image:
+        """Return the segmentation mask for ``image`` at its full size"""
+        return prediction_to_mask(self.predict_array(image), image.size)
+
+    def warm_up(self) -> None:
+        """Create every session in the pool and run one inference on each"""
+        sessions = []
+        while self._session_count < self.pool_size:
+            sessions.append(self._acquire_session())
+        if not sessions:
+            return
+
+        size = MODEL_PREPROCESSING.get(self.model_name, ((320, 320),))[0]
+        dummy = Image.new("RGB", size)
+        for session in sessions:
+            session.predict(dummy)
+            self._release_session(session)
+
+    def status(self) -> dict:
+        return {
+            "sessions": self._session_count,
+            "pool_size": self.pool_size,
+            "batched_inference": self.supports_batching,
+            "queued_requests": self._requests.qsize(),
+            "images_processed": self.images_processed,
+            "batches_run": self.batches_run
+        }
+
+
+class PooledSession:
+    """
+    Drop-in replacement for a rembg session
+
+    rembg.remove() only calls session.predict(), so routing it through the
+    model's scheduler keeps all existing remove() calls working unchanged.
+    """
+
+    def __init__(self, model: SegmentationModel):
+        self.model = model
+        self.model_name = model.model_name
+
+    def predict(self, img: Image.Image, *args, **kwargs) -> List[Image.Image]:
+        return [self.model.predict(img)]
+
+    def predict_array(self, img: Image.Image) -> np.ndarray:
+        return self.model.predict_array(img)
+
+
+_models: Dict[str, SegmentationModel] = {}
+_models_lock = threading.Lock()
+
+
+def get_segmentation_model(model_name: str) -> SegmentationModel:
+    """Get (or create) the shared pool/scheduler for a model"""
+    with _models_lock:
+        if model_name not in _models:
+            _models[model_name] = SegmentationModel(model_name)
+        return _models[model_name]
+
+
+def get_pooled_session(model_name: str) -> PooledSession:
+    return PooledSession(get_segmentation_model(model_name))
+
+
+def warm_up_models(model_names: Optional[List[str]] = None) -> None:
+    """Load and warm up background removal models (run from a startup thread)"""
+    for model_name in model_names or BG_REMOVAL_WARMUP_MODELS:
+        try:
+            get_segmentation_model(model_name).warm_up()
+            print(f"[Model] Warmed up {model_name}")
+        except Exception as e:
+            print(f"[Model] Warm-up failed for {model_name}: {e}")
+
+
+def get_pool_status() -> dict:
+    return {name: model.status() for name, model in _models.items()}
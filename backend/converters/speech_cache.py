@@ -0,0 +1,157 @@
+# converters/speech_cache.py - Cache of synthesized speech segments
+"""
+Raw TTS output cached per segment, before any effects
+
+Keys are (normalized text, language, engine, voice), so a repeated phrase
+(templated announcements, retries with different speed/pitch/format) is
+synthesized once. Whitespace and Unicode normalization make trivially
+different spellings of the same sentence share an entry; case and
+punctuation are kept because they change the pronunciation.
+
+Entries are the engine's own encoded output (MP3 for gTTS, WAV for Coqui)
+in a size-bounded LRU in memory, backed by a larger one on disk.
+"""
+import hashlib
+import json
+import re
+import unicodedata
+from typing import Callable, List, Optional
+
+from utils.cache import LRUCache, DiskCache
+from utils.config import (
+    VOICE_SEGMENT_CACHE_DIR, VOICE_SEGMENT_MEMORY_BYTES, VOICE_SEGMENT_DISK_BYTES,
+    VOICE_SENTENCE_MIN_CHARS, VOICE_SENTENCE_MAX_CHARS
+)
+
+_memory_cache = LRUCache(VOICE_SEGMENT_MEMORY_BYTES)
+_disk_cache = DiskCache(VOICE_SEGMENT_CACHE_DIR, VOICE_SEGMENT_DISK_BYTES)
+synthesis_count = 0
+
+
+def normalize_text(text: str) -> str:
+    """NFC with runs of whitespace collapsed to one space"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFC", text)).strip()
+
+
+# Sentence-final punctuation, including Urdu/Arabic, Devanagari and CJK stops
+# (CJK stops need no following space)
+_SENTENCE_END = re.compile(r"(?<=[.!?\u06d4\u061f\u0964])\s+|(?<=[\u3002\uff01\uff1f])\s*")
+# A period after these doesn't end the sentence, even before a capital
+_ABBREVIATION = re.compile(r"(?:\b(?:mr|mrs|ms|dr|prof|st|jr|sr|vs|e\.g|i\.e|cf)|(?:^|\s)\w)\.$", re.IGNORECASE)
+_CLAUSE_END = re.compile(r"(?<=[,:\u060c\u3001\uff0c])\s*")
+
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    """Break an over-long sentence at clause punctuation, then at spaces"""
+    parts, current = [], ""
+    for piece in _CLAUSE_END.split(sentence):
+        for word in (piece.split(" ") if len(piece) > max_chars else [piece]):
+            candidate = f"{current} {word}".strip() if current else word
+            if current and len(candidate) > max_chars:
+                parts.append(current)
+                candidate = word
+            current = candidate
+    if current:
+        parts.append(current)
+    return parts
+
+
+def _sentence_spans(text: str) -> List[tuple]:
+    """
+    (start, end) of each sentence, split at sentence-final punctuation
+
+    A stop followed by a lowercase letter ("e.g. the") or ending a known
+    abbreviation or initial ("Dr. Smith", "J. Doe") is not a boundary.
+    """
+    spans, start = [], 0
+    for match in _SENTENCE_END.finditer(text):
+        following = text[match.end():match.end() + 1]
+        if following.islower() or _ABBREVIATION.search(text[start:match.start()]):
+            continue
+        spans.append((start, match.start()))
+        start = match.end()
+    spans.append((start, len(text)))
+    return [(s, e) for s, e in spans if text[s:e].strip()]
+
+
+def split_sentences(text: str, max_chars: int = VOICE_SENTENCE_MAX_CHARS,
+                    min_chars: int = VOICE_SENTENCE_MIN_CHARS) -> List[str]:
+    """
+    Split text into sentences (segments) of at most max_chars, where spaces allow
+
+    Sentences shorter than min_chars are merged into the next one (keeping
+    the original text between them), so short fragments don't become
+    separate TTS calls with their own pauses.
+    """
+    text = normalize_text(text)
+    merged, pending = [], None
+    for start, end in _sentence_spans(text):
+        if pending is None:
+            pending = start
+        if end - pending >= min_chars:
+            merged.append((pending, end))
+            pending = None
+    if pending is not None:
+        if merged and len(text) - merged[-1][0] <= max_chars:
+            merged[-1] = (merged[-1][0], len(text))
+        else:
+            merged.append((pending, len(text)))
+
+    segments = []
+    for start, end in merged:
+        sentence = text[start:end].strip()
+        segments.extend(_split_long(sentence, max_chars) if len(sentence) > max_chars else [sentence])
+    return segments
+
+
+def segment_key(text: str, language: str, engine: str, voice: str = "") -> str:
+    """Cache key for one segment; voice identifies the speaker (e.g. a sample's content hash)"""
+    identity = json.dumps([normalize_text(text), language, engine, voice], ensure_ascii=False)
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+
+
+def get_segment(key: str, suffix: str) -> Optional[bytes]:
+    data = _memory_cache.get(key)
+    if data is not None:
+        return data
+
+    cached_path = _disk_cache.get_path(key, suffix)
+    if cached_path:
+        try:
+            with open(cached_path, "rb") as f:
+                data = f.read()
+            _memory_cache.put(key, data)
+            return data
+        except OSError:
+            pass
+    return None
+
+
+def put_segment(key: str, data: bytes, suffix: str) -> None:
+    _memory_cache.put(key, data)
+    try:
+        _disk_cache.put_bytes(key, data, suffix)
+    except Exception as e:
+        print(f"[SpeechCache] Could not write segment: {e}")
+
+
+def cached_synthesis(text: str, language: str, engine: str, synthesize: Callable[[str], bytes],
+                     suffix: str, voice: str = "") -> bytes:
+    """
+    Encoded audio for one segment, calling synthesize(normalized_text) only on a miss
+    """
+    key = segment_key(text, language, engine, voice)
+    data = get_segment(key, suffix)
+    if data is not None:
+        return data
+
+    global synthesis_count
+    synthesis_count += 1
+    data = synthesize(normalize_text(text))
+    if data:
+        put_segment(key, data, suffix)
+    return data
+
+
+def get_speech_cache_stats() -> dict:
+    return {"synthesized": synthesis_count, "memory": _memory_cache.stats(), "disk": _disk_cache.stats()}
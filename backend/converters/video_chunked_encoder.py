@@ -0,0 +1,364 @@
+# converters/video_chunked_encoder.py - Segmented parallel video encoding
+"""
+Long videos are encoded as independent segments:
+
+1. The video stream is split at keyframes with the segment muxer (stream
+   copy, no decoding)
+2. Each segment is encoded by its own FFmpeg process; the audio track is
+   encoded once from the original in parallel
+3. The encoded segments are joined with the concat demuxer and the audio
+   is muxed back in (stream copy)
+
+x264/x265 stop scaling well past a handful of threads, so several smaller
+encoders keep all cores busy where one process cannot.
+
+Segment tasks are published as JSON files in a job directory under
+UPLOAD_DIR/video_chunks. The local server works through them itself, and
+other hosts that mount the same uploads directory can help by running
+
+    python -m converters.video_chunked_encoder
+
+A task is claimed by atomically renaming its file, so each segment is
+encoded exactly once even with several hosts polling the same job.
+"""
+import asyncio
+import glob
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, List, Optional
+
+if __name__ == "__main__":
+    # Allow running as a worker from the backend directory
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from converters import video_converter
+from converters.media_analysis import cap_bitrates
+from utils.config import (
+    UPLOAD_DIR, VIDEO_CHUNK_MIN_DURATION, VIDEO_CHUNK_WORKERS,
+    VIDEO_CHUNK_MIN_SEGMENT_SECONDS, VIDEO_CHUNK_TIMEOUT, VIDEO_CHUNK_CLAIM_TIMEOUT
+)
+
+CHUNK_JOBS_DIR = os.path.join(UPLOAD_DIR, "video_chunks")
+
+# Targets whose codecs/containers concatenate cleanly with stream copy
+CHUNKABLE_FORMATS = {'mp4', 'mov', 'mkv', 'webm', 'h264', 'x264', 'h265', 'hevc', 'x265'}
+
+# Segments (and the audio track) are kept in Matroska until the final mux,
+# since it stores every codec and timestamp layout we produce
+SEGMENT_EXT = ".mkv"
+
+CREATION_FLAGS = subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+
+# A claimed task's file is touched this often while its segment encodes;
+# claims untouched for VIDEO_CHUNK_CLAIM_TIMEOUT are considered abandoned
+CLAIM_HEARTBEAT_SECONDS = min(60, VIDEO_CHUNK_CLAIM_TIMEOUT / 4)
+
+
+def should_chunk(video_info: Optional[dict], target_format: str) -> bool:
+    """Whether a probed video is long enough (and the target suitable) for chunked encoding"""
+    if target_format.lower() not in CHUNKABLE_FORMATS or not video_info:
+        return False
+    try:
+        duration = float(video_info.get("format", {}).get("duration") or 0)
+    except (TypeError, ValueError):
+        return False
+    has_video = any(s.get("codec_type") == "video" for s in video_info.get("streams", []))
+    return has_video and duration >= VIDEO_CHUNK_MIN_DURATION
+
+
+def _encode_args(target_format: str, quality: str) -> List[str]:
+    """Video encoder arguments shared by every segment (same as a single-process encode)"""
+    args = list(video_converter.QUALITY_SETTINGS.get(quality, video_converter.QUALITY_SETTINGS["medium"]))
+    # faststart only matters for the final file
+    if "-movflags" in args:
+        index = args.index("-movflags")
+        del args[index:index + 2]
+    args.extend(video_converter.FORMAT_SETTINGS[target_format.lower()])
+    return args
+
+
+class _ProcessGroup:
+    """FFmpeg processes started from worker threads, killed together when their job fails"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes: List[subprocess.Popen] = []
+        self.stopped = False
+
+    def start(self, cmd: List[str], **kwargs) -> subprocess.Popen:
+        with self._lock:
+            if self.stopped:
+                raise RuntimeError("Job was stopped")
+            process = subprocess.Popen(cmd, **kwargs)
+            self._processes.append(process)
+            return process
+
+    def kill(self) -> None:
+        with self._lock:
+            self.stopped = True
+            for process in self._processes:
+                if process.poll() is None:
+                    process.kill()
+
+
+def _run_ffmpeg(args: List[str], cwd: Optional[str] = None, timeout: int = VIDEO_CHUNK_TIMEOUT,
+                group: Optional[_ProcessGroup] = None) -> None:
+    cmd = [video_converter.FFMPEG_PATH, "-y", "-v", "error"] + args
+    options = dict(cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                   text=True, errors="replace", creationflags=CREATION_FLAGS)
+    process = group.start(cmd, **options) if group else subprocess.Popen(cmd, **options)
+    try:
+        _, stderr = process.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise
+    if process.returncode != 0:
+        raise RuntimeError(f"FFmpeg failed ({process.returncode}): {stderr.strip()[-500:]}")
+
+
+def _claim_task(job_dir: str, task_name: str) -> Optional[str]:
+    """Atomically claim a published task; returns the claimed path or None if taken"""
+    claimed_path = os.path.join(job_dir, "claimed", f"{task_name}.{socket.gethostname()}.{os.getpid()}")
+    try:
+        os.rename(os.path.join(job_dir, "tasks", task_name), claimed_path)
+        # rename keeps the publish time; the claim's age starts now
+        os.utime(claimed_path)
+        return claimed_path
+    except OSError:
+        return None
+
+
+def run_segment_task(job_dir: str, claimed_path: str) -> None:
+    """Encode one claimed segment and mark it done (also used by remote workers)"""
+    with open(claimed_path) as f:
+        task = json.load(f)
+
+    args = ["-i", task["input"]] + task["args"] + [
+        "-threads", str(task["threads"]), "-f", "matroska", task["output"] + ".part"
+    ]
+
+    # Keep the claim fresh so long segments aren't re-queued while encoding
+    finished = threading.Event()
+
+    def heartbeat():
+        while not finished.wait(CLAIM_HEARTBEAT_SECONDS):
+            try:
+                os.utime(claimed_path)
+            except OSError:
+                return
+
+    heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+    heartbeat_thread.start()
+    try:
+        _run_ffmpeg(args, cwd=job_dir)
+        os.replace(os.path.join(job_dir, task["output"] + ".part"), os.path.join(job_dir, task["output"]))
+        marker = os.path.join(job_dir, "done", task["name"])
+    except Exception as e:
+        print(f"[Chunked] Segment {task['name']} failed: {e}")
+        marker = os.path.join(job_dir, "failed", task["name"])
+    finally:
+        finished.set()
+        heartbeat_thread.join()
+
+    try:
+        with open(marker, "w") as f:
+            f.write(socket.gethostname())
+        os.remove(claimed_path)
+    except OSError:
+        # The job was cancelled (and its directory removed) meanwhile
+        pass
+
+
+def _work_on_job(job_dir: str) -> int:
+    """Claim and encode tasks of one job until none are left; returns the number encoded"""
+    encoded = 0
+    while True:
+        try:
+            task_names = sorted(os.listdir(os.path.join(job_dir, "tasks")))
+        except FileNotFoundError:
+            return encoded
+
+        claimed_path = None
+        for task_name in task_names:
+            claimed_path = _claim_task(job_dir, task_name)
+            if claimed_path:
+                break
+        if claimed_path is None:
+            return encoded
+
+        run_segment_task(job_dir, claimed_path)
+        encoded += 1
+
+
+def _requeue_stale_claims(job_dir: str) -> None:
+    """Publish segments again when the host that claimed them went quiet"""
+    cutoff = time.time() - VIDEO_CHUNK_CLAIM_TIMEOUT
+    for claimed_path in glob.glob(os.path.join(job_dir, "claimed", "*")):
+        try:
+            if os.path.getmtime(claimed_path) < cutoff:
+                task_name = os.path.basename(claimed_path).split(".")[0] + ".json"
+                os.rename(claimed_path, os.path.join(job_dir, "tasks", task_name))
+                print(f"[Chunked] Re-queued stale segment {task_name}")
+        except OSError:
+            pass
+
+
+async def convert_video_chunked(
+    input_path: str,
+    output_path: str,
+    target_format: str,
+    quality: str,
+    video_info: dict,
+    copy_audio: bool = False,
+    progress: Optional[Callable[[float], None]] = None
+) -> bool:
+    """
+    Encode a video as parallel keyframe-aligned segments
+
+    Produces the same codecs and container as convert_video, with the same
+    bitrate caps. Returns False (after cleaning up) if any step fails, so
+    callers can fall back to a single-process encode. copy_audio keeps the
+    source audio stream as-is. progress receives the fraction of segments
+    encoded (0-1).
+    """
+    duration = float(video_info["format"]["duration"])
+    has_audio = any(s.get("codec_type") == "audio" for s in video_info.get("streams", []))
+
+    workers = VIDEO_CHUNK_WORKERS
+    threads = max(1, (os.cpu_count() or 2) // workers)
+    # About four segments per worker balances uneven segment costs
+    segment_seconds = max(VIDEO_CHUNK_MIN_SEGMENT_SECONDS, duration / (workers * 4))
+
+    job_dir = os.path.join(CHUNK_JOBS_DIR, uuid.uuid4().hex)
+    for sub_dir in ("source", "tasks", "claimed", "done", "failed"):
+        os.makedirs(os.path.join(job_dir, sub_dir), exist_ok=True)
+
+    audio_task = None
+    audio_processes = _ProcessGroup()
+    started = time.time()
+    print(f"[Chunked] {duration:.0f}s video, ~{segment_seconds:.0f}s segments, {workers} workers x {threads} threads")
+
+    try:
+        # 1. Split the video stream at keyframes (no re-encoding)
+        await asyncio.to_thread(_run_ffmpeg, [
+            "-i", os.path.abspath(input_path), "-map", "0:v:0", "-c", "copy",
+            "-f", "segment", "-segment_time", f"{segment_seconds:.3f}",
+            "-reset_timestamps", "1", os.path.join("source", f"%05d{SEGMENT_EXT}")
+        ], job_dir)
+        segments = sorted(os.listdir(os.path.join(job_dir, "source")))
+        if not segments:
+            raise RuntimeError("Segmenting produced no output")
+
+        # 2. Publish one task per segment, then encode them (and the audio)
+        encode_args = cap_bitrates(_encode_args(target_format, quality), video_info) + ["-an"]
+        for segment in segments:
+            name = os.path.splitext(segment)[0]
+            task = {
+                "name": name,
+                "input": os.path.join("source", segment),
+                "output": f"encoded_{name}{SEGMENT_EXT}",
+                "args": encode_args,
+                "threads": threads
+            }
+            task_path = os.path.join(job_dir, "tasks", f"{name}.json")
+            with open(task_path + ".tmp", "w") as f:
+                json.dump(task, f)
+            os.replace(task_path + ".tmp", task_path)
+        print(f"[Chunked] Published {len(segments)} segments")
+
+        if has_audio:
+            audio_args = ["-i", os.path.abspath(input_path), "-map", "0:a:0", "-vn"]
+            if copy_audio:
+                audio_args += ["-c:a", "copy"]
+            else:
+                audio_args += cap_bitrates(video_converter.FORMAT_SETTINGS[target_format.lower()], video_info)
+            audio_task = asyncio.create_task(asyncio.to_thread(
+                _run_ffmpeg, audio_args + [os.path.join(job_dir, f"audio{SEGMENT_EXT}")],
+                group=audio_processes
+            ))
+
+        while True:
+            local_workers = asyncio.gather(*(
+                asyncio.to_thread(_work_on_job, job_dir) for _ in range(workers)
+            ))
+            while not local_workers.done():
+                await asyncio.wait([local_workers], timeout=1)
+                if progress:
+                    progress(len(os.listdir(os.path.join(job_dir, "done"))) / len(segments))
+            await local_workers
+
+            done = len(os.listdir(os.path.join(job_dir, "done")))
+            if progress:
+                progress(done / len(segments))
+            failed = os.listdir(os.path.join(job_dir, "failed"))
+            if failed:
+                raise RuntimeError(f"{len(failed)} segment(s) failed to encode")
+            if done == len(segments):
+                break
+
+            # Remaining segments are being encoded by other hosts
+            await asyncio.sleep(1)
+            _requeue_stale_claims(job_dir)
+
+        if audio_task:
+            await audio_task
+
+        # 3. Join segments and mux the audio back in, all stream copy
+        concat_list = os.path.join(job_dir, "concat.txt")
+        with open(concat_list, "w") as f:
+            for segment in segments:
+                f.write(f"file 'encoded_{os.path.splitext(segment)[0]}{SEGMENT_EXT}'\n")
+
+        final_args = ["-f", "concat", "-safe", "0", "-i", concat_list]
+        if has_audio:
+            final_args += ["-i", os.path.join(job_dir, f"audio{SEGMENT_EXT}"), "-map", "0:v", "-map", "1:a"]
+        final_args += ["-c", "copy"]
+        if output_path.lower().endswith((".mp4", ".mov")):
+            final_args += ["-movflags", "+faststart"]
+        final_args.append(output_path)
+        await asyncio.to_thread(_run_ffmpeg, final_args)
+
+        if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+            raise RuntimeError("Output file is missing or empty")
+
+        print(f"[Chunked] Encoded {len(segments)} segments in {time.time() - started:.1f}s")
+        return True
+
+    except Exception as e:
+        print(f"[Chunked] Chunked encoding failed: {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return False
+
+    finally:
+        if audio_task:
+            # A thread can't be cancelled: stop the audio encode by killing
+            # its FFmpeg process, and wait for the thread before removing
+            # the directory it writes into
+            if not audio_task.done():
+                audio_processes.kill()
+            await asyncio.gather(audio_task, return_exceptions=True)
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def run_chunk_worker(poll_interval: float = 1.0) -> None:
+    """Help encode segments published by any server sharing CHUNK_JOBS_DIR (runs forever)"""
+    print(f"[Chunked] Worker {socket.gethostname()} polling {os.path.abspath(CHUNK_JOBS_DIR)}")
+    while True:
+        encoded = 0
+        for job_dir in glob.glob(os.path.join(CHUNK_JOBS_DIR, "*")):
+            encoded += _work_on_job(job_dir)
+        if not encoded:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    run_chunk_worker()
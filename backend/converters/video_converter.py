@@ -3,12 +3,17 @@
 import os
 import subprocess
 import shlex
-from typing import Optional
+from typing import Optional, Callable
 import logging
 import threading
 import queue
 import asyncio
 import json
+import re
+import shutil
+import tempfile
+
+from converters.media_analysis import analyze_media_async, cap_bitrates
 
 logger = logging.getLogger(__name__)
 
@@ -64,9 +69,264 @@ def check_ffmpeg():
 
 FFMPEG_AVAILABLE = check_ffmpeg()
 
+# Quality presets
+DEFAULT_QUALITY = "medium"
+
+QUALITY_SETTINGS = {
+    "high": ["-crf", "18", "-preset", "medium"],
+    "medium": ["-crf", "23", "-preset", "fast"], 
+    "low": ["-crf", "28", "-preset", "veryfast"],
+    "web": ["-crf", "25", "-preset", "fast", "-movflags", "+faststart"]
+}
+
+# Comprehensive format settings - handles containers and codecs
+FORMAT_SETTINGS = {
+    # Container formats
+    'mp4': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
+    'mov': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
+    'avi': ["-c:v", "libx264", "-c:a", "aac"],
+    'mkv': ["-c:v", "libx264", "-c:a", "aac"],
+    'webm': ["-c:v", "libvpx-vp9", "-c:a", "libopus", "-b:v", "1M"],
+    'wmv': ["-c:v", "wmv2", "-c:a", "wmav2"],
+    'flv': ["-c:v", "libx264", "-c:a", "aac", "-f", "flv"],
+    'mpeg': ["-c:v", "mpeg2video", "-c:a", "mp2"],
+
+    # Codec formats - these output as MP4 with specified codec
+    'h264': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
+    'x264': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
+    'h265': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
+    'hevc': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
+    'x265': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
+}
+
+# Source codecs (ffprobe codec_name) that each target can take as-is with
+# -c copy. Only the codecs the target would encode to anyway (or that the
+# container is normally expected to carry) are listed, so a remuxed output
+# plays wherever a re-encoded one would.
+STREAM_COPY_CODECS = {
+    'mp4': {'video': {'h264'}, 'audio': {'aac', 'mp3'}},
+    'mov': {'video': {'h264'}, 'audio': {'aac', 'mp3'}},
+    'mkv': {'video': {'h264', 'hevc', 'vp8', 'vp9', 'av1'},
+            'audio': {'aac', 'mp3', 'opus', 'vorbis', 'flac', 'ac3'}},
+    'webm': {'video': {'vp8', 'vp9', 'av1'}, 'audio': {'opus', 'vorbis'}},
+    'avi': {'video': {'h264'}, 'audio': {'aac', 'mp3'}},
+    'flv': {'video': {'h264'}, 'audio': {'aac', 'mp3'}},
+    'wmv': {'video': {'wmv2'}, 'audio': {'wmav2'}},
+    'mpeg': {'video': {'mpeg2video'}, 'audio': {'mp2'}},
+    'h264': {'video': {'h264'}, 'audio': {'aac'}},
+    'x264': {'video': {'h264'}, 'audio': {'aac'}},
+    'h265': {'video': {'hevc'}, 'audio': {'aac'}},
+    'hevc': {'video': {'hevc'}, 'audio': {'aac'}},
+    'x265': {'video': {'hevc'}, 'audio': {'aac'}},
+}
+
+def plan_streams(video_info: Optional[dict], target_format: str) -> dict:
+    """
+    Decide per stream type whether to copy or re-encode
+
+    Returns {"video": ..., "audio": ...} with "copy", "encode" or None (no
+    such stream). Without probe data everything is re-encoded.
+    """
+    plan = {"video": "encode", "audio": "encode"}
+    if not video_info or target_format not in STREAM_COPY_CODECS:
+        return plan
+
+    compatible = STREAM_COPY_CODECS[target_format]
+    for stream_type in ("video", "audio"):
+        stream = next((
+            s for s in video_info.get("streams", [])
+            if s.get("codec_type") == stream_type
+            # Cover art is reported as a video stream
+            and not s.get("disposition", {}).get("attached_pic")
+        ), None)
+        if stream is None:
+            plan[stream_type] = None
+        elif stream.get("codec_name") in compatible[stream_type]:
+            plan[stream_type] = "copy"
+    return plan
+
+def plan_path(plan: dict) -> str:
+    """Name the path a plan takes: remux, partial_remux or transcode"""
+    actions = [action for action in plan.values() if action]
+    if actions and all(action == "copy" for action in actions):
+        return "remux"
+    if "copy" in actions:
+        return "partial_remux"
+    return "transcode"
+
+def build_output_args(target_format: str, quality: str, plan: Optional[dict] = None,
+                      quality_args: Optional[list] = None) -> list:
+    """
+    FFmpeg output options for a target, honoring a stream plan
+
+    Copied streams get -c:<type> copy and drop that type's encoder options
+    (CRF/preset only apply to video); container options are always kept.
+    quality_args replaces the preset's rate control (see
+    converters/video_rate_control.py) and overrides the target's own
+    options for the same flags (e.g. WebM's fixed -b:v).
+    """
+    format_args = FORMAT_SETTINGS.get(target_format, ["-c:v", "libx264", "-c:a", "aac"])
+    if quality_args is None:
+        quality_args = QUALITY_SETTINGS.get(quality, QUALITY_SETTINGS["medium"])
+    else:
+        overridden = set(quality_args[::2])
+        format_args = [arg for pair in zip(format_args[::2], format_args[1::2])
+                       if pair[0] not in overridden for arg in pair]
+    if plan is None:
+        return quality_args + format_args
+
+    args = []
+    for stream_type in ("video", "audio"):
+        if plan.get(stream_type) == "copy":
+            args.extend([f"-c:{stream_type[0]}", "copy"])
+
+    for options in (quality_args, format_args):
+        for flag, value in zip(options[::2], options[1::2]):
+            if flag.endswith(":v") or flag in ("-crf", "-preset", "-maxrate", "-bufsize", "-vf", "-row-mt"):
+                stream_type = "video"
+            elif flag.endswith(":a"):
+                stream_type = "audio"
+            else:
+                stream_type = None
+            if stream_type is None or plan.get(stream_type) != "copy":
+                args.extend([flag, value])
+    return args
+
+FFMPEG_TIME_PATTERN = re.compile(r"time=(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+def _run_conversion(cmd: list, input_path: str, output_path: str,
+                    duration: Optional[float] = None,
+                    progress: Optional[Callable[[float], None]] = None) -> bool:
+    """
+    Run an FFmpeg conversion command, logging progress (blocking)
+
+    With the input duration known, progress is called with the completed
+    fraction (0-1) parsed from FFmpeg's time= output.
+    """
+    # Log the complete command
+    cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
+    print(f"FFmpeg command: {cmd_str}")
+    logger.info(f"FFmpeg command: {cmd_str}")
+    
+    # Execute conversion
+    print("[*] Starting FFmpeg process...")
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        bufsize=1,
+        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    )
+    
+    # Read output in real-time
+    stderr_lines = []
+    
+    def read_stderr():
+        for line in iter(process.stderr.readline, ''):
+            if line.strip():
+                # Encode-safe version for Windows console
+                safe_line = line.strip().encode('ascii', errors='ignore').decode('ascii')
+                stderr_lines.append(safe_line)
+                # Only print progress and important messages
+                if any(keyword in safe_line.lower() for keyword in ['time=', 'error', 'warning']):
+                    print(f"FFmpeg: {safe_line}")
+                if progress and duration:
+                    match = FFMPEG_TIME_PATTERN.search(safe_line)
+                    if match:
+                        hours, minutes, seconds = match.groups()
+                        elapsed = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+                        progress(min(elapsed / duration, 1.0))
+    
+    # Start reading thread
+    stderr_thread = threading.Thread(target=read_stderr)
+    stderr_thread.start()
+    
+    # Wait for completion with timeout
+    try:
+        return_code = process.wait(timeout=1800)  # 30 minutes
+        
+        # Wait for thread to finish
+        stderr_thread.join(timeout=5)
+        
+        print(f"FFmpeg finished with return code: {return_code}")
+        
+        if return_code == 0:
+            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                output_size = os.path.getsize(output_path)
+                print(f"✅ Conversion successful!")
+                print(f"Output file size: {output_size} bytes ({output_size/1024/1024:.2f} MB)")
+                logger.info(f"Video conversion successful: {input_path} -> {output_path}")
+                return True
+            else:
+                print("[ERROR] Output file is missing or empty")
+                logger.error("Output file missing or empty")
+                return False
+        else:
+            print(f"[ERROR] FFmpeg failed with return code: {return_code}")
+            if stderr_lines:
+                print("Last error messages:")
+                for line in stderr_lines[-5:]:
+                    print(f"  {line}")
+            logger.error(f"FFmpeg failed: {return_code}")
+            return False
+            
+    except subprocess.TimeoutExpired:
+        print("[ERROR] Conversion timed out after 30 minutes")
+        process.kill()
+        stderr_thread.join(timeout=2)
+        logger.error("Video conversion timed out")
+        return False
+
+def _run_two_pass(output_args: list, rate_control: dict, input_path: str, output_path: str,
+                  duration: Optional[float] = None,
+                  progress: Optional[Callable[[float], None]] = None) -> bool:
+    """
+    Two-pass ABR encode (blocking)
+
+    The analysis pass skips audio and writes to the output path, which the
+    second pass then overwrites; the pass log lives in a temporary directory
+    next to the output.
+    """
+    from converters.video_rate_control import pass_args
+
+    log_dir = tempfile.mkdtemp(prefix="twopass_", dir=os.path.dirname(os.path.abspath(output_path)))
+    log_prefix = os.path.join(log_dir, "pass")
+    try:
+        first_pass = [FFMPEG_PATH, "-y", "-i", input_path] + output_args \
+            + pass_args(rate_control, 1, log_prefix) + ["-an", output_path]
+        first_progress = (lambda fraction: progress(fraction / 2)) if progress else None
+        if not _run_conversion(first_pass, input_path, output_path, duration, first_progress):
+            return False
+
+        second_pass = [FFMPEG_PATH, "-y", "-i", input_path] + output_args \
+            + pass_args(rate_control, 2, log_prefix) + [output_path]
+        second_progress = (lambda fraction: progress(0.5 + fraction / 2)) if progress else None
+        return _run_conversion(second_pass, input_path, output_path, duration, second_progress)
+    finally:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
 async def convert_video(input_path: str, output_path: str, target_format: str, 
-                       quality: str = "medium") -> bool:
-    """Convert video with comprehensive format and codec support"""
+                       quality: str = DEFAULT_QUALITY, chunked: Optional[bool] = None,
+                       stream_copy: Optional[bool] = None, report: Optional[dict] = None,
+                       progress: Optional[Callable[[float], None]] = None,
+                       target_size_mb: Optional[float] = None) -> bool:
+    """
+    Convert video with comprehensive format and codec support
+
+    chunked: True/False forces segmented parallel encoding on/off; None
+    uses it for long videos (see converters/video_chunked_encoder.py)
+    stream_copy: copy streams whose codec the target already accepts
+    (remux) instead of re-encoding them; None does so only when the
+    container changes at the default quality
+    report: optional dict filled with the path taken ("remux",
+    "partial_remux", "transcode" or "chunked") and the per-stream plan
+    progress: optional callback receiving the completed fraction (0-1)
+    quality: a QUALITY_SETTINGS preset, or "auto" to pick CRF and preset
+    from sample encodes of this video
+    target_size_mb: encode with two-pass ABR to about this file size
+    (report["error"] explains targets that can't be met)
+    """
     
     print(f"Starting video conversion:")
     print(f"   Input: {input_path}")
@@ -74,6 +334,9 @@ async def convert_video(input_path: str, output_path: str, target_format: str,
     print(f"   Format: {target_format}")
     print(f"   Quality: {quality}")
     
+    if report is None:
+        report = {}
+    
     if not FFMPEG_AVAILABLE:
         print("[ERROR] FFmpeg not available - cannot convert video")
         return False
@@ -83,43 +346,6 @@ async def convert_video(input_path: str, output_path: str, target_format: str,
         return False
     
     try:
-        # Quality presets
-        quality_settings = {
-            "high": ["-crf", "18", "-preset", "medium"],
-            "medium": ["-crf", "23", "-preset", "fast"], 
-            "low": ["-crf", "28", "-preset", "veryfast"],
-            "web": ["-crf", "25", "-preset", "fast", "-movflags", "+faststart"]
-        }
-        
-        # Comprehensive format settings - handles containers and codecs
-        format_settings = {
-            # Container formats
-            'mp4': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
-            'mov': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
-            'avi': ["-c:v", "libx264", "-c:a", "aac"],
-            'mkv': ["-c:v", "libx264", "-c:a", "aac"],
-            'webm': ["-c:v", "libvpx-vp9", "-c:a", "libopus", "-b:v", "1M"],
-            'wmv': ["-c:v", "wmv2", "-c:a", "wmav2"],
-            'flv': ["-c:v", "libx264", "-c:a", "aac", "-f", "flv"],
-            'mpeg': ["-c:v", "mpeg2video", "-c:a", "mp2"],
-
-            # Codec formats - these output as MP4 with specified codec
-            'h264': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
-            'x264': ["-c:v", "libx264", "-c:a", "aac", "-profile:v", "main"],
-            'h265': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
-            'hevc': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
-            'x265': ["-c:v", "libx265", "-c:a", "aac", "-profile:v", "main"],
-        }
-        
-        # Build FFmpeg command
-        cmd = [FFMPEG_PATH, "-y", "-i", input_path]
-        
-        # Add quality settings
-        if quality in quality_settings:
-            cmd.extend(quality_settings[quality])
-        else:
-            cmd.extend(quality_settings["medium"])
-        
         # Handle format settings
         target_format_lower = target_format.lower()
         
@@ -131,92 +357,95 @@ async def convert_video(input_path: str, output_path: str, target_format: str,
                 output_path = output_path.rsplit('.', 1)[0] + '.mp4'
                 print(f"Codec format detected, changing output to: {output_path}")
         
-        # Add format-specific encoding settings
-        if target_format_lower in format_settings:
-            cmd.extend(format_settings[target_format_lower])
-        else:
+        if target_format_lower not in FORMAT_SETTINGS:
             print(f"⚠️  Unknown format {target_format}, using default H.264 settings")
-            cmd.extend(["-c:v", "libx264", "-c:a", "aac"])
         
+        # A quality choice or a same-container target asks for a re-encode;
+        # remux by default only when just the container changes
+        if stream_copy is None:
+            same_container = os.path.splitext(input_path)[1].lower() == os.path.splitext(output_path)[1].lower()
+            stream_copy = not same_container and quality == DEFAULT_QUALITY
+
+        # Probe once; the stream plan and chunking decision both use it
+        video_info = await get_video_info(input_path)
+        if stream_copy:
+            plan = plan_streams(video_info, target_format_lower)
+        else:
+            plan = {"video": "encode", "audio": "encode"}
+        
+        # Size and quality targets need the video re-encoded, unless the
+        # source already fits the requested size
+        rate_control = None
+        if (target_size_mb or quality == "auto") and plan["video"] == "copy":
+            fits = target_size_mb and os.path.getsize(input_path) <= target_size_mb * 1024 * 1024
+            if not fits:
+                plan["video"] = "encode"
+        if (target_size_mb or quality == "auto") and plan["video"] == "encode":
+            from converters.video_rate_control import plan_rate_control
+            try:
+                rate_control = await asyncio.to_thread(
+                    plan_rate_control, input_path, video_info, target_format_lower, quality,
+                    target_size_mb, plan["audio"] == "copy"
+                )
+            except ValueError as e:
+                print(f"[ERROR] {e}")
+                report["error"] = str(e)
+                return False
+            if rate_control:
+                report["rate_control"] = {k: v for k, v in rate_control.items() if k != "args"}
+        
+        report.update(path=plan_path(plan), streams=plan)
+        print(f"Stream plan: {plan} ({report['path']})")
+        
+        # Long videos: encode keyframe-aligned segments in parallel
+        if plan["video"] == "encode" and chunked is not False and rate_control is None:
+            from converters.video_chunked_encoder import should_chunk, convert_video_chunked
+
+            if chunked or should_chunk(video_info, target_format_lower):
+                if video_info and target_format_lower in FORMAT_SETTINGS:
+                    if await convert_video_chunked(input_path, output_path, target_format_lower, quality,
+                                                   video_info, copy_audio=plan["audio"] == "copy",
+                                                   progress=progress):
+                        report["path"] = "chunked"
+                        return True
+                print("[WARNING] Chunked encoding not possible, using a single FFmpeg process")
+
         # Essential stability settings
-        cmd.extend([
+        stability_args = [
             "-threads", "0",  # Use all cores
             "-avoid_negative_ts", "make_zero",
             "-fflags", "+genpts",
             "-max_muxing_queue_size", "1024"
-        ])
-        
-        # Add output file
-        cmd.append(output_path)
+        ]
         
-        # Log the complete command
-        cmd_str = ' '.join(shlex.quote(arg) for arg in cmd)
-        print(f"FFmpeg command: {cmd_str}")
-        logger.info(f"FFmpeg command: {cmd_str}")
+        # Build FFmpeg command
+        duration = (video_info or {}).get("duration")
+        quality_args = rate_control["args"] if rate_control else None
         
-        # Execute conversion
-        print("[*] Starting FFmpeg process...")
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            bufsize=1,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        )
+        def output_args_for(stream_plan: dict) -> list:
+            args = build_output_args(target_format_lower, quality, stream_plan, quality_args)
+            return cap_bitrates(args, video_info) + stability_args
         
-        # Read output in real-time
-        stderr_lines = []
+        if rate_control and rate_control["passes"] == 2:
+            return await asyncio.to_thread(
+                _run_two_pass, output_args_for(plan), rate_control, input_path, output_path, duration, progress
+            )
         
-        def read_stderr():
-            for line in iter(process.stderr.readline, ''):
-                if line.strip():
-                    # Encode-safe version for Windows console
-                    safe_line = line.strip().encode('ascii', errors='ignore').decode('ascii')
-                    stderr_lines.append(safe_line)
-                    # Only print progress and important messages
-                    if any(keyword in safe_line.lower() for keyword in ['time=', 'error', 'warning']):
-                        print(f"FFmpeg: {safe_line}")
+        cmd = [FFMPEG_PATH, "-y", "-i", input_path] + output_args_for(plan) + [output_path]
         
-        # Start reading thread
-        stderr_thread = threading.Thread(target=read_stderr)
-        stderr_thread.start()
+        if await asyncio.to_thread(_run_conversion, cmd, input_path, output_path, duration, progress):
+            return True
         
-        # Wait for completion with timeout
-        try:
-            return_code = process.wait(timeout=1800)  # 30 minutes
-            
-            # Wait for thread to finish
-            stderr_thread.join(timeout=5)
-            
-            print(f"FFmpeg finished with return code: {return_code}")
-            
-            if return_code == 0:
-                if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                    output_size = os.path.getsize(output_path)
-                    print(f"✅ Conversion successful!")
-                    print(f"Output file size: {output_size} bytes ({output_size/1024/1024:.2f} MB)")
-                    logger.info(f"Video conversion successful: {input_path} -> {output_path}")
-                    return True
-                else:
-                    print("[ERROR] Output file is missing or empty")
-                    logger.error("Output file missing or empty")
-                    return False
-            else:
-                print(f"[ERROR] FFmpeg failed with return code: {return_code}")
-                if stderr_lines:
-                    print("Last error messages:")
-                    for line in stderr_lines[-5:]:
-                        print(f"  {line}")
-                logger.error(f"FFmpeg failed: {return_code}")
-                return False
-                
-        except subprocess.TimeoutExpired:
-            print("[ERROR] Conversion timed out after 30 minutes")
-            process.kill()
-            stderr_thread.join(timeout=2)
-            logger.error("Video conversion timed out")
+        if "copy" not in plan.values():
             return False
+        
+        # Some sources can't be copied into the target container (e.g. odd
+        # bitstream layouts); fall back to a full re-encode
+        print("[WARNING] Stream copy failed, re-encoding all streams")
+        plan = {"video": "encode", "audio": "encode"}
+        report.update(path="transcode", streams=plan)
+        cmd = [FFMPEG_PATH, "-y", "-i", input_path] + output_args_for(plan) + [output_path]
+        return await asyncio.to_thread(_run_conversion, cmd, input_path, output_path, duration, progress)
             
     except Exception as e:
         # Sanitize error message for Windows console
@@ -226,7 +455,11 @@ async def convert_video(input_path: str, output_path: str, target_format: str,
         return False
 
 async def get_video_info(input_path: str) -> Optional[dict]:
-    """Get video information"""
+    """
+    Get video information (raw ffprobe format/streams plus a summary)
+
+    Probes are cached by content, see converters/media_analysis.py.
+    """
     if not FFMPEG_AVAILABLE:
         return None
     
@@ -234,28 +467,7 @@ async def get_video_info(input_path: str) -> Optional[dict]:
         return None
     
     try:
-        cmd = [
-            FFPROBE_PATH, "-v", "quiet", "-print_format", "json",
-            "-show_format", "-show_streams", input_path
-        ]
-        
-        result = subprocess.run(
-            cmd, 
-            capture_output=True, 
-            text=True, 
-            timeout=30,
-            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
-        )
-        
-        if result.returncode == 0 and result.stdout.strip():
-            try:
-                data = json.loads(result.stdout)
-                return data
-            except json.JSONDecodeError:
-                return None
-        else:
-            return None
-            
+        return await analyze_media_async(input_path)
     except Exception:
         return None
 
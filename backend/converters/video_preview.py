@@ -0,0 +1,154 @@
+# converters/video_preview.py - Posters, thumbnail sprite and animated preview
+"""
+Preview images for a video from one keyframe-only FFmpeg pass
+
+`-skip_frame nokey` makes the decoder skip everything but keyframes, so a
+preview costs a small fraction of a full decode. One filter graph splits
+the keyframes into:
+
+- poster frames spread over the video (poster_01.jpg ...)
+- a sprite sheet of small thumbnails (sprite.jpg) plus a WebVTT thumbnail
+  track (thumbnails.vtt) mapping time ranges to sprite regions
+- a short low-res animated preview (preview.webp)
+
+The fps filter resamples the irregular keyframe times onto even intervals,
+so each image shows the nearest keyframe to its time. The last keyframe is
+cloned up to the full duration (tpad), so images after it repeat it rather
+than going missing.
+"""
+import os
+import shutil
+import subprocess
+
+from converters import video_converter
+from converters.media_analysis import analyze_media
+from utils.config import (
+    VIDEO_PREVIEW_POSTERS, VIDEO_PREVIEW_POSTER_WIDTH, VIDEO_PREVIEW_THUMB_WIDTH,
+    VIDEO_PREVIEW_SPRITE_COLUMNS, VIDEO_PREVIEW_MAX_THUMBS, VIDEO_PREVIEW_MIN_INTERVAL,
+    VIDEO_PREVIEW_ANIMATION_FRAMES, VIDEO_PREVIEW_ANIMATION_FPS, VIDEO_PREVIEW_ANIMATION_WIDTH
+)
+
+PREVIEW_TIMEOUT = 600
+
+
+def _even_size(width: int, height: int, target_width: int) -> tuple:
+    """Scale to target_width (never up), keeping the aspect ratio with even dimensions"""
+    target_width = min(target_width, width)
+    target_width -= target_width % 2
+    target_height = max(2, round(height * target_width / width / 2) * 2)
+    return target_width, target_height
+
+
+def _vtt_time(seconds: float) -> str:
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_thumbnail_track(path: str, sprite_name: str, count: int, interval: float,
+                          duration: float, thumb_size: tuple, columns: int) -> None:
+    """WebVTT track pointing each interval at its region of the sprite sheet"""
+    width, height = thumb_size
+    lines = ["WEBVTT", ""]
+    for i in range(count):
+        start = i * interval
+        end = min((i + 1) * interval, duration)
+        if start >= duration:
+            break
+        x, y = (i % columns) * width, (i // columns) * height
+        lines += [f"{_vtt_time(start)} --> {_vtt_time(end)}", f"{sprite_name}#xywh={x},{y},{width},{height}", ""]
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines))
+
+
+def generate_video_preview(input_path: str, output_dir: str) -> dict:
+    """
+    Write posters, sprite sheet, WebVTT track and animated preview (blocking)
+
+    Returns {success, posters, sprite, thumbnails, animation, interval,
+    duration} with file names relative to output_dir, or {success: False,
+    error} after removing the partial output.
+    """
+    if not video_converter.FFMPEG_AVAILABLE:
+        return {"success": False, "error": "FFmpeg not available"}
+
+    analysis = analyze_media(input_path)
+    video = (analysis or {}).get("video")
+    duration = (analysis or {}).get("duration")
+    if not video or not video.get("width") or not video.get("height") or not duration:
+        return {"success": False, "error": "Could not read the video stream"}
+
+    width, height = video["width"], video["height"]
+    poster_size = _even_size(width, height, VIDEO_PREVIEW_POSTER_WIDTH)
+    thumb_size = _even_size(width, height, VIDEO_PREVIEW_THUMB_WIDTH)
+    animation_size = _even_size(width, height, VIDEO_PREVIEW_ANIMATION_WIDTH)
+
+    interval = max(VIDEO_PREVIEW_MIN_INTERVAL, duration / VIDEO_PREVIEW_MAX_THUMBS)
+    thumb_count = max(1, min(VIDEO_PREVIEW_MAX_THUMBS, int(-(-duration // interval))))
+    columns = min(VIDEO_PREVIEW_SPRITE_COLUMNS, thumb_count)
+    rows = -(-thumb_count // columns)
+
+    posters = VIDEO_PREVIEW_POSTERS
+    poster_step = duration / posters
+    animation_step = duration / VIDEO_PREVIEW_ANIMATION_FRAMES
+
+    # Posters sit mid-interval so the first one isn't the (often black) opening frame
+    # The last keyframe can come long before the end (x264's default GOP is
+    # 10 s), so it is held to the full duration: every poster, tile and
+    # animation frame then exists
+    graph = ";".join([
+        f"[0:v]tpad=stop_mode=clone:stop_duration={duration:.3f},trim=end={duration:.3f},split=3[p][s][a]",
+        f"[p]fps=1/{poster_step:.6f}:start_time={poster_step / 2:.6f},"
+        f"scale={poster_size[0]}:{poster_size[1]}[posters]",
+        f"[s]fps=1/{interval:.6f},scale={thumb_size[0]}:{thumb_size[1]},"
+        f"tile={columns}x{rows}[sprite]",
+        f"[a]fps=1/{animation_step:.6f},scale={animation_size[0]}:{animation_size[1]},"
+        f"settb=1/{VIDEO_PREVIEW_ANIMATION_FPS},setpts=N[animation]"
+    ])
+
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = [
+        video_converter.FFMPEG_PATH, "-y", "-v", "error",
+        "-skip_frame", "nokey", "-i", input_path,
+        "-filter_complex", graph,
+        "-map", "[posters]", "-frames:v", str(posters), "-q:v", "3",
+        os.path.join(output_dir, "poster_%02d.jpg"),
+        "-map", "[sprite]", "-frames:v", "1", "-q:v", "4",
+        os.path.join(output_dir, "sprite.jpg"),
+        "-map", "[animation]", "-frames:v", str(VIDEO_PREVIEW_ANIMATION_FRAMES),
+        "-c:v", "libwebp_anim", "-loop", "0", "-quality", "60", "-r", str(VIDEO_PREVIEW_ANIMATION_FPS),
+        os.path.join(output_dir, "preview.webp")
+    ]
+
+    try:
+        result = subprocess.run(
+            cmd,
+            capture_output=True,
+            text=True,
+            errors="replace",
+            timeout=PREVIEW_TIMEOUT,
+            creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip()[-300:])
+
+        poster_files = sorted(f for f in os.listdir(output_dir) if f.startswith("poster_"))
+        if not poster_files or not os.path.exists(os.path.join(output_dir, "sprite.jpg")):
+            raise RuntimeError("FFmpeg produced no preview images")
+
+        write_thumbnail_track(os.path.join(output_dir, "thumbnails.vtt"), "sprite.jpg",
+                              thumb_count, interval, duration, thumb_size, columns)
+    except Exception as e:
+        print(f"[Preview] Preview generation failed: {e}")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return {"success": False, "error": f"Preview generation failed: {e}"}
+
+    return {
+        "success": True,
+        "posters": poster_files,
+        "sprite": "sprite.jpg",
+        "thumbnails": "thumbnails.vtt",
+        "animation": "preview.webp" if os.path.exists(os.path.join(output_dir, "preview.webp")) else None,
+        "interval": round(interval, 3),
+        "duration": duration
+    }
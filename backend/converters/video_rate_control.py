@@ -0,0 +1,277 @@
+# converters/video_rate_control.py - Target-size and automatic quality rate control
+"""
+Rate control beyond the fixed CRF presets in QUALITY_SETTINGS
+
+- Target size: two-pass ABR at the video bitrate that fits the requested
+  file size (after the audio budget). The bitrate never exceeds the
+  source's, and the output is downscaled when the budget would leave too
+  few bits per pixel.
+- Automatic quality (quality="auto"): a few short samples spread over the
+  video are encoded at candidate CRFs and the highest CRF whose SSIM
+  against the source reaches VIDEO_AUTO_SSIM_TARGET is used, so simple or
+  small inputs get a higher CRF and detailed ones a lower one. The preset
+  follows the amount of work (pixels x frames), and the bitrate is capped
+  to the source's with -maxrate.
+
+Both return a settings dict whose "args" replace the quality arguments of
+a normal conversion (see build_output_args in video_converter.py).
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from typing import List, Optional
+
+from converters import video_converter
+from utils.cache import LRUCache
+from utils.config import (
+    UPLOAD_DIR, VIDEO_AUTO_SSIM_TARGET, VIDEO_AUTO_SAMPLE_COUNT, VIDEO_AUTO_SAMPLE_SECONDS,
+    VIDEO_AUTO_CRF_RANGES, VIDEO_MIN_BITS_PER_PIXEL
+)
+
+# Faster presets for bigger encodes: (max pixels x frames, preset)
+AUTO_PRESETS = [(5e9, "medium"), (5e10, "fast"), (None, "veryfast")]
+
+# Audio budget when the audio is re-encoded in target-size mode
+TARGET_SIZE_AUDIO_BITRATE = 128000
+# Container overhead reserved out of the target size
+TARGET_SIZE_OVERHEAD = 0.02
+MIN_TARGET_VIDEO_BITRATE = 50000
+
+# Heights tried (largest first) when a target size needs a downscale
+DOWNSCALE_HEIGHTS = (2160, 1440, 1080, 720, 540, 480, 360, 240)
+
+SSIM_PATTERN = re.compile(r"All:(\d+(?:\.\d+)?)")
+
+# Automatic CRF decisions by content hash, target encoder and preset
+_auto_cache = LRUCache(1024, sizeof=lambda _: 1)
+
+
+def video_encoder(target_format: str) -> Optional[str]:
+    """The -c:v encoder a target format uses"""
+    args = video_converter.FORMAT_SETTINGS.get(target_format, ["-c:v", "libx264"])
+    return args[args.index("-c:v") + 1] if "-c:v" in args else None
+
+
+def choose_preset(video_info: Optional[dict], quality: str) -> str:
+    """Fixed preset for the named quality, or one sized to the encode for "auto" """
+    if quality in video_converter.QUALITY_SETTINGS:
+        quality_args = video_converter.QUALITY_SETTINGS[quality]
+        return quality_args[quality_args.index("-preset") + 1]
+
+    video = (video_info or {}).get("video") or {}
+    work = (video.get("width") or 1920) * (video.get("height") or 1080) \
+        * (video.get("fps") or 30) * ((video_info or {}).get("duration") or 60)
+    for max_work, preset in AUTO_PRESETS:
+        if max_work is None or work <= max_work:
+            return preset
+
+
+def _run_ffmpeg(args: List[str], timeout: int = 600) -> str:
+    """Run FFmpeg and return its stderr (raises on failure)"""
+    result = subprocess.run(
+        [video_converter.FFMPEG_PATH, "-y", "-hide_banner", "-nostats"] + args,
+        capture_output=True,
+        text=True,
+        errors="replace",
+        timeout=timeout,
+        creationflags=subprocess.CREATE_NO_WINDOW if os.name == 'nt' else 0
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg failed ({result.returncode}): {result.stderr.strip()[-300:]}")
+    return result.stderr
+
+
+def _extract_reference(input_path: str, video_info: dict, reference_path: str) -> None:
+    """Join a few short samples spread over the video into one lossless clip"""
+    duration = video_info.get("duration") or 0
+    count, seconds = VIDEO_AUTO_SAMPLE_COUNT, VIDEO_AUTO_SAMPLE_SECONDS
+
+    if duration <= count * seconds * 2:
+        starts = [0.0]
+        seconds = min(duration or count * seconds, count * seconds)
+    else:
+        starts = [duration * (i + 1) / (count + 1) - seconds / 2 for i in range(count)]
+
+    args = []
+    for start in starts:
+        args += ["-ss", f"{start:.3f}", "-t", f"{seconds:.3f}", "-i", input_path]
+    inputs = "".join(f"[{i}:v:0]" for i in range(len(starts)))
+    args += [
+        "-filter_complex", f"{inputs}concat=n={len(starts)}:v=1:a=0,format=yuv420p[v]",
+        "-map", "[v]", "-c:v", "libx264", "-qp", "0", "-preset", "ultrafast",
+        "-f", "matroska", reference_path
+    ]
+    _run_ffmpeg(args)
+
+
+def _measure_ssim(reference_path: str, candidate_path: str, encoder: str, preset: str, crf: int) -> float:
+    """Encode the reference at a CRF and return the SSIM of the result"""
+    args = ["-i", reference_path, "-c:v", encoder, "-crf", str(crf), "-preset", preset]
+    if encoder == "libvpx-vp9":
+        args += ["-b:v", "0", "-row-mt", "1"]
+    _run_ffmpeg(args + ["-an", "-f", "matroska", candidate_path])
+
+    stderr = _run_ffmpeg([
+        "-i", candidate_path, "-i", reference_path,
+        "-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"
+    ])
+    match = SSIM_PATTERN.search(stderr)
+    if not match:
+        raise RuntimeError("SSIM not reported")
+    return float(match.group(1))
+
+
+def choose_auto_crf(input_path: str, video_info: dict, encoder: str, preset: str) -> Optional[dict]:
+    """
+    Highest CRF whose sample encode reaches VIDEO_AUTO_SSIM_TARGET (blocking)
+
+    Bisects the encoder's CRF range (SSIM falls as CRF rises), so a handful
+    of short sample encodes are needed. Returns {"crf", "ssim"} or None if
+    the encoder has no CRF range or sampling fails.
+    """
+    if encoder not in VIDEO_AUTO_CRF_RANGES:
+        return None
+
+    cache_key = f"{video_info.get('content_hash')}:{encoder}:{preset}:{VIDEO_AUTO_SSIM_TARGET}"
+    if video_info.get("content_hash"):
+        cached = _auto_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    work_dir = tempfile.mkdtemp(prefix="auto_crf_", dir=UPLOAD_DIR)
+    try:
+        reference_path = os.path.join(work_dir, "reference.mkv")
+        candidate_path = os.path.join(work_dir, "candidate.mkv")
+        _extract_reference(input_path, video_info, reference_path)
+
+        low, high = VIDEO_AUTO_CRF_RANGES[encoder]
+        best = {"crf": low, "ssim": None}
+        while low <= high:
+            crf = (low + high) // 2
+            ssim = _measure_ssim(reference_path, candidate_path, encoder, preset, crf)
+            print(f"[Auto quality] CRF {crf}: SSIM {ssim:.4f}")
+            if ssim >= VIDEO_AUTO_SSIM_TARGET:
+                best = {"crf": crf, "ssim": ssim}
+                low = crf + 1
+            else:
+                high = crf - 1
+    except Exception as e:
+        print(f"[Auto quality] Sampling failed: {e}")
+        return None
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if video_info.get("content_hash"):
+        _auto_cache.put(cache_key, best)
+    return best
+
+
+def plan_target_size(video_info: Optional[dict], target_size_mb: float, copy_audio: bool) -> dict:
+    """
+    Video/audio bitrates (bits/s) and output height that fit a file size
+
+    Raises ValueError when the duration is unknown or the size is too small
+    to hold a watchable video.
+    """
+    duration = (video_info or {}).get("duration")
+    if not duration:
+        raise ValueError("Target size needs the video duration, which could not be determined")
+
+    video = (video_info or {}).get("video") or {}
+    audio = (video_info or {}).get("audio")
+    if audio is None:
+        audio_bitrate = 0
+    elif copy_audio:
+        audio_bitrate = audio.get("bit_rate") or TARGET_SIZE_AUDIO_BITRATE
+    else:
+        audio_bitrate = min(audio.get("bit_rate") or TARGET_SIZE_AUDIO_BITRATE, TARGET_SIZE_AUDIO_BITRATE)
+
+    total_bits = target_size_mb * 1024 * 1024 * 8 * (1 - TARGET_SIZE_OVERHEAD)
+    video_bitrate = int(total_bits / duration - audio_bitrate)
+    if video_bitrate < MIN_TARGET_VIDEO_BITRATE:
+        raise ValueError(f"Target size of {target_size_mb} MB is too small for a {duration:.0f}s video")
+
+    # Never spend more than the source does
+    if video.get("bit_rate"):
+        video_bitrate = min(video_bitrate, video["bit_rate"])
+
+    # Keep enough bits per pixel by downscaling (never upscaling)
+    height = video.get("height")
+    width = video.get("width")
+    fps = video.get("fps") or 30
+    scale_height = None
+    if width and height:
+        for candidate in (height,) + tuple(h for h in DOWNSCALE_HEIGHTS if h < height):
+            bits_per_pixel = video_bitrate / (width * candidate / height * candidate * fps)
+            scale_height = candidate
+            if bits_per_pixel >= VIDEO_MIN_BITS_PER_PIXEL:
+                break
+        if scale_height == height:
+            scale_height = None
+
+    return {"video_bitrate": video_bitrate, "audio_bitrate": audio_bitrate, "scale_height": scale_height}
+
+
+def plan_rate_control(
+    input_path: str,
+    video_info: Optional[dict],
+    target_format: str,
+    quality: str,
+    target_size_mb: Optional[float] = None,
+    copy_audio: bool = False
+) -> Optional[dict]:
+    """
+    Settings for target-size or automatic-quality encoding (blocking)
+
+    Returns {"mode": "two_pass"|"auto", "args": [...], "passes": 1|2, ...}
+    where args replace the target's quality arguments, or None when the
+    fixed presets should be used (no mode requested, or an encoder without
+    CRF support in auto mode). Raises ValueError for impossible targets.
+    """
+    encoder = video_encoder(target_format)
+    preset = choose_preset(video_info, quality)
+
+    if target_size_mb:
+        budget = plan_target_size(video_info, target_size_mb, copy_audio)
+        bitrate = f"{budget['video_bitrate'] // 1000}k"
+        args = ["-b:v", bitrate, "-maxrate", f"{int(budget['video_bitrate'] * 1.5) // 1000}k",
+                "-bufsize", f"{budget['video_bitrate'] * 2 // 1000}k", "-preset", preset]
+        if budget["audio_bitrate"]:
+            args += ["-b:a", f"{budget['audio_bitrate'] // 1000}k"]
+        if budget["scale_height"]:
+            args += ["-vf", f"scale=-2:{budget['scale_height']}"]
+        print(f"[Target size] {target_size_mb} MB -> video {bitrate}, "
+              f"audio {budget['audio_bitrate'] // 1000}k, height {budget['scale_height'] or 'source'}")
+        return {"mode": "two_pass", "passes": 2, "args": args, "encoder": encoder,
+                "preset": preset, "video_bitrate": budget["video_bitrate"],
+                "scale_height": budget["scale_height"]}
+
+    if quality != "auto" or not video_info or not video_info.get("video"):
+        return None
+
+    choice = choose_auto_crf(input_path, video_info, encoder, preset)
+    if choice is None:
+        return None
+
+    args = ["-crf", str(choice["crf"]), "-preset", preset]
+    source_rate = video_info["video"].get("bit_rate")
+    if encoder == "libvpx-vp9":
+        # Constrained quality: the CRF with the source bitrate as the ceiling
+        args += ["-b:v", f"{source_rate // 1000}k" if source_rate else "0", "-row-mt", "1"]
+    elif source_rate:
+        args += ["-maxrate", f"{source_rate // 1000}k", "-bufsize", f"{source_rate * 2 // 1000}k"]
+    print(f"[Auto quality] Using CRF {choice['crf']} with preset {preset}")
+    return {"mode": "auto", "passes": 1, "args": args, "encoder": encoder,
+            "preset": preset, "crf": choice["crf"], "ssim": choice["ssim"]}
+
+
+def pass_args(rate_control: dict, pass_number: int, log_prefix: str) -> List[str]:
+    """Per-pass options of a two-pass encode"""
+    if rate_control["encoder"] == "libx265":
+        # libx265 takes its pass settings through x265-params
+        stats = log_prefix.replace("\\", "/").replace(":", "\\:")
+        return ["-x265-params", f"pass={pass_number}:stats={stats}.log"]
+    return ["-pass", str(pass_number), "-passlogfile", log_prefix]
+
@@ -0,0 +1,176 @@
+# converters/video_streaming.py - HLS/DASH adaptive streaming packaging
+"""
+Package a video as an adaptive bitrate ladder (HLS or DASH)
+
+All renditions come from a single FFmpeg process: the input is decoded
+once, a split/scale filter graph fans the frames out to one encoder per
+rung, and the audio is encoded once and shared by every rung. Keyframes
+are forced on the same segment boundaries in every rendition so players
+can switch bitrates at any segment.
+
+Output goes to one directory (manifests and segments side by side), so it
+can be served through /download/<dir>/<file>.
+"""
+import asyncio
+import os
+import shutil
+from typing import Callable, List, Optional
+
+from converters import video_converter
+from converters.media_analysis import analyze_media_async, parse_bitrate
+from utils.config import VIDEO_STREAMING_LADDER, VIDEO_STREAMING_SEGMENT_SECONDS
+
+STREAMING_FORMATS = ('hls', 'dash')
+
+# Manifest each protocol's players should load
+MANIFEST_NAMES = {'hls': 'master.m3u8', 'dash': 'manifest.mpd'}
+
+
+def plan_ladder(media_info: Optional[dict]) -> List[dict]:
+    """
+    Pick the rungs of VIDEO_STREAMING_LADDER that suit the source
+
+    Rungs taller than the source are dropped (no upscaling) and bitrates are
+    capped to the source video bitrate. A source smaller than every rung
+    gets a single rendition at its own height.
+    """
+    video = (media_info or {}).get("video") or {}
+    source_height = video.get("height")
+    source_rate = video.get("bit_rate")
+
+    rungs = [dict(rung) for rung in VIDEO_STREAMING_LADDER
+             if not source_height or rung["height"] <= source_height]
+    if not rungs:
+        smallest = VIDEO_STREAMING_LADDER[-1]
+        rungs = [dict(smallest, height=source_height - source_height % 2)]
+
+    for rung in rungs:
+        if source_rate and parse_bitrate(rung["video_bitrate"]) > source_rate:
+            rung["video_bitrate"] = f"{source_rate // 1000}k"
+    return rungs
+
+
+def build_streaming_command(
+    input_path: str,
+    output_dir: str,
+    protocol: str,
+    rungs: List[dict],
+    has_audio: bool,
+    fps: Optional[float],
+    quality: str = "medium"
+) -> List[str]:
+    """FFmpeg command encoding every rung from one decode"""
+    preset_args = video_converter.QUALITY_SETTINGS.get(quality, video_converter.QUALITY_SETTINGS["medium"])
+    preset = preset_args[preset_args.index("-preset") + 1]
+    segment = VIDEO_STREAMING_SEGMENT_SECONDS
+    gop = max(1, round((fps or 30) * segment))
+
+    split_outputs = "".join(f"[s{i}]" for i in range(len(rungs)))
+    graph = [f"[0:v]split={len(rungs)}{split_outputs}"]
+    graph += [f"[s{i}]scale=-2:{rung['height']}[v{i}]" for i, rung in enumerate(rungs)]
+
+    cmd = [video_converter.FFMPEG_PATH, "-y", "-i", input_path, "-filter_complex", ";".join(graph)]
+
+    for i, rung in enumerate(rungs):
+        bitrate = parse_bitrate(rung["video_bitrate"])
+        cmd += [
+            "-map", f"[v{i}]",
+            f"-c:v:{i}", "libx264", f"-preset:v:{i}", preset, f"-profile:v:{i}", "main",
+            f"-b:v:{i}", rung["video_bitrate"],
+            f"-maxrate:v:{i}", f"{int(bitrate * 1.07) // 1000}k",
+            f"-bufsize:v:{i}", f"{int(bitrate * 1.5) // 1000}k"
+        ]
+    # Identical, scene-cut-free GOPs keep segment boundaries aligned across rungs
+    cmd += ["-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0", "-pix_fmt", "yuv420p"]
+
+    if has_audio:
+        audio_bitrate = max(rungs, key=lambda rung: rung["height"])["audio_bitrate"]
+        cmd += ["-map", "0:a:0", "-c:a", "aac", "-b:a", audio_bitrate, "-ac", "2"]
+
+    if protocol == "hls":
+        # One audio rendition shared by all video variants
+        if has_audio:
+            variants = [f"v:{i},agroup:audio" for i in range(len(rungs))] + ["a:0,agroup:audio"]
+        else:
+            variants = [f"v:{i}" for i in range(len(rungs))]
+        cmd += [
+            "-f", "hls",
+            "-hls_time", str(segment),
+            "-hls_playlist_type", "vod",
+            "-hls_flags", "independent_segments",
+            "-hls_segment_type", "mpegts",
+            "-hls_segment_filename", os.path.join(output_dir, "stream_%v_%05d.ts"),
+            "-master_pl_name", MANIFEST_NAMES["hls"],
+            "-var_stream_map", " ".join(variants),
+            os.path.join(output_dir, "stream_%v.m3u8")
+        ]
+    else:
+        # fMP4 segments; hls_playlist adds HLS playlists over the same segments
+        cmd += [
+            "-f", "dash",
+            "-seg_duration", str(segment),
+            "-use_template", "1",
+            "-use_timeline", "1",
+            "-adaptation_sets", "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+            "-init_seg_name", "init_$RepresentationID$.m4s",
+            "-media_seg_name", "chunk_$RepresentationID$_$Number%05d$.m4s",
+            "-hls_playlist", "1",
+            os.path.join(output_dir, MANIFEST_NAMES["dash"])
+        ]
+    return cmd
+
+
+async def package_adaptive_stream(
+    input_path: str,
+    output_dir: str,
+    protocol: str = "hls",
+    quality: str = "medium",
+    progress: Optional[Callable[[float], None]] = None
+) -> dict:
+    """
+    Encode a bitrate ladder and package it for HLS or DASH
+
+    Returns {success, protocol, manifest, renditions} where manifest is the
+    file name (inside output_dir) players should load, or {success: False,
+    error} after removing the partial output.
+    """
+    protocol = protocol.lower()
+    if protocol not in STREAMING_FORMATS:
+        return {"success": False, "error": f"Unsupported streaming format: {protocol}"}
+    if not video_converter.FFMPEG_AVAILABLE:
+        return {"success": False, "error": "FFmpeg not available"}
+
+    media_info = await analyze_media_async(input_path)
+    if media_info is not None and media_info.get("video") is None:
+        return {"success": False, "error": "Input has no video stream"}
+
+    rungs = plan_ladder(media_info)
+    # Without a probe the audio is left out: the HLS variant map and DASH
+    # adaptation sets would otherwise name a stream that may not exist
+    has_audio = media_info is not None and media_info.get("audio") is not None
+    fps = ((media_info or {}).get("video") or {}).get("fps")
+
+    os.makedirs(output_dir, exist_ok=True)
+    cmd = build_streaming_command(input_path, output_dir, protocol, rungs, has_audio, fps, quality)
+    manifest_path = os.path.join(output_dir, MANIFEST_NAMES[protocol])
+
+    ladder = ", ".join(f"{rung['height']}p@{rung['video_bitrate']}" for rung in rungs)
+    print(f"Packaging {protocol.upper()} ladder: {ladder}")
+    success = await asyncio.to_thread(
+        video_converter._run_conversion, cmd, input_path, manifest_path,
+        (media_info or {}).get("duration"), progress
+    )
+    if not success:
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return {"success": False, "error": "FFmpeg packaging failed"}
+
+    return {
+        "success": True,
+        "protocol": protocol,
+        "manifest": MANIFEST_NAMES[protocol],
+        "hls_manifest": MANIFEST_NAMES["hls"] if os.path.exists(os.path.join(output_dir, MANIFEST_NAMES["hls"])) else None,
+        "renditions": [
+            {"height": rung["height"], "video_bitrate": rung["video_bitrate"]} for rung in rungs
+        ],
+        "segment_seconds": VIDEO_STREAMING_SEGMENT_SECONDS
+    }
@@ -6,14 +6,26 @@ Supports both gTTS (Default Voice) and Coqui TTS (Voice Cloning)
 import os
 import io
 import uuid
+import asyncio
 import logging
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Literal
+from typing import Optional, Literal, AsyncIterator
 from datetime import datetime
 from pydub import AudioSegment
-from pydub.effects import normalize, compress_dynamic_range, low_pass_filter, high_pass_filter
+from pydub.effects import compress_dynamic_range, low_pass_filter, high_pass_filter
 import numpy as np
 
+from converters.audio_converter import FFMPEG_AVAILABLE, FFMPEG_PATH, STREAM_MUXERS, stream_ffmpeg_output
+from converters.loudness import measure_loudness, loudness_filter
+from converters.voice_effects import (
+    apply_voice_effects, to_float_buffer, to_pcm16, crossfade_join, CrossfadeJoiner
+)
+from converters.speech_cache import cached_synthesis, split_sentences
+from utils.config import VOICE_SYNTHESIS_WORKERS, VOICE_CROSSFADE_MS, LOUDNESS_TARGETS
+from converters.media_analysis import media_fingerprint
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -84,10 +96,34 @@ class VoiceDubbingConverter:
 
     SUPPORTED_OUTPUT_FORMATS = ['mp3', 'wav', 'ogg', 'flac', 'm4a']
 
+    # Formats that can be encoded while the text is still being synthesized
+    STREAMING_ENCODERS = {'mp3': 'libmp3lame', 'ogg': 'libvorbis', 'm4a': 'aac'}
+
+    QUALITY_BITRATES = {
+        'low': '64k',
+        'medium': '128k',
+        'high': '192k',
+        'ultra': '320k'
+    }
+
+    # libvorbis rejects most fixed bitrates at speech sample rates (24 kHz
+    # mono), so streamed Vorbis uses its VBR quality scale instead
+    VORBIS_QUALITIES = {
+        'low': '2',
+        'medium': '4',
+        'high': '6',
+        'ultra': '8'
+    }
+
     def __init__(self, output_dir: str = "uploads"):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
+        # Sentences of a text are synthesized concurrently. Coqui's model
+        # isn't safe to share between threads, so it gets a single worker
+        self._synthesis_pool = ThreadPoolExecutor(max_workers=VOICE_SYNTHESIS_WORKERS, thread_name_prefix="tts")
+        self._coqui_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="coqui")
+
         # Initialize Coqui TTS if available
         self.coqui_tts = None
         if COQUI_AVAILABLE:
@@ -108,7 +144,8 @@ class VoiceDubbingConverter:
         volume: float = 1.0,
         output_format: str = 'mp3',
         apply_noise_reduction: bool = False,
-        quality: str = 'high'
+        quality: str = 'high',
+        loudness: Optional[str] = 'podcast'
     ) -> tuple[str, str]:
         """
         Generate voice using gTTS (Default Voice Mode)
@@ -122,6 +159,8 @@ class VoiceDubbingConverter:
             output_format: Output audio format
             apply_noise_reduction: Whether to apply noise reduction
             quality: Audio quality (low, medium, high, ultra)
+            loudness: EBU R128 loudness target (see LOUDNESS_TARGETS), or
+                None for peak normalization
 
         Returns:
             Tuple of (output_file_path, filename)
@@ -139,27 +178,16 @@ class VoiceDubbingConverter:
         filename = f"voice_gtts_{uuid.uuid4().hex[:8]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{output_format}"
         output_path = self.output_dir / filename
 
-        # Generate speech with gTTS
-        tts = gTTS(text=text, lang=language, slow=False)
-
-        # Save to temporary MP3 file
-        temp_mp3 = self.output_dir / f"temp_{uuid.uuid4().hex}.mp3"
-        tts.save(str(temp_mp3))
-
-        # Load audio for processing
-        audio = AudioSegment.from_mp3(str(temp_mp3))
+        # Generate speech with gTTS, sentence by sentence (cached sentences are reused)
+        audio = self._synthesize_text(text, language)
 
         # Apply audio processing
         audio = self._apply_audio_effects(
-            audio, speed, pitch, volume, apply_noise_reduction, quality
+            audio, speed, pitch, volume, apply_noise_reduction, quality, loudness
         )
 
         # Export in desired format
-        self._export_audio(audio, output_path, output_format, quality)
-
-        # Clean up temp file
-        if temp_mp3.exists():
-            temp_mp3.unlink()
+        self._export_audio(audio, output_path, output_format, quality, loudness)
 
         return str(output_path), filename
 
@@ -173,7 +201,8 @@ class VoiceDubbingConverter:
         volume: float = 1.0,
         output_format: str = 'mp3',
         apply_noise_reduction: bool = False,
-        quality: str = 'high'
+        quality: str = 'high',
+        loudness: Optional[str] = 'podcast'
     ) -> tuple[str, str]:
         """
         Generate voice using Coqui TTS with voice cloning
@@ -189,6 +218,7 @@ class VoiceDubbingConverter:
             output_format: Output audio format
             apply_noise_reduction: Whether to apply noise reduction
             quality: Audio quality
+            loudness: EBU R128 loudness target, or None for peak normalization
 
         Returns:
             Tuple of (output_file_path, filename)
@@ -199,44 +229,231 @@ class VoiceDubbingConverter:
         # Generate unique filename
         filename = f"voice_clone_{uuid.uuid4().hex[:8]}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{output_format}"
         output_path = self.output_dir / filename
-        temp_wav = self.output_dir / f"temp_coqui_{uuid.uuid4().hex}.wav"
 
-        try:
-            if COQUI_AVAILABLE and self.coqui_tts is not None:
-                # Use Coqui TTS for true voice cloning
-                self.coqui_tts.tts_to_file(
-                    text=text,
-                    speaker_wav=speaker_wav_path,
-                    language=language,
-                    file_path=str(temp_wav)
-                )
-                audio = AudioSegment.from_wav(str(temp_wav))
-            else:
-                # Fallback: Use gTTS and apply speaker audio characteristics
-                logger.info("Using gTTS fallback for voice cloning")
-                audio = self._generate_enhanced_voice(text, language, speaker_wav_path)
-
-            # Apply audio processing
-            audio = self._apply_audio_effects(
-                audio, speed, pitch, volume, apply_noise_reduction, quality
-            )
+        if COQUI_AVAILABLE and self.coqui_tts is not None:
+            # Use Coqui TTS for true voice cloning
+            audio = self._synthesize_text(text, language, speaker_wav_path)
+        else:
+            # Fallback: Use gTTS and apply speaker audio characteristics
+            logger.info("Using gTTS fallback for voice cloning")
+            audio, pitch_shift, speed_factor = self._generate_enhanced_voice(text, language, speaker_wav_path)
+            # Folded into the requested effects so the audio is processed once
+            pitch += pitch_shift
+            speed *= speed_factor
 
-            # Export in desired format
-            self._export_audio(audio, output_path, output_format, quality)
+        # Apply audio processing
+        audio = self._apply_audio_effects(
+            audio, speed, pitch, volume, apply_noise_reduction, quality, loudness
+        )
 
-            return str(output_path), filename
+        # Export in desired format
+        self._export_audio(audio, output_path, output_format, quality, loudness)
+
+        return str(output_path), filename
 
+    def _synthesize_gtts(self, text: str, language: str) -> bytes:
+        """gTTS backend call (network): MP3 bytes for text"""
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=language, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+
+    def _synthesize_coqui(self, text: str, language: str, speaker_wav_path: str) -> bytes:
+        """Coqui backend call: WAV bytes for text in the speaker's voice"""
+        temp_wav = self.output_dir / f"temp_coqui_{uuid.uuid4().hex}.wav"
+        try:
+            self.coqui_tts.tts_to_file(
+                text=text,
+                speaker_wav=speaker_wav_path,
+                language=language,
+                file_path=str(temp_wav)
+            )
+            return temp_wav.read_bytes()
         finally:
-            # Clean up temp file
             if temp_wav.exists():
                 temp_wav.unlink()
 
+    def _gtts_segment(self, text: str, language: str) -> AudioSegment:
+        """Synthesized speech before effects, from the segment cache when possible"""
+        data = cached_synthesis(
+            text, language, 'gtts',
+            lambda normalized: self._synthesize_gtts(normalized, language),
+            '.mp3'
+        )
+        return AudioSegment.from_file(io.BytesIO(data), format='mp3')
+
+    def _submit_segments(self, text: str, language: str,
+                         speaker_wav_path: Optional[str] = None) -> list[Future]:
+        """Start synthesizing every sentence of text on the bounded pool, in order"""
+        sentences = split_sentences(text) or [text]
+        if speaker_wav_path:
+            return [self._coqui_pool.submit(self._coqui_segment, sentence, language, speaker_wav_path)
+                    for sentence in sentences]
+        return [self._synthesis_pool.submit(self._gtts_segment, sentence, language) for sentence in sentences]
+
+    def _synthesize_text(self, text: str, language: str,
+                         speaker_wav_path: Optional[str] = None) -> AudioSegment:
+        """
+        Synthesize a whole text (Coqui when speaker_wav_path is given, gTTS otherwise)
+
+        The text is split at sentence boundaries, the sentences synthesized
+        concurrently and joined with a VOICE_CROSSFADE_MS crossfade, so
+        latency follows the slowest sentence rather than the whole text.
+        """
+        futures = self._submit_segments(text, language, speaker_wav_path)
+        try:
+            segments = [future.result() for future in futures]
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+
+        if len(segments) == 1:
+            return segments[0]
+        first = segments[0]
+        joined = crossfade_join(
+            [self._to_buffer(segment, first) for segment in segments],
+            int(first.frame_rate * VOICE_CROSSFADE_MS / 1000)
+        )
+        return first._spawn(to_pcm16(joined), overrides={'sample_width': 2, 'frame_width': 2 * first.channels})
+
+    @staticmethod
+    def _to_buffer(audio: AudioSegment, reference: Optional[AudioSegment] = None) -> np.ndarray:
+        """Float (frames, channels) buffer, in the reference's sample rate and channels if given"""
+        if reference is not None:
+            if audio.frame_rate != reference.frame_rate:
+                audio = audio.set_frame_rate(reference.frame_rate)
+            if audio.channels != reference.channels:
+                audio = audio.set_channels(reference.channels)
+        if audio.sample_width not in (2, 4):
+            audio = audio.set_sample_width(2)
+        return to_float_buffer(audio.raw_data, audio.sample_width, audio.channels)
+
+    def stream_gtts_voice(
+        self,
+        text: str,
+        language: str = 'en',
+        speed: float = 1.0,
+        pitch: float = 0.0,
+        volume: float = 1.0,
+        output_format: str = 'mp3',
+        apply_noise_reduction: bool = False,
+        quality: str = 'high',
+        loudness: Optional[str] = 'podcast'
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream gTTS speech, starting as soon as the first sentence is synthesized
+
+        Sentences are synthesized concurrently; each one gets its effects
+        and is piped into an FFmpeg encoder as soon as it and the sentences
+        before it are ready. Peak normalization needs the whole text, so
+        streamed audio gets one static gain, measured on the first sentence,
+        that brings it to the loudness target (or is only scaled by volume
+        when loudness is None). loudnorm's one-pass mode would hold back
+        about 3 seconds of audio.
+
+        Arguments are validated here, before anything is streamed.
+        """
+        if not GTTS_AVAILABLE:
+            raise ImportError("gTTS is not installed. Install with: pip install gTTS")
+
+        if language not in self.GTTS_LANGUAGES:
+            raise ValueError(f"Unsupported language: {language}")
+
+        if output_format not in self.STREAMING_ENCODERS:
+            raise ValueError(f"Streaming is not available for {output_format}. "
+                             f"Streamable formats: {', '.join(self.STREAMING_ENCODERS)}")
+
+        if not FFMPEG_AVAILABLE:
+            raise ImportError("FFmpeg is required for streaming voice generation")
+
+        if loudness and loudness not in LOUDNESS_TARGETS:
+            raise ValueError(f"Unknown loudness target: {loudness}")
+
+        encoder_args = ["-c:a", self.STREAMING_ENCODERS[output_format]]
+        if output_format == 'ogg':
+            encoder_args.extend(["-q:a", self.VORBIS_QUALITIES.get(quality, '6')])
+        else:
+            encoder_args.extend(["-b:a", self.QUALITY_BITRATES.get(quality, '192k')])
+        noise_reduction = self._reduce_noise if apply_noise_reduction and NOISEREDUCE_AVAILABLE else None
+
+        async def encoded_chunks():
+            futures = self._submit_segments(text, language)
+            try:
+                first = await asyncio.wrap_future(futures[0])
+                joiner = CrossfadeJoiner(int(first.frame_rate * VOICE_CROSSFADE_MS / 1000))
+                gain = None
+
+                def process(segment: AudioSegment) -> bytes:
+                    nonlocal gain
+                    buffer = apply_voice_effects(
+                        self._to_buffer(segment, first), first.frame_rate,
+                        speed=speed, pitch=pitch, volume=volume,
+                        normalize=False, noise_reduction=noise_reduction
+                    )
+                    if gain is None:
+                        gain = self._stream_gain(buffer, first.frame_rate, loudness) if loudness else 1.0
+                    if gain != 1.0:
+                        buffer *= np.float32(gain)
+                    return to_pcm16(joiner.push(buffer))
+
+                async def pcm_chunks():
+                    for future in futures:
+                        segment = await asyncio.wrap_future(future)
+                        yield await asyncio.to_thread(process, segment)
+                    yield to_pcm16(joiner.flush())
+
+                # The raw PCM format is fully specified, so skip input probing,
+                # which would otherwise wait for seconds of audio
+                cmd = [FFMPEG_PATH, "-v", "error", "-probesize", "32", "-analyzeduration", "0",
+                       "-f", "s16le", "-ar", str(first.frame_rate), "-ac", str(first.channels), "-i", "pipe:0"]
+                cmd.extend(encoder_args)
+                cmd.extend(["-ar", str(first.frame_rate)])
+                cmd.extend(STREAM_MUXERS[output_format])
+                cmd.append("pipe:1")
+
+                async for chunk in stream_ffmpeg_output(cmd, stdin_chunks=pcm_chunks()):
+                    yield chunk
+            finally:
+                # Client went away or synthesis failed: drop sentences not started yet
+                for future in futures:
+                    future.cancel()
+
+        return encoded_chunks()
+
+    @staticmethod
+    def _stream_gain(buffer: np.ndarray, sample_rate: int, loudness: str) -> float:
+        """Static gain bringing a buffer (the first streamed sentence) to a loudness target"""
+        wav_buffer = io.BytesIO()
+        with wave.open(wav_buffer, 'wb') as wav:
+            wav.setnchannels(buffer.shape[1])
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes(to_pcm16(buffer.copy()))
+        measurement = measure_loudness(wav_buffer.getvalue())
+        if measurement is None:
+            return 1.0
+
+        # Stay under the target's true peak, as loudnorm's linear mode would
+        target = LOUDNESS_TARGETS[loudness]
+        gain_db = min(target['I'] - measurement['input_i'], target['TP'] - measurement['input_tp'])
+        return 10 ** (gain_db / 20)
+
+    def _coqui_segment(self, text: str, language: str, speaker_wav_path: str) -> AudioSegment:
+        """Cloned speech before effects; the voice is identified by the sample's content"""
+        data = cached_synthesis(
+            text, language, 'coqui',
+            lambda normalized: self._synthesize_coqui(normalized, language, speaker_wav_path),
+            '.wav',
+            voice=media_fingerprint(speaker_wav_path)
+        )
+        return AudioSegment.from_file(io.BytesIO(data), format='wav')
+
     def _generate_enhanced_voice(
         self,
         text: str,
         language: str,
         speaker_wav_path: str
-    ) -> AudioSegment:
+    ) -> tuple[AudioSegment, float, float]:
         """
         Generate voice using gTTS and apply speaker audio characteristics
         This is a fallback when Coqui TTS is not available
@@ -245,17 +462,17 @@ class VoiceDubbingConverter:
         - Volume/loudness (dBFS)
         - Average pitch (by estimating formants)
         - Speaking speed (words per minute)
+
+        Returns (audio, pitch shift in semitones, speed factor); the pitch
+        and speed matches are applied with the other effects.
         """
         if not GTTS_AVAILABLE:
             raise ImportError("gTTS is required for voice generation")
 
         # Generate speech with gTTS
-        tts = gTTS(text=text, lang=language, slow=False)
-        temp_mp3 = self.output_dir / f"temp_gtts_{uuid.uuid4().hex}.mp3"
-        tts.save(str(temp_mp3))
-
-        # Load the generated audio
-        generated_audio = AudioSegment.from_mp3(str(temp_mp3))
+        generated_audio = self._synthesize_text(text, language)
+        pitch_shift = 0.0
+        speed_factor = 1.0
 
         try:
             # Load speaker audio to analyze characteristics
@@ -287,12 +504,10 @@ class VoiceDubbingConverter:
                 if samples_per_ms > sample_rate / 500:  # Rough threshold for higher pitch
                     # Apply slight pitch increase
                     pitch_shift = 2  # semitones
-                    generated_audio = self._change_pitch(generated_audio, pitch_shift)
                     logger.info(f"Applied +{pitch_shift} semitone pitch shift for higher voice")
                 elif samples_per_ms < sample_rate / 1000:  # Rough threshold for lower pitch
                     # Apply slight pitch decrease
                     pitch_shift = -2  # semitones
-                    generated_audio = self._change_pitch(generated_audio, pitch_shift)
                     logger.info(f"Applied {pitch_shift} semitone pitch shift for lower voice")
 
             # 3. Try to match speaking speed
@@ -300,11 +515,9 @@ class VoiceDubbingConverter:
             expected_duration = len(text.split()) * 500  # Rough estimate: 500ms per word
             if speaker_duration_ms > expected_duration * 1.3:  # Speaker talks slower
                 speed_factor = 0.95
-                generated_audio = self._change_speed(generated_audio, speed_factor)
                 logger.info(f"Applied speed factor {speed_factor} for slower speech")
             elif speaker_duration_ms < expected_duration * 0.7:  # Speaker talks faster
                 speed_factor = 1.05
-                generated_audio = self._change_speed(generated_audio, speed_factor)
                 logger.info(f"Applied speed factor {speed_factor} for faster speech")
 
         except Exception as e:
@@ -318,12 +531,7 @@ class VoiceDubbingConverter:
             except:
                 pass
 
-        finally:
-            # Clean up temp file
-            if temp_mp3.exists():
-                temp_mp3.unlink()
-
-        return generated_audio
+        return generated_audio, pitch_shift, speed_factor
 
     def _apply_audio_effects(
         self,
@@ -332,94 +540,54 @@ class VoiceDubbingConverter:
         pitch: float,
         volume: float,
         apply_noise_reduction: bool,
-        quality: str
+        quality: str,
+        loudness: Optional[str] = None
     ) -> AudioSegment:
-        """Apply various audio effects to the AudioSegment"""
-
-        # Apply noise reduction if requested
-        if apply_noise_reduction and NOISEREDUCE_AVAILABLE:
-            try:
-                audio = self._apply_noise_reduction(audio)
-            except Exception as e:
-                logger.warning(f"Noise reduction failed: {e}")
-
-        # Apply speed adjustment
-        if speed != 1.0:
-            audio = self._change_speed(audio, speed)
-
-        # Apply pitch adjustment
-        if pitch != 0.0:
-            audio = self._change_pitch(audio, pitch)
-
-        # Apply volume adjustment
-        if volume != 1.0:
-            # Convert volume multiplier to dB
-            db_change = 20 * np.log10(volume) if volume > 0 else -60
-            audio = audio + db_change
-
-        # Apply normalization for consistent volume
-        audio = normalize(audio)
-
-        return audio
+        """
+        Apply noise reduction, speed, pitch, volume and normalization
 
-    def _change_speed(self, audio: AudioSegment, speed: float) -> AudioSegment:
-        """Change playback speed without affecting pitch"""
-        # Change frame rate
-        sound_with_altered_frame_rate = audio._spawn(
-            audio.raw_data,
-            overrides={"frame_rate": int(audio.frame_rate * speed)}
+        The samples are converted to a float buffer once, processed by one
+        NumPy pipeline (converters/voice_effects.py) and converted back
+        once. Speed keeps the pitch; loudness normalization happens in the
+        FFmpeg export instead of here.
+        """
+        samples = self._to_buffer(audio)
+        processed = apply_voice_effects(
+            samples,
+            audio.frame_rate,
+            speed=speed,
+            pitch=pitch,
+            volume=volume,
+            normalize=not (loudness and FFMPEG_AVAILABLE),
+            noise_reduction=self._reduce_noise if apply_noise_reduction and NOISEREDUCE_AVAILABLE else None
         )
-        # Convert back to original frame rate
-        return sound_with_altered_frame_rate.set_frame_rate(audio.frame_rate)
-
-    def _change_pitch(self, audio: AudioSegment, semitones: float) -> AudioSegment:
-        """Change pitch by semitones"""
-        # Calculate new sample rate
-        new_sample_rate = int(audio.frame_rate * (2.0 ** (semitones / 12.0)))
 
-        # Change frame rate to shift pitch
-        pitched = audio._spawn(audio.raw_data, overrides={'frame_rate': new_sample_rate})
-
-        # Resample to original frame rate
-        return pitched.set_frame_rate(audio.frame_rate)
-
-    def _apply_noise_reduction(self, audio: AudioSegment) -> AudioSegment:
-        """Apply noise reduction to audio"""
-        if not NOISEREDUCE_AVAILABLE:
-            return audio
-
-        # Convert to numpy array
-        samples = np.array(audio.get_array_of_samples())
-
-        # Apply noise reduction
-        reduced_noise = nr.reduce_noise(
-            y=samples,
-            sr=audio.frame_rate,
-            stationary=True
+        return audio._spawn(
+            to_pcm16(processed),
+            overrides={'sample_width': 2, 'frame_width': 2 * audio.channels}
         )
 
-        # Convert back to AudioSegment
-        reduced_audio = audio._spawn(reduced_noise.tobytes())
-        return reduced_audio
+    @staticmethod
+    def _reduce_noise(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+        """Stationary noise reduction of a (channels, frames) buffer; unchanged on failure"""
+        try:
+            return nr.reduce_noise(y=samples, sr=sample_rate, stationary=True)
+        except Exception as e:
+            logger.warning(f"Noise reduction failed: {e}")
+            return samples
 
     def _export_audio(
         self,
         audio: AudioSegment,
         output_path: Path,
         format: str,
-        quality: str
+        quality: str,
+        loudness: Optional[str] = None
     ):
         """Export audio with specified quality settings"""
 
         # Quality settings
-        bitrate_map = {
-            'low': '64k',
-            'medium': '128k',
-            'high': '192k',
-            'ultra': '320k'
-        }
-
-        bitrate = bitrate_map.get(quality, '192k')
+        bitrate = self.QUALITY_BITRATES.get(quality, '192k')
 
         # Export parameters based on format
         export_params = {
@@ -432,6 +600,18 @@ class VoiceDubbingConverter:
         elif format == 'ogg':
             export_params['codec'] = 'libvorbis'
 
+        if loudness and FFMPEG_AVAILABLE:
+            # Measure the processed audio (cached per content, so regenerating
+            # the same text and settings skips the first pass) and normalize
+            # in the encode pydub runs anyway
+            wav_buffer = io.BytesIO()
+            audio.export(wav_buffer, format='wav')
+            measurement = measure_loudness(wav_buffer.getvalue())
+            export_params['parameters'] = export_params.get('parameters', []) + [
+                '-af', loudness_filter(loudness, measurement),
+                '-ar', str(audio.frame_rate)
+            ]
+
         audio.export(str(output_path), **export_params)
 
     @staticmethod
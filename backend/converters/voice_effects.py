@@ -0,0 +1,182 @@
+# converters/voice_effects.py - Single-pass voice effects on a NumPy buffer
+"""
+Speed, pitch, gain and peak normalization in one vectorized pipeline
+
+The audio is converted to a float32 (frames, channels) buffer once and
+converted back once:
+
+- speed and pitch share one phase-vocoder time stretch followed by one
+  resample. Resampling by the pitch ratio p shifts the pitch and shortens
+  the audio by p, so stretching by p / speed first leaves the duration at
+  1 / speed with the pitch unchanged unless asked for.
+- gain and peak normalization are a single multiply.
+
+Every step works on whole arrays (framed STFT, cumulative phase, strided
+overlap-add), so there is no per-sample or per-frame Python loop.
+"""
+import numpy as np
+
+STFT_SIZE = 2048
+STFT_HOP = STFT_SIZE // 4
+STRETCH_BLOCK_FRAMES = 128
+NORMALIZE_HEADROOM_DB = 0.1  # same default as pydub.effects.normalize
+
+
+def _window() -> np.ndarray:
+    return np.hanning(STFT_SIZE).astype(np.float32)
+
+
+def time_stretch(x: np.ndarray, stretch: float) -> np.ndarray:
+    """
+    Phase-vocoder time stretch of a 1-D signal (stretch > 1 is longer), pitch unchanged
+
+    Output frames are produced in blocks of STRETCH_BLOCK_FRAMES (carrying
+    the accumulated phase across blocks), so memory stays bounded by the
+    block size rather than the length of the audio.
+    """
+    if abs(stretch - 1.0) < 1e-3 or len(x) < STFT_SIZE:
+        return x
+
+    window = _window()
+    padded = np.pad(x.astype(np.float32, copy=False), (STFT_SIZE // 2, STFT_SIZE // 2 + STFT_HOP))
+    analysis_frames = np.lib.stride_tricks.sliding_window_view(padded, STFT_SIZE)[::STFT_HOP]
+
+    # Analysis positions read at 1 / stretch frames per output frame
+    positions = np.arange(0, len(analysis_frames) - 1, 1.0 / stretch)
+    expected = (2 * np.pi * STFT_HOP * np.arange(STFT_SIZE // 2 + 1) / STFT_SIZE).astype(np.float32)
+
+    overlap = STFT_SIZE // STFT_HOP
+    blocks = np.zeros((len(positions) + overlap - 1, STFT_HOP), dtype=np.float32)
+    norm = np.zeros_like(blocks)
+    window_sq = (window ** 2).reshape(overlap, STFT_HOP)
+    phase_acc = None
+
+    for start in range(0, len(positions), STRETCH_BLOCK_FRAMES):
+        block_positions = positions[start:start + STRETCH_BLOCK_FRAMES]
+        index = block_positions.astype(np.int64)
+        first = index[0]
+        spectrum = np.fft.rfft(analysis_frames[first:index[-1] + 2] * window, axis=1)
+        magnitude = np.abs(spectrum)
+        phase = np.angle(spectrum)
+        local = index - first
+        frac = (block_positions - index).astype(np.float32)[:, None]
+        out_magnitude = (1 - frac) * magnitude[local] + frac * magnitude[local + 1]
+
+        # Phase advance per output frame: expected bin advance plus the wrapped deviation
+        advance = phase[local + 1] - phase[local] - expected
+        advance -= np.float32(2 * np.pi) * np.round(advance / np.float32(2 * np.pi))
+        advance += expected
+        if phase_acc is None:
+            phase_acc = phase[0]
+        out_phase = np.cumsum(advance, axis=0)
+        out_phase -= advance
+        out_phase += phase_acc
+        phase_acc = out_phase[-1] + advance[-1]
+
+        frames = np.fft.irfft(out_magnitude * np.exp(1j * out_phase), n=STFT_SIZE, axis=1).astype(np.float32)
+        frames *= window
+        count = len(frames)
+        for offset in range(overlap):
+            rows = slice(start + offset, start + offset + count)
+            blocks[rows] += frames[:, offset * STFT_HOP:(offset + 1) * STFT_HOP]
+            norm[rows] += window_sq[offset]
+
+    blocks /= np.maximum(norm, 1e-6)
+    length = int(round(len(x) * stretch))
+    return blocks.ravel()[STFT_SIZE // 2:STFT_SIZE // 2 + length]
+
+
+def resample(x: np.ndarray, ratio: float) -> np.ndarray:
+    """Read the signal `ratio` times faster (linear interpolation, like audioop.ratecv)"""
+    if abs(ratio - 1.0) < 1e-6:
+        return x
+    length = max(1, int(len(x) / ratio))
+    return np.interp(np.arange(length) * ratio, np.arange(len(x)), x).astype(np.float32)
+
+
+def apply_voice_effects(samples: np.ndarray, sample_rate: int, speed: float = 1.0, pitch: float = 0.0,
+                        volume: float = 1.0, normalize: bool = True,
+                        noise_reduction=None) -> np.ndarray:
+    """
+    Apply all voice effects to a float32 (frames, channels) buffer in [-1, 1]
+
+    The buffer may be modified in place; use the returned array.
+
+    speed: tempo multiplier (pitch preserved); pitch: shift in semitones;
+    volume: linear gain, ignored when normalize peak-normalizes anyway.
+    noise_reduction, if given, is called as f(channels_by_frames, sample_rate)
+    before the other effects (noisereduce.reduce_noise fits).
+    """
+    audio = samples
+    if noise_reduction is not None:
+        audio = np.asarray(noise_reduction(audio.T, sample_rate), dtype=np.float32).reshape(audio.T.shape).T
+
+    pitch_ratio = 2.0 ** (pitch / 12.0)
+    stretch = pitch_ratio / speed
+    if abs(stretch - 1.0) >= 1e-3 or abs(pitch_ratio - 1.0) >= 1e-6:
+        audio = np.stack(
+            [resample(time_stretch(audio[:, ch], stretch), pitch_ratio) for ch in range(audio.shape[1])],
+            axis=1
+        )
+
+    if normalize:
+        peak = float(np.max(np.abs(audio))) if audio.size else 0.0
+        gain = 10 ** (-NORMALIZE_HEADROOM_DB / 20) / peak if peak > 0 else 1.0
+    else:
+        gain = max(volume, 0.0)
+    if gain != 1.0:
+        audio *= np.float32(gain)
+
+    return audio
+
+
+def to_float_buffer(raw_data: bytes, sample_width: int, channels: int) -> np.ndarray:
+    """PCM bytes (16 or 32-bit signed) -> float32 (frames, channels)"""
+    dtype = {2: np.int16, 4: np.int32}[sample_width]
+    samples = np.frombuffer(raw_data, dtype=dtype).astype(np.float32).reshape(-1, channels)
+    samples *= np.float32(1.0 / 2 ** (8 * sample_width - 1))
+    return samples
+
+
+def to_pcm16(audio: np.ndarray) -> bytes:
+    """float32 (frames, channels) -> interleaved 16-bit PCM bytes, clipped (in place)"""
+    np.clip(audio, -1.0, 1.0, out=audio)
+    audio *= np.float32(32767)
+    return audio.astype(np.int16).tobytes()
+
+
+class CrossfadeJoiner:
+    """
+    Join consecutive float buffers with a linear crossfade, incrementally
+
+    push() returns the audio that is final so far; the last fade_frames
+    are held back to overlap with the next buffer, and flush() returns
+    them at the end. Used both for whole-text joins and for streaming.
+    """
+
+    def __init__(self, fade_frames: int):
+        self.fade_frames = fade_frames
+        self._tail = None
+
+    def push(self, buffer: np.ndarray) -> np.ndarray:
+        if self._tail is not None and len(self._tail):
+            overlap = min(len(self._tail), len(buffer))
+            ramp = np.linspace(0.0, 1.0, overlap, dtype=np.float32)[:, None]
+            mixed = self._tail[len(self._tail) - overlap:] * (1 - ramp) + buffer[:overlap] * ramp
+            buffer = np.concatenate([self._tail[:len(self._tail) - overlap], mixed, buffer[overlap:]])
+
+        keep = min(self.fade_frames, len(buffer))
+        self._tail = buffer[len(buffer) - keep:].copy()
+        return buffer[:len(buffer) - keep]
+
+    def flush(self) -> np.ndarray:
+        tail, self._tail = self._tail, None
+        return tail if tail is not None else np.zeros((0, 1), dtype=np.float32)
+
+
+def crossfade_join(buffers: list, fade_frames: int) -> np.ndarray:
+    """Concatenate float (frames, channels) buffers with crossfades between them"""
+    joiner = CrossfadeJoiner(fade_frames)
+    parts = [joiner.push(buffer) for buffer in buffers]
+    parts.append(joiner.flush())
+    return np.concatenate(parts)
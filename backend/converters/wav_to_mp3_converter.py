@@ -1,29 +1,61 @@
-
 # converters/wav_to_mp3_converter.py - Audio conversion logic
-from utils.dependencies import PYDUB_AVAILABLE
+"""
+WAV to MP3 with FFmpeg directly
+
+FFmpeg reads the WAV and writes the MP3 itself (file to file, or to a pipe
+for streaming responses), so samples never pass through Python and memory
+use doesn't depend on the input length.
+"""
+from typing import AsyncIterator, Optional
+import asyncio
+
+from converters import audio_converter
+from converters.waveform import PeakAccumulator, peaks_output_args
+
+# LAME VBR quality (0 = best, 9 = smallest); 2 averages around 190 kbps
+DEFAULT_VBR_QUALITY = 2
 
-async def wav_to_mp3_converter(wav_path: str, output_path: str) -> bool:
-    """Convert WAV to MP3 format"""
-    if not PYDUB_AVAILABLE:
+def mp3_encoder_args(bitrate: Optional[str] = None, vbr_quality: Optional[int] = None) -> list:
+    """Constant bitrate when a bitrate is given, VBR otherwise"""
+    if bitrate:
+        return ["-c:a", "libmp3lame", "-b:a", bitrate]
+    quality = DEFAULT_VBR_QUALITY if vbr_quality is None else vbr_quality
+    return ["-c:a", "libmp3lame", "-q:a", str(quality)]
+
+async def wav_to_mp3_converter(wav_path: str, output_path: str, bitrate: Optional[str] = None,
+                               vbr_quality: Optional[int] = None,
+                               waveform_path: Optional[str] = None) -> bool:
+    """Convert WAV to MP3 format, optionally writing waveform peaks from the same decode"""
+    if not audio_converter.FFMPEG_AVAILABLE:
         return False
     
     try:
-        from pydub import AudioSegment
+        cmd = [audio_converter.FFMPEG_PATH, "-y", "-i", wav_path, "-vn"]
+        cmd.extend(mp3_encoder_args(bitrate, vbr_quality))
+        cmd.append(output_path)
         
-        # Load WAV file
-        audio = AudioSegment.from_wav(wav_path)
+        peaks = None
+        if waveform_path:
+            peaks = PeakAccumulator()
+            cmd.extend(peaks_output_args())
         
-        # Export as MP3 with good quality settings
-        audio.export(
-            output_path, 
-            format="mp3",
-            bitrate="192k",  # Good quality bitrate
-            parameters=["-q:a", "2"]  # High quality VBR
+        success = await asyncio.to_thread(
+            audio_converter._run_ffmpeg, cmd, wav_path, [output_path], peaks.consume if peaks else None
         )
-        
-        print(f"WAV converted to MP3: {output_path}")
-        return True
+        if success:
+            print(f"WAV converted to MP3: {output_path}")
+            if peaks:
+                audio_converter._write_peaks(peaks, waveform_path)
+        return success
         
     except Exception as e:
         print(f"WAV to MP3 conversion error: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def stream_wav_to_mp3(wav_path: str, bitrate: Optional[str] = None,
+                      vbr_quality: Optional[int] = None) -> AsyncIterator[bytes]:
+    """Yield the MP3 while FFmpeg encodes it"""
+    cmd = [audio_converter.FFMPEG_PATH, "-v", "error", "-i", wav_path, "-vn"]
+    cmd.extend(mp3_encoder_args(bitrate, vbr_quality))
+    cmd.extend(["-f", "mp3", "pipe:1"])
+    return audio_converter.stream_ffmpeg_output(cmd)
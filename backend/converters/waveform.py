@@ -0,0 +1,150 @@
+# converters/waveform.py - Multi-resolution waveform peaks
+"""
+Waveform peaks computed while audio is converted
+
+The conversion's FFmpeg process gets one extra output: the same decoded
+(and filtered) audio as raw 16-bit PCM on stdout. PeakAccumulator reads
+it, reducing each bucket of samples to its minimum and maximum with NumPy
+as it arrives, so the peaks cost no extra decode and never hold the whole
+signal in memory.
+
+Coarser zoom levels are reduced from the finest one. The peaks file is
+JSON in the layout of audiowaveform's format (interleaved 8-bit min/max
+pairs), with one entry per zoom level:
+
+    {"version": 1, "sample_rate": 44100, "channels": 1, "bits": 8,
+     "duration": 12.3, "levels": [{"samples_per_pixel": 256,
+     "length": 2119, "data": [min0, max0, min1, max1, ...]}, ...]}
+
+Stereo audio is folded into one envelope (the extremes of both channels).
+"""
+import json
+from typing import BinaryIO, List, Optional
+
+import numpy as np
+
+from utils.config import WAVEFORM_SAMPLE_RATE, WAVEFORM_SAMPLES_PER_PIXEL, WAVEFORM_MAX_BUCKETS
+
+PEAKS_CHANNELS = 2
+READ_SIZE = 256 * 1024
+
+
+def peaks_output_args(audio_filter: Optional[str] = None, source: str = "0:a:0") -> list:
+    """
+    FFmpeg arguments for the extra raw PCM output read by PeakAccumulator
+
+    source is the stream to map; pass a -filter_complex output label
+    (e.g. "[peaks]") to reuse audio that is already filtered.
+    """
+    args = ["-map", source]
+    if audio_filter:
+        args.extend(["-af", audio_filter])
+    args.extend([
+        "-ac", str(PEAKS_CHANNELS), "-ar", str(WAVEFORM_SAMPLE_RATE),
+        "-c:a", "pcm_s16le", "-f", "s16le", "pipe:1"
+    ])
+    return args
+
+
+class PeakAccumulator:
+    """Reduce a stream of interleaved s16le PCM to per-bucket min/max"""
+
+    def __init__(self, samples_per_pixel: int = WAVEFORM_SAMPLES_PER_PIXEL[0],
+                 channels: int = PEAKS_CHANNELS, sample_rate: int = WAVEFORM_SAMPLE_RATE):
+        self.samples_per_pixel = samples_per_pixel
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.frames = 0
+        self._bucket_values = samples_per_pixel * channels
+        self._pending = b""
+        self._mins: List[np.ndarray] = []
+        self._maxs: List[np.ndarray] = []
+        self.error: Optional[Exception] = None
+
+    def feed(self, data: bytes) -> None:
+        data = self._pending + data
+        usable = len(data) - len(data) % (2 * self._bucket_values)
+        self._pending = data[usable:]
+        if usable:
+            buckets = np.frombuffer(data[:usable], dtype="<i2").reshape(-1, self._bucket_values)
+            self._mins.append(buckets.min(axis=1))
+            self._maxs.append(buckets.max(axis=1))
+            self.frames += usable // (2 * self.channels)
+
+    def consume(self, stream: BinaryIO) -> None:
+        """Read a pipe to EOF (run in its own thread next to the FFmpeg process)"""
+        while True:
+            chunk = stream.read(READ_SIZE)
+            if not chunk:
+                break
+            if self.error is None:
+                try:
+                    self.feed(chunk)
+                except Exception as e:
+                    # Keep draining, or FFmpeg would block on a full pipe
+                    self.error = e
+
+    def finish(self) -> tuple:
+        """(mins, maxs) as int16 arrays, including the final partial bucket"""
+        tail = self._pending[:len(self._pending) - len(self._pending) % (2 * self.channels)]
+        if tail:
+            samples = np.frombuffer(tail, dtype="<i2")
+            self._mins.append(samples.min(keepdims=True))
+            self._maxs.append(samples.max(keepdims=True))
+            self.frames += len(tail) // (2 * self.channels)
+        self._pending = b""
+        if not self._mins:
+            return np.zeros(0, dtype=np.int16), np.zeros(0, dtype=np.int16)
+        return np.concatenate(self._mins), np.concatenate(self._maxs)
+
+    def write(self, path: str) -> bool:
+        """Write the peaks file; False if no audio was read"""
+        if self.error is not None:
+            raise self.error
+        mins, maxs = self.finish()
+        if not len(mins):
+            return False
+        peaks = build_peaks(mins, maxs, self.samples_per_pixel, self.sample_rate, self.frames)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(peaks, f, separators=(",", ":"))
+        return True
+
+
+def _reduce(values: np.ndarray, factor: int, reducer) -> np.ndarray:
+    """Combine every `factor` consecutive buckets (the last group may be short)"""
+    padded = -(-len(values) // factor) * factor
+    if padded != len(values):
+        values = np.concatenate([values, np.full(padded - len(values), values[-1], dtype=values.dtype)])
+    return reducer(values.reshape(-1, factor), axis=1)
+
+
+def build_peaks(mins: np.ndarray, maxs: np.ndarray, samples_per_pixel: int,
+                sample_rate: int, frames: int) -> dict:
+    """Peaks document with every zoom level of WAVEFORM_SAMPLES_PER_PIXEL that fits"""
+    levels = []
+    zooms = [spp for spp in WAVEFORM_SAMPLES_PER_PIXEL if spp % samples_per_pixel == 0]
+    for i, spp in enumerate(zooms):
+        factor = spp // samples_per_pixel
+        length = -(-len(mins) // factor)
+        if length > WAVEFORM_MAX_BUCKETS and i < len(zooms) - 1:
+            continue
+        level_mins = _reduce(mins, factor, np.min) if factor > 1 else mins
+        level_maxs = _reduce(maxs, factor, np.max) if factor > 1 else maxs
+        data = np.empty(2 * length, dtype=np.int8)
+        data[0::2] = level_mins >> 8
+        data[1::2] = level_maxs >> 8
+        levels.append({"samples_per_pixel": spp, "length": int(length), "data": data.tolist()})
+
+    return {
+        "version": 1,
+        "sample_rate": sample_rate,
+        "channels": 1,
+        "bits": 8,
+        "duration": round(frames / sample_rate, 3),
+        "levels": levels
+    }
+
+
+def peaks_path_for(output_path: str) -> str:
+    """Peaks file stored next to an output: name.mp3 -> name.peaks.json"""
+    return output_path.rsplit(".", 1)[0] + ".peaks.json"
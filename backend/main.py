@@ -1,5 +1,6 @@
 # main.py - Updated with document, audio, and video converter support
 import os
+import threading
 from datetime import datetime
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
@@ -37,6 +38,7 @@ from routers import (
 )
 from utils.config import UPLOAD_DIR
 from utils.dependencies import check_dependencies, cleanup_old_files, get_dependency_status
+from converters.segmentation_pool import warm_up_models
 
 # Lifespan event handler
 @asynccontextmanager
@@ -46,6 +48,9 @@ async def lifespan(app: FastAPI):
     print(f"Upload directory: {UPLOAD_DIR}")
     check_dependencies()
     cleanup_old_files()
+    # Load background removal models off the startup path so the first
+    # request doesn't pay for model download and session creation
+    threading.Thread(target=warm_up_models, name="bg-removal-warmup", daemon=True).start()
     yield
     # Shutdown
     print("Shutting down File Converter API...")
@@ -184,6 +189,8 @@ async def list_converters():
             "png_to_webp": "/convert/png-to-webp",
             "wav_to_mp3": "/convert/wav-to-mp3",
             "image_converter": "/convert/image",
+            "image_batch_converter": "/convert/convert-image-batch",
+            "image_variants": "/convert/image-variants",
             "video_converter": "/convert/video",
             "document_converter": "/convert/document",
             "audio_converter": "/convert/audio",
@@ -1,15 +1,20 @@
 # routers/audio_converter.py - CORRECTED VERSION
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 import os
 import logging
 import uuid
 
-from utils.config import UPLOAD_DIR
-from utils.helpers import generate_unique_filename, check_rate_limit, write_file
+from utils.config import UPLOAD_DIR, MAX_AUDIO_SIZE, LOUDNESS_TARGETS
+from utils.helpers import generate_unique_filename, check_rate_limit, write_file, save_upload
 from utils.dependencies import cleanup_old_files
-from converters.audio_converter import convert_audio, FFMPEG_AVAILABLE
+from converters.audio_converter import (
+    convert_audio, convert_audio_multi, stream_audio, FFMPEG_AVAILABLE,
+    STREAM_MUXERS, STREAM_MEDIA_TYPES, PIPE_INPUT_FORMATS
+)
+from converters.waveform import peaks_path_for
 
 router = APIRouter()
 security = HTTPBearer(auto_error=False)
@@ -24,13 +29,25 @@ SUPPORTED_AUDIO_FORMATS = {
     ],
     'output': [
         # Only reliable output formats
-        'mp3', 'wav', 'aac', 'm4a'
+        'mp3', 'wav', 'aac', 'm4a', 'ogg', 'flac'
     ]
 }
 
 # Simple progress storage
 conversion_status = {}
 
+def validate_loudness(loudness: Optional[str]) -> Optional[str]:
+    """Normalize the loudness form value ("" / "none" mean no normalization)"""
+    if not loudness or loudness.lower() == "none":
+        return None
+    loudness = loudness.lower()
+    if loudness not in LOUDNESS_TARGETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid loudness target: {loudness}. Valid options: {', '.join(LOUDNESS_TARGETS)}"
+        )
+    return loudness
+
 def validate_audio_file_size(file: UploadFile, max_size_mb: int = 1024):
     """Validate audio file size"""
     max_size = max_size_mb * 1024 * 1024
@@ -42,7 +59,7 @@ def validate_audio_file_size(file: UploadFile, max_size_mb: int = 1024):
         )
 
 async def process_audio_conversion(conversion_id: str, input_path: str, output_path: str, 
-                                 target_format: str, bitrate: str):
+                                 target_format: str, bitrate: str, loudness: Optional[str] = None):
     """Background audio conversion process"""
     try:
         print(f"Starting background audio conversion for ID: {conversion_id}")
@@ -54,8 +71,9 @@ async def process_audio_conversion(conversion_id: str, input_path: str, output_p
             "message": "Converting audio..."
         }
         
-        # Run the actual conversion
-        success = await convert_audio(input_path, output_path, target_format, bitrate)
+        # Run the actual conversion (waveform peaks come from the same decode)
+        waveform_path = peaks_path_for(output_path)
+        success = await convert_audio(input_path, output_path, target_format, bitrate, loudness, waveform_path)
         
         if success:
             if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
@@ -63,7 +81,8 @@ async def process_audio_conversion(conversion_id: str, input_path: str, output_p
                     "status": "completed",
                     "progress": 100,
                     "message": "Audio conversion completed",
-                    "download_url": f"/download/{os.path.basename(output_path)}"
+                    "download_url": f"/download/{os.path.basename(output_path)}",
+                    "waveform_url": f"/download/{os.path.basename(waveform_path)}" if os.path.exists(waveform_path) else None
                 }
                 print(f"Audio conversion {conversion_id} completed successfully")
             else:
@@ -99,15 +118,150 @@ async def process_audio_conversion(conversion_id: str, input_path: str, output_p
         except:
             pass
 
+async def process_audio_multi_conversion(conversion_id: str, input_path: str, outputs: dict, bitrate: str,
+                                         loudness: Optional[str] = None):
+    """Background multi-format conversion (one decode, one FFmpeg process)"""
+    try:
+        print(f"Starting background multi-format audio conversion for ID: {conversion_id}")
+        
+        conversion_status[conversion_id] = {
+            "status": "processing",
+            "progress": 10,
+            "message": f"Converting audio to {len(outputs)} formats..."
+        }
+        
+        # Every format carries the same audio, so one peaks file serves them all
+        waveform_path = peaks_path_for(next(iter(outputs.values())))
+        success = await convert_audio_multi(input_path, outputs, bitrate, loudness, waveform_path)
+        
+        if success:
+            downloads = {
+                target_format: f"/download/{os.path.basename(output_path)}"
+                for target_format, output_path in outputs.items()
+            }
+            conversion_status[conversion_id] = {
+                "status": "completed",
+                "progress": 100,
+                "message": "Audio conversion completed",
+                "download_url": next(iter(downloads.values())),
+                "downloads": downloads,
+                "waveform_url": f"/download/{os.path.basename(waveform_path)}" if os.path.exists(waveform_path) else None
+            }
+            print(f"Audio conversion {conversion_id} completed successfully")
+        else:
+            # Don't leave a partial set behind
+            for output_path in outputs.values():
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            conversion_status[conversion_id] = {
+                "status": "error",
+                "progress": 0,
+                "message": "Audio conversion failed",
+                "error": "FFmpeg conversion failed"
+            }
+            print(f"Audio conversion {conversion_id} failed")
+            
+    except Exception as e:
+        print(f"Audio conversion {conversion_id} error: {str(e)}")
+        conversion_status[conversion_id] = {
+            "status": "error",
+            "progress": 0,
+            "message": "Conversion error",
+            "error": str(e)
+        }
+    finally:
+        # Cleanup input file
+        try:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+                print(f"Cleaned up input file: {input_path}")
+        except:
+            pass
+
+async def stream_audio_response(file: UploadFile, file_extension: str, target_format: str,
+                                bitrate: str, loudness: Optional[str] = None) -> StreamingResponse:
+    """Streaming response whose body is FFmpeg's output"""
+    if target_format not in STREAM_MUXERS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Streaming is not available for {target_format}. Streamable formats: {', '.join(STREAM_MUXERS)}"
+        )
+    
+    input_path = None
+    if file_extension in PIPE_INPUT_FORMATS and not loudness:
+        if file.size and file.size > MAX_AUDIO_SIZE:
+            raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_AUDIO_SIZE // (1024 * 1024)}MB")
+        
+        async def upload_chunks():
+            total = 0
+            while chunk := await file.read(1024 * 1024):
+                total += len(chunk)
+                if total > MAX_AUDIO_SIZE:
+                    raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {MAX_AUDIO_SIZE // (1024 * 1024)}MB")
+                yield chunk
+        source = upload_chunks()
+    else:
+        # Containers like M4A/WMA may need seeking, and loudness normalization
+        # measures the whole input first, so FFmpeg reads these from a file
+        input_path = os.path.join(UPLOAD_DIR, generate_unique_filename(file.filename))
+        await save_upload(file, input_path, max_bytes=MAX_AUDIO_SIZE)
+        source = input_path
+    
+    def cleanup():
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+    
+    # Pull the first chunk before answering: the probe and FFmpeg's input
+    # errors surface here, while a proper error status can still be sent
+    chunks = stream_audio(source, target_format, bitrate, loudness)
+    try:
+        first_chunk = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_chunk = b""
+    except HTTPException:
+        cleanup()
+        raise
+    except (ValueError, RuntimeError) as e:
+        cleanup()
+        raise HTTPException(status_code=400, detail=f"Could not convert audio: {e}")
+    
+    async def audio_chunks():
+        try:
+            if first_chunk:
+                yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+            cleanup()
+    
+    print(f"Streaming audio conversion: {file.filename} -> {target_format}")
+    return StreamingResponse(
+        audio_chunks(),
+        media_type=STREAM_MEDIA_TYPES[target_format],
+        headers={"Content-Disposition": f'attachment; filename="converted_audio.{target_format}"'}
+    )
+
 @router.post("/convert-audio")
 async def convert_audio_endpoint(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     target_format: str = Form(...),
     bitrate: str = Form(default="320"),
+    stream: bool = Form(default=False),
+    loudness: Optional[str] = Form(default=None),
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ):
-    """Universal audio conversion endpoint supporting all formats"""
+    """
+    Universal audio conversion endpoint supporting all formats
+
+    stream: return the converted audio as the response body while FFmpeg
+    produces it (mp3, ogg, aac and m4a) instead of starting a background
+    job to poll; nothing is written to uploads/ for pipe-friendly inputs
+
+    loudness: normalize to an EBU R128 target (podcast -16 LUFS,
+    streaming -14 LUFS, broadcast -23 LUFS)
+    """
     
     print(f"Received audio conversion request: {file.filename} -> {target_format}")
     
@@ -142,9 +296,14 @@ async def convert_audio_endpoint(
             detail=f"Invalid bitrate setting: {bitrate}. Valid options: {', '.join(valid_bitrates)}"
         )
     
+    loudness = validate_loudness(loudness)
+    
     # Validate file size
     validate_audio_file_size(file)
     
+    if stream:
+        return await stream_audio_response(file, file_extension, target_format.lower(), bitrate, loudness)
+    
     try:
         # Generate unique ID
         conversion_id = str(uuid.uuid4())
@@ -179,7 +338,8 @@ async def convert_audio_endpoint(
             input_path,
             output_path,
             target_format,
-            bitrate
+            bitrate,
+            loudness
         )
         
         print(f"Started background audio conversion: {conversion_id}")
@@ -193,6 +353,7 @@ async def convert_audio_endpoint(
             "status": "started",
             "target_format": target_format,
             "bitrate": bitrate,
+            "loudness": loudness,
             "progress_url": f"/convert/audio-progress/{conversion_id}"
         }
         
@@ -210,6 +371,105 @@ async def convert_audio_endpoint(
         
         raise HTTPException(status_code=500, detail=f"Audio conversion setup failed: {error_message}")
 
+@router.post("/convert-audio-multi")
+async def convert_audio_multi_endpoint(
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...),
+    target_formats: str = Form(...),
+    bitrate: str = Form(default="320"),
+    loudness: Optional[str] = Form(default=None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+):
+    """
+    Convert one upload to several formats in one job
+
+    target_formats: comma-separated list, e.g. "mp3,ogg,flac". The audio is
+    decoded once and encoded to every format by a single FFmpeg process;
+    the completed status lists a download URL per format.
+    """
+    
+    if not FFMPEG_AVAILABLE:
+        raise HTTPException(
+            status_code=503, 
+            detail="FFmpeg not available. Please install FFmpeg to enable audio conversion."
+        )
+    
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No filename provided")
+    
+    file_extension = file.filename.split('.')[-1].lower()
+    if file_extension not in SUPPORTED_AUDIO_FORMATS['input']:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Unsupported input format: {file_extension}. Supported formats: {', '.join(SUPPORTED_AUDIO_FORMATS['input'])}"
+        )
+    
+    formats = list(dict.fromkeys(f.strip().lower() for f in target_formats.split(",") if f.strip()))
+    if not formats:
+        raise HTTPException(status_code=400, detail="No target formats provided")
+    unsupported = [f for f in formats if f not in SUPPORTED_AUDIO_FORMATS['output']]
+    if unsupported:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Unsupported output format: {', '.join(unsupported)}. Supported formats: {', '.join(SUPPORTED_AUDIO_FORMATS['output'])}"
+        )
+    
+    valid_bitrates = ["96", "128", "192", "256", "320"]
+    if bitrate not in valid_bitrates:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid bitrate setting: {bitrate}. Valid options: {', '.join(valid_bitrates)}"
+        )
+    
+    loudness = validate_loudness(loudness)
+    validate_audio_file_size(file)
+    
+    try:
+        conversion_id = str(uuid.uuid4())
+        
+        input_filename = generate_unique_filename(file.filename)
+        input_path = os.path.join(UPLOAD_DIR, input_filename)
+        
+        content = await file.read()
+        await write_file(input_path, content)
+        
+        print(f"Saved input file: {input_filename} ({len(content)} bytes)")
+        
+        base_name = file.filename.rsplit('.', 1)[0]
+        outputs = {
+            target_format: os.path.join(UPLOAD_DIR, generate_unique_filename(f"{base_name}_converted.{target_format}"))
+            for target_format in formats
+        }
+        
+        conversion_status[conversion_id] = {
+            "status": "starting",
+            "progress": 0,
+            "message": "Initializing audio conversion..."
+        }
+        
+        background_tasks.add_task(
+            process_audio_multi_conversion,
+            conversion_id,
+            input_path,
+            outputs,
+            bitrate,
+            loudness
+        )
+        
+        return {
+            "message": f"Audio conversion to {', '.join(f.upper() for f in formats)} started",
+            "conversion_id": conversion_id,
+            "status": "started",
+            "target_formats": formats,
+            "bitrate": bitrate,
+            "loudness": loudness,
+            "progress_url": f"/convert/audio-progress/{conversion_id}"
+        }
+        
+    except Exception as e:
+        print(f"Audio setup error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Audio conversion setup failed: {str(e)}")
+
 @router.get("/audio-progress/{conversion_id}")
 async def get_audio_conversion_progress(conversion_id: str):
     """Get audio conversion progress and status"""
@@ -225,6 +485,7 @@ async def get_supported_audio_formats():
         "input_formats": SUPPORTED_AUDIO_FORMATS['input'],
         "output_formats": SUPPORTED_AUDIO_FORMATS['output'],
         "bitrate_options": ["96", "128", "192", "256", "320"],
+        "loudness_targets": LOUDNESS_TARGETS,
         "format_categories": {
             "lossy": {
                 "formats": ["mp3", "aac", "m4a", "ogg", "opus", "wma", "ac3"],
@@ -250,7 +511,9 @@ async def get_supported_audio_formats():
             "ffmpeg_available": FFMPEG_AVAILABLE,
             "max_file_size": "1GB",
             "bitrate_note": "Higher bitrates provide better quality but larger file sizes",
-            "lossless_note": "Lossless formats ignore bitrate settings and preserve original quality"
+            "lossless_note": "Lossless formats ignore bitrate settings and preserve original quality",
+            "streaming_formats": list(STREAM_MUXERS),
+            "streaming_note": "Send stream=true to receive these formats directly in the response while they are converted"
         }
     }
 
@@ -3,13 +3,18 @@ Background Remover API Router
 Provides comprehensive background removal endpoints with advanced features
 """
 from fastapi import APIRouter, File, UploadFile, HTTPException, Form
-from fastapi.responses import FileResponse
-from typing import Optional, List
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import Optional, List, Tuple
+import asyncio
+import json
 import os
+import time
 import uuid
 import shutil
 from datetime import datetime
 from converters.background_remover import BackgroundRemover
+from converters.segmentation_pool import get_pool_status
+from utils.helpers import stream_zip
 
 router = APIRouter(prefix="/bg-remove", tags=["Background Removal"])
 
@@ -21,6 +26,10 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 ALLOWED_FORMATS = {".jpg", ".jpeg", ".png", ".webp", ".heic"}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Per-image status of batch jobs, kept for an hour after they finish
+batch_status = {}
+BATCH_STATUS_TTL = 3600
+
 
 def validate_file(file: UploadFile) -> None:
     """Validate uploaded file"""
@@ -54,33 +63,122 @@ def save_upload_file(upload_file: UploadFile) -> str:
     return file_path
 
 
+def _prune_batch_status() -> None:
+    """Forget batches that finished more than BATCH_STATUS_TTL seconds ago"""
+    cutoff = time.time() - BATCH_STATUS_TTL
+    for batch_id in [b for b, st in batch_status.items() if st.get("finished_at", cutoff + 1) < cutoff]:
+        del batch_status[batch_id]
+
+
+def resolve_input(file: Optional[UploadFile], mask_id: Optional[str]) -> Tuple[str, str]:
+    """
+    Return (input_path, filename) for an uploaded image or a mask handle
+
+    With a mask handle the cached source image is copied to a fresh upload
+    path, so endpoints clean up as usual and the cached mask is reused.
+    """
+    if file is not None and file.filename:
+        validate_file(file)
+        return save_upload_file(file), file.filename
+
+    if mask_id:
+        source_path = BackgroundRemover.get_mask_source(mask_id)
+        if source_path is None:
+            raise HTTPException(status_code=404, detail="Mask handle not found or expired. Upload the image again.")
+        input_path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.img")
+        shutil.copyfile(source_path, input_path)
+        return input_path, f"{mask_id}.png"
+
+    raise HTTPException(status_code=400, detail="Provide an image file or a mask_id")
+
+
+def parse_color_stops(color_stops: str) -> List[tuple]:
+    """Parse 'r,g,b@position;r,g,b@position' into [(position, (r, g, b))]"""
+    try:
+        entries = [entry.strip() for entry in color_stops.split(";") if entry.strip()]
+        if len(entries) < 2:
+            raise ValueError("at least two stops are required")
+
+        stops = []
+        for index, entry in enumerate(entries):
+            color, _, position = entry.partition("@")
+            rgb = tuple(int(c) for c in color.split(","))
+            if len(rgb) != 3 or not all(0 <= c <= 255 for c in rgb):
+                raise ValueError(f"invalid color '{color}'")
+            # Stops without a position are spread evenly
+            pos = float(position) if position else index / (len(entries) - 1)
+            if not 0 <= pos <= 1:
+                raise ValueError(f"position {pos} is outside 0-1")
+            stops.append((pos, rgb))
+        return stops
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid color stops: {e}")
+
+
+@router.post("/mask")
+async def create_mask_endpoint(file: UploadFile = File(...)):
+    """
+    Segment an image once and return a mask handle
+
+    Pass the returned mask_id (instead of the file) to /remove,
+    /blur-background, /replace-background (as foreground_mask_id),
+    /gradient-background or /resize to reuse the mask without running the
+    model again. Handles expire when the cache evicts them (404).
+
+    Args:
+        file: Image file to segment
+
+    Returns:
+        mask_id, image size and whether the mask was already cached
+    """
+    try:
+        validate_file(file)
+        input_path = save_upload_file(file)
+
+        result = await asyncio.to_thread(BackgroundRemover.create_mask_handle, input_path)
+
+        os.remove(input_path)
+        return result
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        if 'input_path' in locals() and os.path.exists(input_path):
+            os.remove(input_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/remove")
 async def remove_background_endpoint(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    mask_id: Optional[str] = Form(None),
     output_format: str = Form("png"),
     background_color: Optional[str] = Form(None),
     edge_refinement: int = Form(0),
-    quality: int = Form(95)
+    quality: int = Form(95),
+    model: str = Form("isnet-general-use")
 ):
     """
     Remove background from image
 
     Args:
         file: Image file to process
+        mask_id: Mask handle from /mask, used instead of file
         output_format: Output format (png, jpg, webp)
         background_color: Background color in format 'r,g,b,a' (e.g., '255,255,255,255')
         edge_refinement: Edge refinement level 0-10
         quality: Output quality 1-100
+        model: isnet-general-use, u2net_human_seg, or auto (pick by detected subject)
 
     Returns:
-        Processed image file
+        Processed image file (detected subject in X-Detected-Subject)
     """
     try:
-        # Validate
-        validate_file(file)
-
-        # Save input file
-        input_path = save_upload_file(file)
+        if model not in BackgroundRemover.MODEL_CHOICES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Model must be one of: {', '.join(BackgroundRemover.MODEL_CHOICES)}"
+            )
 
         # Parse background color if provided
         bg_color = None
@@ -91,18 +189,23 @@ async def remove_background_endpoint(
             except:
                 raise HTTPException(status_code=400, detail="Invalid background color format")
 
+        # Validate and save input file (or resolve the mask handle)
+        input_path, filename = resolve_input(file, mask_id)
+
         # Generate output path
         output_filename = f"nobg_{uuid.uuid4()}.{output_format}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
 
         # Process
-        result = BackgroundRemover.remove_background(
+        result = await asyncio.to_thread(
+            BackgroundRemover.remove_background,
             input_path=input_path,
             output_path=output_path,
             output_format=output_format,
             background_color=bg_color,
             edge_refinement=edge_refinement,
-            quality=quality
+            quality=quality,
+            model=model
         )
 
         # Clean up input file
@@ -112,9 +215,11 @@ async def remove_background_endpoint(
         return FileResponse(
             output_path,
             media_type=f"image/{output_format}",
-            filename=f"nobg_{file.filename.rsplit('.', 1)[0]}.{output_format}",
+            filename=f"nobg_{filename.rsplit('.', 1)[0]}.{output_format}",
             headers={
-                "X-Processing-Info": str(result)
+                "X-Processing-Info": str(result),
+                "X-Detected-Subject": result["subject"],
+                "X-Model-Used": result["model_used"]
             }
         )
 
@@ -129,7 +234,8 @@ async def remove_background_endpoint(
 
 @router.post("/blur-background")
 async def blur_background_endpoint(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    mask_id: Optional[str] = Form(None),
     blur_intensity: int = Form(20),
     output_format: str = Form("png")
 ):
@@ -138,6 +244,7 @@ async def blur_background_endpoint(
 
     Args:
         file: Image file to process
+        mask_id: Mask handle from /mask, used instead of file
         blur_intensity: Blur intensity 1-100
         output_format: Output format (png, jpg, webp)
 
@@ -145,13 +252,13 @@ async def blur_background_endpoint(
         Processed image file
     """
     try:
-        validate_file(file)
-        input_path = save_upload_file(file)
+        input_path, filename = resolve_input(file, mask_id)
 
         output_filename = f"blurred_{uuid.uuid4()}.{output_format}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
 
-        result = BackgroundRemover.blur_background(
+        result = await asyncio.to_thread(
+            BackgroundRemover.blur_background,
             input_path=input_path,
             output_path=output_path,
             blur_intensity=blur_intensity,
@@ -163,7 +270,7 @@ async def blur_background_endpoint(
         return FileResponse(
             output_path,
             media_type=f"image/{output_format}",
-            filename=f"blurred_{file.filename}"
+            filename=f"blurred_{filename}"
         )
 
     except HTTPException:
@@ -176,8 +283,9 @@ async def blur_background_endpoint(
 
 @router.post("/replace-background")
 async def replace_background_endpoint(
-    foreground: UploadFile = File(...),
+    foreground: Optional[UploadFile] = File(None),
     background: UploadFile = File(...),
+    foreground_mask_id: Optional[str] = Form(None),
     output_format: str = Form("png")
 ):
     """
@@ -186,22 +294,23 @@ async def replace_background_endpoint(
     Args:
         foreground: Foreground image file
         background: Background image file
+        foreground_mask_id: Mask handle from /mask, used instead of foreground
         output_format: Output format (png, jpg, webp)
 
     Returns:
         Processed image file
     """
     try:
-        validate_file(foreground)
         validate_file(background)
 
-        foreground_path = save_upload_file(foreground)
+        foreground_path, foreground_filename = resolve_input(foreground, foreground_mask_id)
         background_path = save_upload_file(background)
 
         output_filename = f"replaced_{uuid.uuid4()}.{output_format}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
 
-        result = BackgroundRemover.replace_background(
+        result = await asyncio.to_thread(
+            BackgroundRemover.replace_background,
             foreground_path=foreground_path,
             background_path=background_path,
             output_path=output_path,
@@ -214,7 +323,7 @@ async def replace_background_endpoint(
         return FileResponse(
             output_path,
             media_type=f"image/{output_format}",
-            filename=f"replaced_{foreground.filename}"
+            filename=f"replaced_{foreground_filename}"
         )
 
     except HTTPException:
@@ -229,29 +338,33 @@ async def replace_background_endpoint(
 
 @router.post("/gradient-background")
 async def gradient_background_endpoint(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    mask_id: Optional[str] = Form(None),
     gradient_type: str = Form("linear"),
     color_start: str = Form("138,43,226"),  # Purple
     color_end: str = Form("75,0,130"),  # Indigo
-    output_format: str = Form("png")
+    output_format: str = Form("png"),
+    angle: Optional[float] = Form(None),
+    color_stops: Optional[str] = Form(None)
 ):
     """
     Add gradient background to image
 
     Args:
         file: Image file to process
+        mask_id: Mask handle from /mask, used instead of file
         gradient_type: Gradient type (linear or radial)
         color_start: Start color in RGB format 'r,g,b'
         color_end: End color in RGB format 'r,g,b'
         output_format: Output format (png, jpg, webp)
+        angle: Linear gradient angle in degrees (0 = to top, 90 = to right, 180 = to bottom)
+        color_stops: Multi-stop colors 'r,g,b@position;...' with positions 0-1,
+                     e.g. '255,0,0@0;255,255,0@0.5;0,0,255@1' (positions optional)
 
     Returns:
         Processed image file
     """
     try:
-        validate_file(file)
-        input_path = save_upload_file(file)
-
         # Parse colors
         try:
             start = tuple(int(c) for c in color_start.split(","))
@@ -259,16 +372,28 @@ async def gradient_background_endpoint(
         except:
             raise HTTPException(status_code=400, detail="Invalid color format")
 
+        if gradient_type not in ("linear", "radial"):
+            raise HTTPException(status_code=400, detail="Gradient type must be 'linear' or 'radial'")
+
+        stops = parse_color_stops(color_stops) if color_stops else None
+
+        # Validate everything before saving the input, so a rejected request
+        # leaves nothing behind
+        input_path, filename = resolve_input(file, mask_id)
+
         output_filename = f"gradient_{uuid.uuid4()}.{output_format}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
 
-        result = BackgroundRemover.add_gradient_background(
+        result = await asyncio.to_thread(
+            BackgroundRemover.add_gradient_background,
             input_path=input_path,
             output_path=output_path,
             gradient_type=gradient_type,
             color_start=start,
             color_end=end,
-            output_format=output_format
+            output_format=output_format,
+            angle=angle,
+            color_stops=stops
         )
 
         os.remove(input_path)
@@ -276,7 +401,7 @@ async def gradient_background_endpoint(
         return FileResponse(
             output_path,
             media_type=f"image/{output_format}",
-            filename=f"gradient_{file.filename}"
+            filename=f"gradient_{filename}"
         )
 
     except HTTPException:
@@ -296,6 +421,11 @@ async def batch_remove_endpoint(
     """
     Batch process multiple images
 
+    Images are processed concurrently and each result is streamed into the
+    ZIP as soon as it finishes. Per-image status is available from
+    /batch-status/{batch_id} (batch id in the X-Batch-Id header) while the
+    batch runs, and in manifest.json at the end of the archive.
+
     Args:
         files: List of image files to process
         output_format: Output format (png, jpg, webp)
@@ -304,88 +434,132 @@ async def batch_remove_endpoint(
     Returns:
         ZIP file with all processed images
     """
-    try:
-        import zipfile
-        from io import BytesIO
-
-        # Validate all files
-        for file in files:
-            validate_file(file)
-
-        # Save all input files
-        input_paths = []
-        for file in files:
-            path = save_upload_file(file)
-            input_paths.append(path)
-
-        # Parse background color if provided
-        bg_color = None
-        if background_color:
-            try:
-                parts = background_color.split(",")
-                bg_color = tuple(int(p) for p in parts)
-            except:
-                raise HTTPException(status_code=400, detail="Invalid background color format")
+    # Validate all files
+    for file in files:
+        validate_file(file)
 
-        # Create output directory for batch
-        batch_id = str(uuid.uuid4())
-        batch_dir = os.path.join(UPLOAD_DIR, f"batch_{batch_id}")
-        os.makedirs(batch_dir, exist_ok=True)
+    # Parse background color if provided
+    bg_color = None
+    if background_color:
+        try:
+            parts = background_color.split(",")
+            bg_color = tuple(int(p) for p in parts)
+        except:
+            raise HTTPException(status_code=400, detail="Invalid background color format")
 
-        # Process all images
-        results = []
-        output_paths = []
+    # Create output directory for batch
+    batch_id = str(uuid.uuid4())
+    batch_dir = os.path.join(UPLOAD_DIR, f"batch_{batch_id}")
+    os.makedirs(batch_dir, exist_ok=True)
 
-        for i, input_path in enumerate(input_paths):
-            try:
-                filename = os.path.basename(input_path)
-                output_filename = f"nobg_{i}_{filename.rsplit('.', 1)[0]}.{output_format}"
-                output_path = os.path.join(batch_dir, output_filename)
-
-                result = BackgroundRemover.remove_background(
-                    input_path=input_path,
-                    output_path=output_path,
-                    output_format=output_format,
-                    background_color=bg_color
-                )
-
-                results.append({"index": i, "success": True, "filename": output_filename})
-                output_paths.append(output_path)
-
-            except Exception as e:
-                results.append({"index": i, "success": False, "error": str(e)})
-
-        # Create ZIP file
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for output_path in output_paths:
-                if os.path.exists(output_path):
-                    zip_file.write(output_path, os.path.basename(output_path))
-
-        # Clean up
-        for path in input_paths:
-            if os.path.exists(path):
-                os.remove(path)
+    try:
+        # Save all input files
+        jobs = []
+        for i, file in enumerate(files):
+            stem = os.path.splitext(os.path.basename(file.filename))[0]
+            jobs.append({
+                "index": i,
+                "source": file.filename,
+                "output": f"nobg_{i}_{stem}.{output_format}",
+                "input_path": save_upload_file(file)
+            })
+    except Exception as e:
+        for job in jobs:
+            if os.path.exists(job["input_path"]):
+                os.remove(job["input_path"])
         shutil.rmtree(batch_dir, ignore_errors=True)
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Return ZIP
-        zip_buffer.seek(0)
-        from fastapi.responses import StreamingResponse
-        return StreamingResponse(
-            zip_buffer,
-            media_type="application/zip",
-            headers={"Content-Disposition": f"attachment; filename=batch_nobg_{batch_id}.zip"}
-        )
+    _prune_batch_status()
+    status = {
+        "batch_id": batch_id,
+        "status": "processing",
+        "total": len(jobs),
+        "completed": 0,
+        "successful": 0,
+        "failed": 0,
+        "files": [{"index": job["index"], "source": job["source"], "status": "queued"} for job in jobs]
+    }
+    batch_status[batch_id] = status
 
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    def process_image(job: dict) -> dict:
+        status["files"][job["index"]]["status"] = "processing"
+        output_path = os.path.join(batch_dir, job["output"])
+        try:
+            result = BackgroundRemover.remove_background(
+                input_path=job["input_path"],
+                output_path=output_path,
+                output_format=output_format,
+                background_color=bg_color
+            )
+            return {**job, "success": True, "output_path": output_path, "subject": result.get("subject")}
+        except Exception as e:
+            return {**job, "success": False, "error": str(e)}
+        finally:
+            if os.path.exists(job["input_path"]):
+                os.remove(job["input_path"])
+
+    async def zip_entries():
+        # The semaphore keeps enough images in flight to fill inference
+        # batches without decoding the whole upload set at once
+        semaphore = asyncio.Semaphore(BackgroundRemover.BATCH_CONCURRENCY)
+
+        async def run(job: dict) -> dict:
+            async with semaphore:
+                if status["status"] != "processing":
+                    # Client went away - skip images that have not started
+                    os.remove(job["input_path"])
+                    return {**job, "success": False, "error": "Batch cancelled"}
+                return await asyncio.to_thread(process_image, job)
+
+        tasks = [asyncio.create_task(run(job)) for job in jobs]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                result = await next_done
+                entry = status["files"][result["index"]]
+                status["completed"] += 1
+                if result["success"]:
+                    status["successful"] += 1
+                    entry.update(status="done", output=result["output"], subject=result["subject"])
+                    yield result["output"], result["output_path"]
+                    os.remove(result["output_path"])
+                else:
+                    status["failed"] += 1
+                    entry.update(status="failed", error=result["error"])
+
+            status["status"] = "completed"
+            yield "manifest.json", json.dumps(status, indent=2).encode("utf-8")
+            print(f"Batch {batch_id} finished: {status['successful']}/{status['total']} processed")
+        finally:
+            if status["status"] != "completed":
+                status["status"] = "cancelled"
+            status["finished_at"] = time.time()
+            # Let running workers finish before their files are removed
+            await asyncio.gather(*tasks, return_exceptions=True)
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    return StreamingResponse(
+        stream_zip(zip_entries()),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": f"attachment; filename=batch_nobg_{batch_id}.zip",
+            "X-Batch-Id": batch_id
+        }
+    )
+
+
+@router.get("/batch-status/{batch_id}")
+async def batch_status_endpoint(batch_id: str):
+    """Per-image status of a running (or recently finished) batch"""
+    if batch_id not in batch_status:
+        raise HTTPException(status_code=404, detail="Batch ID not found")
+    return batch_status[batch_id]
 
 
 @router.post("/resize")
 async def resize_endpoint(
-    file: UploadFile = File(...),
+    file: Optional[UploadFile] = File(None),
+    mask_id: Optional[str] = Form(None),
     size: str = Form("original")
 ):
     """
@@ -393,22 +567,26 @@ async def resize_endpoint(
 
     Args:
         file: Image file to resize
+        mask_id: Mask handle from /mask; resizes the cut-out image (PNG)
         size: Size preset (small, medium, original)
 
     Returns:
         Resized image file
     """
     try:
-        validate_file(file)
-        input_path = save_upload_file(file)
+        cut_out = not (file is not None and file.filename) and bool(mask_id)
+        input_path, filename = resolve_input(file, mask_id)
 
-        output_filename = f"resized_{uuid.uuid4()}{os.path.splitext(file.filename)[1]}"
+        output_ext = ".png" if cut_out else os.path.splitext(filename)[1]
+        output_filename = f"resized_{uuid.uuid4()}{output_ext}"
         output_path = os.path.join(UPLOAD_DIR, output_filename)
 
-        result = BackgroundRemover.resize_output(
+        result = await asyncio.to_thread(
+            BackgroundRemover.resize_output,
             input_path=input_path,
             output_path=output_path,
-            size=size
+            size=size,
+            cut_out=cut_out
         )
 
         os.remove(input_path)
@@ -416,7 +594,7 @@ async def resize_endpoint(
         return FileResponse(
             output_path,
             media_type="image/png",
-            filename=f"resized_{file.filename}"
+            filename=f"resized_{filename}"
         )
 
     except HTTPException:
@@ -434,5 +612,7 @@ async def health_check():
         "status": "healthy",
         "service": "Background Remover API",
         "model": "briaai/RMBG-1.4",
+        "inference_pools": get_pool_status(),
+        "mask_cache": BackgroundRemover.get_mask_cache_stats(),
         "timestamp": datetime.now().isoformat()
     }
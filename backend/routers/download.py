@@ -10,6 +10,11 @@ from utils.config import UPLOAD_DIR
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Directories of files that players and pages load directly: HLS/DASH
+# packages (stream_<id>/) and video previews (preview_<id>/)
+INLINE_PACKAGE_PREFIXES = ("stream_", "preview_")
+INLINE_EXTENSIONS = {'m3u8', 'mpd', 'ts', 'm4s', 'vtt', 'jpg', 'webp'}
+
 @router.get("/download/{filename:path}")
 async def download_file(filename: str):
     """Download converted file with comprehensive format support and error handling"""
@@ -98,11 +103,19 @@ async def download_file(filename: str):
             'mpg': 'video/mpeg',
             'm4v': 'video/x-m4v',
             '3gp': 'video/3gpp',
+
+            # Adaptive streaming (HLS/DASH manifests and segments)
+            'm3u8': 'application/vnd.apple.mpegurl',
+            'mpd': 'application/dash+xml',
+            'ts': 'video/mp2t',
+            'm4s': 'video/iso.segment',
+            'vtt': 'text/vtt',
             
             # Image formats
             'webp': 'image/webp',
             'avif': 'image/avif',
             'png': 'image/png',
+            'apng': 'image/apng',
             'jpg': 'image/jpeg',
             'jpeg': 'image/jpeg',
             'gif': 'image/gif',
@@ -132,6 +145,17 @@ async def download_file(filename: str):
             media_type = guessed_type or 'application/octet-stream'
         
         logger.debug(f"Using media type: {media_type} for extension: {file_extension}")
+
+        # Streaming packages, previews and waveform peaks are fetched by
+        # players, not saved: serve inline. Their files never change once
+        # written, so allow caching.
+        if ((len(path_parts) == 2 and path_parts[0].startswith(INLINE_PACKAGE_PREFIXES)
+                and file_extension in INLINE_EXTENSIONS) or filename.endswith(".peaks.json")):
+            return FileResponse(
+                path=file_path,
+                media_type=media_type,
+                headers={"Cache-Control": "public, max-age=3600"}
+            )
         
         # Generate clean filename for download
         clean_filename = filename
@@ -1,13 +1,24 @@
 # routers/image_converter.py - UPDATED VERSION with PDF and all formats support
 from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from typing import Optional
+from typing import Optional, List
 import os
+import json
+import shutil
+import uuid
+import zipfile
+import zlib
 
-from utils.config import UPLOAD_DIR
-from utils.helpers import validate_file_size, generate_unique_filename, check_rate_limit, write_file
+from utils.config import (
+    UPLOAD_DIR, MAX_IMAGE_SIZE, IMAGE_BATCH_MAX_FILES,
+    IMAGE_VARIANT_WIDTHS, IMAGE_VARIANT_FORMATS, IMAGE_VARIANT_QUALITY
+)
+from utils.helpers import (
+    validate_file_size, generate_unique_filename, check_rate_limit, write_file, save_upload, stream_zip
+)
 from utils.dependencies import cleanup_old_files, PIL_AVAILABLE, PDF2IMAGE_AVAILABLE
-from converters.image_converter import convert_image
+from converters.image_converter import convert_image, batch_convert_images, generate_image_variants, VARIANT_FORMATS
 
 router = APIRouter()
 security = HTTPBearer(auto_error=False)
@@ -17,6 +28,8 @@ SUPPORTED_FORMATS = {
     'input': [
         # Standard raster formats
         'avif', 'webp', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'ico', 'heic',
+        # Animated PNG
+        'apng',
         # Vector formats (input only - can be rasterized)
         'svg',
         # Project files (basic conversion only) 
@@ -29,15 +42,23 @@ SUPPORTED_FORMATS = {
     'output': [
         # Standard raster formats that can be created from any input
         'avif', 'webp', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff', 'ico', 'heic',
+        # Animated output (animated GIF/WebP/APNG inputs are converted frame by frame)
+        'apng',
         # Legacy formats
         'pcx',
         # Document formats - PDF can be output
         'pdf',
         # SVG output (embeds raster as base64)
         'svg'
+    ],
+    # Only for animated GIF/WebP/APNG inputs - a still image has no video to write
+    'animated_output': [
+        'mp4'
     ]
 }
 
+ANIMATED_ONLY_ERROR = "MP4 output is only available for animated GIF, WebP or APNG images"
+
 @router.post("/convert-image")
 async def convert_image_endpoint(
     file: UploadFile = File(...),
@@ -57,7 +78,7 @@ async def convert_image_endpoint(
     
     # Validate target format
     target_format = target_format.lower()
-    if target_format not in SUPPORTED_FORMATS['output']:
+    if target_format not in SUPPORTED_FORMATS['output'] + SUPPORTED_FORMATS['animated_output']:
         raise HTTPException(
             status_code=400, 
             detail=f"Unsupported target format: {target_format}. Supported formats: {', '.join(SUPPORTED_FORMATS['output'])}"
@@ -113,6 +134,9 @@ async def convert_image_endpoint(
             if os.path.exists(input_path):
                 os.remove(input_path)
             
+            if target_format in SUPPORTED_FORMATS['animated_output']:
+                raise HTTPException(status_code=400, detail=ANIMATED_ONLY_ERROR)
+
             # Provide specific error message for PDF
             if file_extension == 'pdf':
                 raise HTTPException(
@@ -140,6 +164,10 @@ async def convert_image_endpoint(
             "filename": output_filename
         }
         
+    except HTTPException:
+        if 'output_path' in locals() and os.path.exists(output_path):
+            os.remove(output_path)
+        raise
     except Exception as e:
         # Cleanup on error
         if 'input_path' in locals() and os.path.exists(input_path):
@@ -167,12 +195,320 @@ async def convert_image_endpoint(
         
         raise HTTPException(status_code=500, detail=f"Conversion error: {error_message}")
 
+def _unique_output_name(original_name: str, target_format: str, used_names: set) -> str:
+    """Build a readable output name for a batch entry, avoiding duplicates in the ZIP"""
+    base_name = os.path.basename(original_name).rsplit('.', 1)[0] or "image"
+    output_name = f"{base_name}.{target_format}"
+    counter = 1
+    while output_name in used_names:
+        output_name = f"{base_name}_{counter}.{target_format}"
+        counter += 1
+    used_names.add(output_name)
+    return output_name
+
+
+def _extract_zip_images(archive_path: str, batch_dir: str, limit: int) -> tuple[list, list]:
+    """Extract supported images from an uploaded ZIP into the batch directory"""
+    extracted = []
+    skipped = []
+
+    try:
+        archive = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="Invalid ZIP archive")
+
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            base = os.path.basename(name)
+            if info.is_dir() or not base or base.startswith('.') or name.startswith('__MACOSX'):
+                continue
+
+            extension = base.rsplit('.', 1)[-1].lower() if '.' in base else ''
+            if extension not in SUPPORTED_FORMATS['input']:
+                skipped.append({"source": name, "success": False, "error": f"Unsupported input format: {extension}"})
+                continue
+            if info.file_size > MAX_IMAGE_SIZE:
+                skipped.append({"source": name, "success": False, "error": "File too large"})
+                continue
+            if len(extracted) >= limit:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Too many files. Maximum is {IMAGE_BATCH_MAX_FILES} images per batch"
+                )
+
+            # Never trust archive paths - write under a generated name
+            input_path = os.path.join(batch_dir, generate_unique_filename(base))
+            try:
+                with archive.open(info) as src, open(input_path, 'wb') as dest:
+                    shutil.copyfileobj(src, dest)
+            except (zipfile.BadZipFile, zlib.error, EOFError, RuntimeError, NotImplementedError) as e:
+                # Corrupt, truncated, encrypted or unsupported entry
+                if os.path.exists(input_path):
+                    os.remove(input_path)
+                skipped.append({"source": name, "success": False, "error": f"Could not extract: {e}"})
+                continue
+            extracted.append((name, input_path))
+
+    return extracted, skipped
+
+
+@router.post("/convert-image-batch")
+async def convert_image_batch_endpoint(
+    files: List[UploadFile] = File(...),
+    target_format: str = Form(...),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+):
+    """
+    Convert many images (or a ZIP of images) in one request
+
+    Conversions run in parallel across a process pool and the resulting ZIP
+    is streamed back as files finish. The archive ends with manifest.json
+    listing every input with its output name or error.
+    """
+    if not PIL_AVAILABLE:
+        raise HTTPException(
+            status_code=503,
+            detail="Image conversion not available. Missing PIL/Pillow dependency"
+        )
+
+    # Rate limiting and cleanup once for the whole batch
+    client_ip = "127.0.0.1"
+    check_rate_limit(client_ip)
+    cleanup_old_files()
+
+    target_format = target_format.lower()
+    if target_format not in SUPPORTED_FORMATS['output'] + SUPPORTED_FORMATS['animated_output']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported target format: {target_format}. Supported formats: {', '.join(SUPPORTED_FORMATS['output'])}"
+        )
+
+    if not files:
+        raise HTTPException(status_code=400, detail="No files provided")
+
+    batch_id = str(uuid.uuid4())
+    batch_dir = os.path.join(UPLOAD_DIR, f"batch_{batch_id}")
+    os.makedirs(batch_dir, exist_ok=True)
+
+    jobs = []
+    manifest = []
+    used_names = set()
+
+    try:
+        inputs = []
+        for file in files:
+            if not file.filename:
+                continue
+
+            file_extension = file.filename.split('.')[-1].lower()
+            is_zip = file_extension == 'zip'
+
+            if not is_zip and file_extension not in SUPPORTED_FORMATS['input']:
+                manifest.append({
+                    "source": file.filename,
+                    "success": False,
+                    "error": f"Unsupported input format: {file_extension}"
+                })
+                continue
+
+            # Uploads go to disk chunk by chunk, never whole into memory; an
+            # archive may hold up to a full batch of maximum-size images
+            upload_path = os.path.join(batch_dir, generate_unique_filename(file.filename))
+            max_bytes = IMAGE_BATCH_MAX_FILES * MAX_IMAGE_SIZE if is_zip else MAX_IMAGE_SIZE
+            try:
+                await save_upload(file, upload_path, max_bytes=max_bytes)
+            except HTTPException as e:
+                if e.status_code != 413:
+                    raise
+                manifest.append({"source": file.filename, "success": False, "error": "File too large"})
+                continue
+
+            if is_zip:
+                try:
+                    extracted, skipped = _extract_zip_images(
+                        upload_path, batch_dir, IMAGE_BATCH_MAX_FILES - len(inputs)
+                    )
+                finally:
+                    os.remove(upload_path)
+                inputs.extend(extracted)
+                manifest.extend(skipped)
+                continue
+
+            if len(inputs) >= IMAGE_BATCH_MAX_FILES:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Too many files. Maximum is {IMAGE_BATCH_MAX_FILES} images per batch"
+                )
+            inputs.append((file.filename, upload_path))
+
+        if not inputs:
+            raise HTTPException(status_code=400, detail="No supported images found in upload")
+
+        for source_name, input_path in inputs:
+            output_name = _unique_output_name(source_name, target_format, used_names)
+            jobs.append({
+                "source": source_name,
+                "output": output_name,
+                "input_path": input_path,
+                "output_path": os.path.join(batch_dir, f"out_{uuid.uuid4().hex}_{output_name}")
+            })
+
+    except Exception:
+        shutil.rmtree(batch_dir, ignore_errors=True)
+        raise
+
+    print(f"Starting batch image conversion {batch_id}: {len(jobs)} files -> {target_format}")
+
+    async def zip_entries():
+        succeeded = 0
+        try:
+            async for result in batch_convert_images(jobs, target_format):
+                entry = {"source": result["source"], "success": result["success"]}
+                if result["success"] and os.path.exists(result["output_path"]):
+                    entry["output"] = result["output"]
+                    succeeded += 1
+                    yield result["output"], result["output_path"]
+                else:
+                    entry["error"] = result.get("error") or "Image conversion failed"
+                manifest.append(entry)
+
+            summary = {
+                "batch_id": batch_id,
+                "target_format": target_format,
+                "total": len(manifest),
+                "successful": succeeded,
+                "failed": len(manifest) - succeeded,
+                "files": manifest
+            }
+            yield "manifest.json", json.dumps(summary, indent=2).encode("utf-8")
+            print(f"Batch {batch_id} finished: {succeeded}/{len(manifest)} converted")
+        finally:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+    return StreamingResponse(
+        stream_zip(zip_entries()),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=converted_images_{batch_id}.zip"}
+    )
+
+@router.post("/image-variants")
+async def image_variants_endpoint(
+    file: UploadFile = File(...),
+    widths: str = Form(default=",".join(str(w) for w in IMAGE_VARIANT_WIDTHS)),
+    formats: str = Form(default=",".join(IMAGE_VARIANT_FORMATS)),
+    quality: int = Form(default=IMAGE_VARIANT_QUALITY),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+):
+    """
+    Generate responsive web variants (sizes x formats) from one upload
+
+    The source is decoded once and every width/format pair is encoded in
+    parallel. The response includes a download URL per variant and a
+    ready-to-use srcset string per format.
+    """
+    if not PIL_AVAILABLE:
+        raise HTTPException(
+            status_code=503,
+            detail="Image conversion not available. Missing PIL/Pillow dependency"
+        )
+
+    client_ip = "127.0.0.1"
+    check_rate_limit(client_ip)
+    cleanup_old_files()
+
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="No filename provided")
+
+    file_extension = file.filename.split('.')[-1].lower()
+    if file_extension not in SUPPORTED_FORMATS['input']:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported input format: {file_extension}. Supported formats: {', '.join(SUPPORTED_FORMATS['input'])}"
+        )
+
+    try:
+        width_list = sorted({int(w) for w in widths.split(',') if w.strip()})
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Widths must be a comma separated list of integers")
+    if not width_list or any(w < 16 or w > 10000 for w in width_list):
+        raise HTTPException(status_code=400, detail="Widths must be between 16 and 10000 pixels")
+    if len(width_list) > 10:
+        raise HTTPException(status_code=400, detail="At most 10 widths can be requested")
+
+    format_list = []
+    for variant_format in formats.lower().split(','):
+        variant_format = variant_format.strip()
+        if not variant_format:
+            continue
+        if variant_format not in VARIANT_FORMATS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unsupported variant format: {variant_format}. Supported formats: {', '.join(VARIANT_FORMATS)}"
+            )
+        if variant_format == 'jpeg':
+            variant_format = 'jpg'
+        if variant_format not in format_list:
+            format_list.append(variant_format)
+    if not format_list:
+        raise HTTPException(status_code=400, detail="No variant formats provided")
+
+    if quality < 10 or quality > 100:
+        raise HTTPException(status_code=400, detail="Quality must be between 10 and 100")
+
+    validate_file_size(file)
+
+    input_path = None
+    try:
+        input_path = os.path.join(UPLOAD_DIR, generate_unique_filename(file.filename))
+        content = await file.read()
+        await write_file(input_path, content)
+
+        base_name = file.filename.rsplit('.', 1)[0]
+        result = await generate_image_variants(
+            input_path, UPLOAD_DIR, base_name, width_list, format_list, quality
+        )
+
+        if not result.get('success'):
+            raise HTTPException(
+                status_code=500,
+                detail=f"Variant generation failed: {result.get('error') or result.get('errors')}"
+            )
+
+        # Keep the srcset manifest next to the variants for later use
+        manifest_filename = generate_unique_filename(f"{base_name}_srcset.json")
+        with open(os.path.join(UPLOAD_DIR, manifest_filename), 'w', encoding='utf-8') as f:
+            json.dump({
+                "source": file.filename,
+                "source_dimensions": result['source_dimensions'],
+                "variants": result['variants'],
+                "srcset": result['srcset']
+            }, f, indent=2)
+
+        return {
+            "message": f"Generated {len(result['variants'])} image variants",
+            "source_dimensions": result['source_dimensions'],
+            "variants": result['variants'],
+            "srcset": result['srcset'],
+            "errors": result['errors'],
+            "manifest_url": f"/download/{manifest_filename}"
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Variant generation error: {str(e)}")
+    finally:
+        if input_path and os.path.exists(input_path):
+            os.remove(input_path)
+
 @router.get("/supported-formats")
 async def get_supported_formats():
     """Get list of supported image formats"""
     return {
         "input_formats": SUPPORTED_FORMATS['input'],
         "output_formats": SUPPORTED_FORMATS['output'],
+        "animated_output_formats": SUPPORTED_FORMATS['animated_output'],
         "pdf_support": PDF2IMAGE_AVAILABLE,
         "notes": {
             "pdf_input": "PDF files are converted using the first page only",
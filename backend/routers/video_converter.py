@@ -11,6 +11,8 @@ from utils.config import UPLOAD_DIR
 from utils.helpers import generate_unique_filename, check_rate_limit, write_file
 from utils.dependencies import cleanup_old_files
 from converters.video_converter import convert_video, get_video_info, FFMPEG_AVAILABLE
+from converters.video_streaming import package_adaptive_stream, STREAMING_FORMATS
+from converters.video_preview import generate_video_preview
 
 router = APIRouter()
 security = HTTPBearer(auto_error=False)
@@ -29,7 +31,9 @@ SUPPORTED_VIDEO_FORMATS = {
         # Container formats
         'mp4', 'mov', 'avi', 'mkv', 'webm', 'wmv', 'flv', 'mpeg',
         # Codec formats - these will be converted to appropriate containers
-        'h264', 'h265', 'hevc', 'x264', 'x265'
+        'h264', 'h265', 'hevc', 'x264', 'x265',
+        # Adaptive streaming packages (bitrate ladder + manifest)
+        'hls', 'dash'
     ]
 }
 
@@ -46,6 +50,24 @@ def validate_video_file_size(file: UploadFile, max_size_mb: int = 5120):
             detail=f"File too large. Maximum size is {max_size_mb}MB"
         )
 
+async def create_preview(video_path: str) -> dict:
+    """Generate a video preview into its own directory and return its download URLs"""
+    preview_dir = os.path.join(UPLOAD_DIR, f"preview_{uuid.uuid4().hex}")
+    result = await asyncio.to_thread(generate_video_preview, video_path, preview_dir)
+    if not result["success"]:
+        return result
+
+    base_url = f"/download/{os.path.basename(preview_dir)}"
+    return {
+        "success": True,
+        "posters": [f"{base_url}/{poster}" for poster in result["posters"]],
+        "sprite_url": f"{base_url}/{result['sprite']}",
+        "thumbnails_url": f"{base_url}/{result['thumbnails']}",
+        "animation_url": f"{base_url}/{result['animation']}" if result["animation"] else None,
+        "interval": result["interval"],
+        "duration": result["duration"]
+    }
+
 def get_output_extension(target_format: str) -> str:
     """Get the correct file extension for the target format"""
     target_format = target_format.lower()
@@ -58,7 +80,9 @@ def get_output_extension(target_format: str) -> str:
     # Container formats keep their extension
     return target_format
 
-async def process_conversion(conversion_id: str, input_path: str, output_path: str, target_format: str, quality: str):
+async def process_conversion(conversion_id: str, input_path: str, output_path: str, target_format: str, quality: str,
+                             chunked: Optional[bool] = None, stream_copy: Optional[bool] = None,
+                             target_size_mb: Optional[float] = None, preview: bool = False):
     """Background conversion process"""
     try:
         print(f"Starting background conversion for ID: {conversion_id}")
@@ -71,7 +95,15 @@ async def process_conversion(conversion_id: str, input_path: str, output_path: s
         }
         
         # Run the actual conversion
-        success = await convert_video(input_path, output_path, target_format, quality)
+        def update_progress(fraction: float):
+            conversion_status[conversion_id]["progress"] = 10 + int(fraction * 85)
+
+        encoding = {}
+        success = await convert_video(
+            input_path, output_path, target_format, quality,
+            chunked=chunked, stream_copy=stream_copy, report=encoding,
+            progress=update_progress, target_size_mb=target_size_mb
+        )
         
         if success:
             # Check if the output file exists (codec formats might change extension)
@@ -85,11 +117,20 @@ async def process_conversion(conversion_id: str, input_path: str, output_path: s
                     actual_output_path = mp4_path
             
             if os.path.exists(actual_output_path) and os.path.getsize(actual_output_path) > 0:
+                preview_info = None
+                if preview:
+                    conversion_status[conversion_id]["message"] = "Generating preview..."
+                    preview_info = await create_preview(actual_output_path)
+
                 conversion_status[conversion_id] = {
                     "status": "completed",
                     "progress": 100,
                     "message": "Conversion completed",
-                    "download_url": f"/download/{os.path.basename(actual_output_path)}"
+                    "download_url": f"/download/{os.path.basename(actual_output_path)}",
+                    "encoding_path": encoding.get("path"),
+                    "streams": encoding.get("streams"),
+                    "rate_control": encoding.get("rate_control"),
+                    "preview": preview_info
                 }
                 print(f"Conversion {conversion_id} completed successfully")
             else:
@@ -104,7 +145,7 @@ async def process_conversion(conversion_id: str, input_path: str, output_path: s
                 "status": "error",
                 "progress": 0,
                 "message": "Conversion failed",
-                "error": "FFmpeg conversion failed"
+                "error": encoding.get("error", "FFmpeg conversion failed")
             }
             print(f"Conversion {conversion_id} failed")
             
@@ -125,15 +166,84 @@ async def process_conversion(conversion_id: str, input_path: str, output_path: s
         except:
             pass
 
+async def process_streaming_package(conversion_id: str, input_path: str, output_dir: str, target_format: str, quality: str):
+    """Background HLS/DASH packaging: one decode, every ladder rung"""
+    try:
+        conversion_status[conversion_id] = {
+            "status": "processing",
+            "progress": 10,
+            "message": f"Packaging {target_format.upper()} stream..."
+        }
+
+        def update_progress(fraction: float):
+            conversion_status[conversion_id]["progress"] = 10 + int(fraction * 85)
+
+        result = await package_adaptive_stream(input_path, output_dir, target_format, quality, progress=update_progress)
+
+        if result["success"]:
+            package_dir = os.path.basename(output_dir)
+            conversion_status[conversion_id] = {
+                "status": "completed",
+                "progress": 100,
+                "message": "Packaging completed",
+                "download_url": f"/download/{package_dir}/{result['manifest']}",
+                "hls_url": f"/download/{package_dir}/{result['hls_manifest']}" if result["hls_manifest"] else None,
+                "renditions": result["renditions"],
+                "segment_seconds": result["segment_seconds"]
+            }
+            print(f"Packaging {conversion_id} completed successfully")
+        else:
+            conversion_status[conversion_id] = {
+                "status": "error",
+                "progress": 0,
+                "message": "Packaging failed",
+                "error": result["error"]
+            }
+            print(f"Packaging {conversion_id} failed: {result['error']}")
+
+    except Exception as e:
+        print(f"Packaging {conversion_id} error: {str(e)}")
+        conversion_status[conversion_id] = {
+            "status": "error",
+            "progress": 0,
+            "message": "Packaging error",
+            "error": str(e)
+        }
+    finally:
+        try:
+            if os.path.exists(input_path):
+                os.remove(input_path)
+                print(f"Cleaned up input file: {input_path}")
+        except:
+            pass
+
 @router.post("/convert-video")
 async def convert_video_endpoint(
     background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     target_format: str = Form(...),
     quality: str = Form(default="medium"),
+    chunked: Optional[bool] = Form(default=None),
+    stream_copy: Optional[bool] = Form(default=None),
+    target_size_mb: Optional[float] = Form(default=None),
+    preview: bool = Form(default=False),
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ):
-    """Universal video conversion endpoint supporting all formats and codecs"""
+    """
+    Universal video conversion endpoint supporting all formats and codecs
+
+    chunked: encode keyframe-aligned segments in parallel (true), in one
+    FFmpeg process (false), or automatically for long videos (omitted)
+    stream_copy: copy streams the target already supports instead of
+    re-encoding them (e.g. H.264/AAC MP4 -> MKV is a seconds-long remux);
+    omitted, only a container change at the default quality is remuxed.
+    The completed status reports the encoding_path taken
+    quality: high/medium/low/web presets, or "auto" to pick CRF and preset
+    from sample encodes of the video
+    target_size_mb: two-pass encode to about this size (MB)
+    preview: also generate posters, a thumbnail sprite and an animated
+    preview of the output (see /convert/video-preview)
+    """
     
     print(f"Received conversion request: {file.filename} -> {target_format}")
     
@@ -159,9 +269,12 @@ async def convert_video_endpoint(
             status_code=400, 
             detail=f"Unsupported output format: {target_format}. Supported formats: {', '.join(SUPPORTED_VIDEO_FORMATS['output'])}"
         )
+
+    if target_size_mb is not None and target_size_mb <= 0:
+        raise HTTPException(status_code=400, detail="target_size_mb must be positive")
     
     # Validate quality option
-    valid_quality = ["high", "medium", "low", "web"]
+    valid_quality = ["high", "medium", "low", "web", "auto"]
     if quality not in valid_quality:
         raise HTTPException(
             status_code=400,
@@ -184,6 +297,31 @@ async def convert_video_endpoint(
         
         print(f"Saved input file: {input_filename} ({len(content)} bytes)")
         
+        if target_format.lower() in STREAMING_FORMATS:
+            # Manifest and segments go into their own directory
+            output_dir = os.path.join(UPLOAD_DIR, f"stream_{uuid.uuid4().hex}")
+            conversion_status[conversion_id] = {
+                "status": "starting",
+                "progress": 0,
+                "message": "Initializing packaging..."
+            }
+            background_tasks.add_task(
+                process_streaming_package,
+                conversion_id,
+                input_path,
+                output_dir,
+                target_format.lower(),
+                quality
+            )
+            return {
+                "message": f"{target_format.upper()} packaging started",
+                "conversion_id": conversion_id,
+                "status": "started",
+                "target_format": target_format,
+                "quality": quality,
+                "progress_url": f"/convert/video-progress/{conversion_id}"
+            }
+
         # Generate output filename with correct extension
         base_name = file.filename.rsplit('.', 1)[0]
         output_extension = get_output_extension(target_format)
@@ -206,7 +344,11 @@ async def convert_video_endpoint(
             input_path,
             output_path,
             target_format,
-            quality
+            quality,
+            chunked,
+            stream_copy,
+            target_size_mb,
+            preview
         )
         
         print(f"Started background conversion: {conversion_id}")
@@ -241,6 +383,48 @@ async def convert_video_endpoint(
         
         raise HTTPException(status_code=500, detail=f"Conversion setup failed: {error_message}")
 
+@router.post("/video-preview")
+async def video_preview_endpoint(
+    file: Optional[UploadFile] = File(None),
+    filename: Optional[str] = Form(None),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
+):
+    """
+    Poster frames, a thumbnail sprite with a WebVTT track and an animated preview
+
+    Send a video file, or the filename of an earlier conversion output (the
+    last part of its download_url) to skip uploading it again. Only
+    keyframes are decoded, so this takes a fraction of a conversion's time.
+    """
+    if not FFMPEG_AVAILABLE:
+        raise HTTPException(status_code=503, detail="FFmpeg not available")
+
+    if filename:
+        if os.path.basename(filename) != filename or filename.startswith('.'):
+            raise HTTPException(status_code=400, detail="Invalid filename")
+        video_path = os.path.join(UPLOAD_DIR, filename)
+        if not os.path.isfile(video_path):
+            raise HTTPException(status_code=404, detail="File not found or has expired")
+        uploaded_path = None
+    elif file and file.filename:
+        file_extension = file.filename.split('.')[-1].lower()
+        if file_extension not in SUPPORTED_VIDEO_FORMATS['input']:
+            raise HTTPException(status_code=400, detail=f"Unsupported input format: {file_extension}")
+        uploaded_path = video_path = os.path.join(UPLOAD_DIR, generate_unique_filename(file.filename))
+        await write_file(video_path, await file.read())
+    else:
+        raise HTTPException(status_code=400, detail="Provide a video file or a filename")
+
+    try:
+        result = await create_preview(video_path)
+    finally:
+        if uploaded_path and os.path.exists(uploaded_path):
+            os.remove(uploaded_path)
+
+    if not result["success"]:
+        raise HTTPException(status_code=422, detail=result["error"])
+    return result
+
 @router.get("/video-progress/{conversion_id}")
 async def get_conversion_progress(conversion_id: str):
     """Get conversion progress and status"""
@@ -256,7 +440,7 @@ async def get_supported_formats():
     return {
         "input_formats": SUPPORTED_VIDEO_FORMATS['input'],
         "output_formats": SUPPORTED_VIDEO_FORMATS['output'],
-        "quality_options": ["high", "medium", "low", "web"],
+        "quality_options": ["high", "medium", "low", "web", "auto"],
         "codec_formats": {
             "h264": "H.264 codec (outputs as MP4)",
             "x264": "x264 encoder (outputs as MP4)", 
@@ -273,6 +457,10 @@ async def get_supported_formats():
             "wmv": "Windows Media Video",
             "flv": "Flash Video"
         },
+        "streaming_formats": {
+            "hls": "HLS bitrate ladder (master.m3u8 + MPEG-TS segments)",
+            "dash": "DASH bitrate ladder (manifest.mpd + fMP4 segments, also playable via HLS)"
+        },
         "notes": {
             "ffmpeg_available": FFMPEG_AVAILABLE,
             "max_file_size": "5GB",
@@ -281,8 +469,10 @@ async def get_supported_formats():
                 "high": "Best quality, larger file size",
                 "medium": "Balanced quality and size", 
                 "low": "Smaller file, lower quality",
-                "web": "Optimized for web streaming"
-            }
+                "web": "Optimized for web streaming",
+                "auto": "CRF and preset picked from sample encodes of your video"
+            },
+            "target_size_mb": "Optional: two-pass encode to about this file size (overrides quality)"
         }
     }
 
@@ -10,9 +10,13 @@ from pathlib import Path
 from typing import Optional, List
 from datetime import datetime
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field
 from converters.voice_dubbing_converter import VoiceDubbingConverter
+from converters.media_analysis import analyze_media_async
+from converters.speech_cache import get_speech_cache_stats
+from converters.audio_converter import STREAM_MEDIA_TYPES
+from utils.config import LOUDNESS_TARGETS
 
 router = APIRouter()
 converter = VoiceDubbingConverter()
@@ -37,6 +41,7 @@ class VoiceGenerationRequest(BaseModel):
     output_format: str = Field(default='mp3', description="Output audio format")
     apply_noise_reduction: bool = Field(default=False, description="Apply noise reduction")
     quality: str = Field(default='high', description="Audio quality (low, medium, high, ultra)")
+    loudness: str = Field(default='podcast', description="Loudness target (podcast, streaming, broadcast) or 'peak'")
 
 
 class VoiceCloneRequest(BaseModel):
@@ -48,6 +53,7 @@ class VoiceCloneRequest(BaseModel):
     output_format: str = Field(default='mp3', description="Output audio format")
     apply_noise_reduction: bool = Field(default=False, description="Apply noise reduction")
     quality: str = Field(default='high', description="Audio quality")
+    loudness: str = Field(default='podcast', description="Loudness target (podcast, streaming, broadcast) or 'peak'")
     use_sample_id: Optional[str] = Field(default=None, description="ID of pre-uploaded voice sample")
 
 
@@ -60,6 +66,7 @@ class BatchGenerationRequest(BaseModel):
     output_format: str = Field(default='mp3', description="Output audio format")
     apply_noise_reduction: bool = Field(default=False, description="Apply noise reduction")
     quality: str = Field(default='high', description="Audio quality")
+    loudness: str = Field(default='podcast', description="Loudness target (podcast, streaming, broadcast) or 'peak'")
 
 
 class AudioHistoryItem(BaseModel):
@@ -73,6 +80,19 @@ class AudioHistoryItem(BaseModel):
     duration: Optional[float] = None
 
 
+def resolve_loudness(loudness: str) -> Optional[str]:
+    """Map the loudness option to a LOUDNESS_TARGETS key ('peak' -> None, peak normalization)"""
+    loudness = (loudness or 'peak').lower()
+    if loudness == 'peak':
+        return None
+    if loudness not in LOUDNESS_TARGETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid loudness target: {loudness}. Valid options: {', '.join(LOUDNESS_TARGETS)}, peak"
+        )
+    return loudness
+
+
 def save_to_history(
     filename: str,
     text: str,
@@ -124,13 +144,22 @@ async def generate_gtts_voice(
     volume: float = Form(1.0),
     output_format: str = Form('mp3'),
     apply_noise_reduction: bool = Form(False),
-    quality: str = Form('high')
+    quality: str = Form('high'),
+    loudness: str = Form('podcast'),
+    stream: bool = Form(False)
 ):
     """
     Generate voice using gTTS (Default Voice Mode)
 
-    Supports multiple languages with configurable speed, pitch, and volume
+    Supports multiple languages with configurable speed, pitch, and volume.
+    Output is normalized to the loudness target (EBU R128, default podcast
+    -16 LUFS) or, with loudness='peak', to full-scale peak
+
+    stream: return the audio (mp3, ogg or m4a) as the response body,
+    starting once the first sentence is synthesized, instead of saving it
     """
+    loudness = resolve_loudness(loudness)
+
     try:
         # Validate input
         if not text or len(text.strip()) == 0:
@@ -139,6 +168,29 @@ async def generate_gtts_voice(
         if len(text) > 5000:
             raise HTTPException(status_code=400, detail="Text too long (max 5000 characters)")
 
+        if stream:
+            # Arguments are validated before the first byte is sent, so
+            # report them as a client error rather than a failed stream
+            try:
+                audio_chunks = converter.stream_gtts_voice(
+                    text=text,
+                    language=language,
+                    speed=speed,
+                    pitch=pitch,
+                    volume=volume,
+                    output_format=output_format,
+                    apply_noise_reduction=apply_noise_reduction,
+                    quality=quality,
+                    loudness=loudness
+                )
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            return StreamingResponse(
+                audio_chunks,
+                media_type=STREAM_MEDIA_TYPES[output_format],
+                headers={"Content-Disposition": f'attachment; filename="voice.{output_format}"'}
+            )
+
         # Generate voice
         output_path, filename = converter.generate_gtts_voice(
             text=text,
@@ -148,7 +200,8 @@ async def generate_gtts_voice(
             volume=volume,
             output_format=output_format,
             apply_noise_reduction=apply_noise_reduction,
-            quality=quality
+            quality=quality,
+            loudness=loudness
         )
 
         # Save to history
@@ -162,6 +215,8 @@ async def generate_gtts_voice(
             "history_item": history_item.dict()
         })
 
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -179,13 +234,16 @@ async def generate_voice_clone(
     volume: float = Form(1.0),
     output_format: str = Form('mp3'),
     apply_noise_reduction: bool = Form(False),
-    quality: str = Form('high')
+    quality: str = Form('high'),
+    loudness: str = Form('podcast')
 ):
     """
     Generate voice using Coqui TTS with voice cloning
 
     Either upload a speaker audio file or use a pre-saved voice sample
     """
+    loudness = resolve_loudness(loudness)
+
     try:
         # Validate input
         if not text or len(text.strip()) == 0:
@@ -227,7 +285,8 @@ async def generate_voice_clone(
             volume=volume,
             output_format=output_format,
             apply_noise_reduction=apply_noise_reduction,
-            quality=quality
+            quality=quality,
+            loudness=loudness
         )
 
         # Clean up temporary file if it was uploaded
@@ -245,6 +304,8 @@ async def generate_voice_clone(
             "history_item": history_item.dict()
         })
 
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -276,17 +337,27 @@ async def upload_voice_sample(
         with open(sample_path, "wb") as buffer:
             shutil.copyfileobj(audio.file, buffer)
 
-        # Get file info
+        # Get file info (probe is cached and reused when the sample is used)
         file_size = os.path.getsize(sample_path)
+        media_info = await analyze_media_async(str(sample_path))
+        if media_info is not None and media_info.get("audio") is None:
+            sample_path.unlink()
+            raise HTTPException(status_code=400, detail="The uploaded file contains no audio")
+        audio_info = (media_info or {}).get("audio") or {}
 
         return JSONResponse({
             "success": True,
             "message": "Voice sample uploaded successfully",
             "sample_id": sample_id,
             "sample_name": sample_name,
-            "file_size": file_size
+            "file_size": file_size,
+            "duration": (media_info or {}).get("duration"),
+            "sample_rate": audio_info.get("sample_rate"),
+            "channels": audio_info.get("channels")
         })
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error uploading voice sample: {str(e)}")
 
@@ -345,6 +416,8 @@ async def batch_generate_voices(request: BatchGenerationRequest):
     """
     Generate multiple voices from a list of texts (batch processing)
     """
+    loudness = resolve_loudness(request.loudness)
+
     try:
         results = []
         errors = []
@@ -359,7 +432,8 @@ async def batch_generate_voices(request: BatchGenerationRequest):
                     volume=request.volume,
                     output_format=request.output_format,
                     apply_noise_reduction=request.apply_noise_reduction,
-                    quality=request.quality
+                    quality=request.quality,
+                    loudness=loudness
                 )
 
                 history_item = save_to_history(filename, text, 'gtts', request.language, output_path)
@@ -507,6 +581,7 @@ async def get_status():
             "audio_history": True
         },
         "dependencies": dependencies,
+        "segment_cache": get_speech_cache_stats(),
         "supported_languages": len(converter.get_supported_languages()),
         "supported_formats": converter.get_supported_formats()
     })
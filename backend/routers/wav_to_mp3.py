@@ -1,14 +1,17 @@
 # routers/wav_to_mp3.py - WAV to MP3 conversion endpoint
-from fastapi import APIRouter, File, UploadFile, HTTPException, Depends
+from fastapi import APIRouter, File, UploadFile, HTTPException, Depends, Form
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
 import os
 import traceback
 
-from utils.config import UPLOAD_DIR
-from utils.helpers import validate_file_size, generate_unique_filename, check_rate_limit, write_file
-from utils.dependencies import cleanup_old_files, PYDUB_AVAILABLE
-from converters.wav_to_mp3_converter import wav_to_mp3_converter
+from utils.config import UPLOAD_DIR, MAX_AUDIO_SIZE
+from utils.helpers import validate_file_size, generate_unique_filename, check_rate_limit, save_upload
+from utils.dependencies import cleanup_old_files
+from converters.audio_converter import FFMPEG_AVAILABLE, AUDIO_BITRATES
+from converters.wav_to_mp3_converter import wav_to_mp3_converter, stream_wav_to_mp3
+from converters.waveform import peaks_path_for
 
 router = APIRouter()
 security = HTTPBearer(auto_error=False)
@@ -16,20 +19,38 @@ security = HTTPBearer(auto_error=False)
 @router.post("/wav-to-mp3")
 async def convert_wav_to_mp3(
     file: UploadFile = File(...),
+    bitrate: Optional[str] = Form(None),
+    vbr_quality: Optional[int] = Form(None),
+    stream: bool = Form(False),
     credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)
 ):
+    """
+    Convert WAV to MP3 with FFmpeg
+
+    bitrate: constant bitrate in kbps (96/128/192/256/320); otherwise VBR
+    with vbr_quality 0 (best) - 9 (smallest), default 2
+    stream: send the MP3 back while it is being encoded (chunked transfer)
+    instead of returning a download URL
+    """
     print(f"📥 Received WAV conversion request for file: {file.filename}")
     print(f"📊 File size: {file.size if hasattr(file, 'size') else 'Unknown'} bytes")
     
-    # Check pydub availability
-    if not PYDUB_AVAILABLE:
-        print("❌ pydub dependency not available")
+    # Check FFmpeg availability
+    if not FFMPEG_AVAILABLE:
+        print("❌ FFmpeg not available")
         raise HTTPException(
             status_code=503, 
-            detail="WAV to MP3 conversion not available. Missing dependency: pydub"
+            detail="WAV to MP3 conversion not available. FFmpeg is not installed"
         )
     
-    print("✅ pydub dependency available")
+    if bitrate is not None and bitrate not in AUDIO_BITRATES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid bitrate setting: {bitrate}. Valid options: {', '.join(AUDIO_BITRATES)}"
+        )
+    if vbr_quality is not None and not 0 <= vbr_quality <= 9:
+        raise HTTPException(status_code=400, detail="vbr_quality must be between 0 and 9")
+    mp3_bitrate = AUDIO_BITRATES[bitrate] if bitrate else None
     
     # Rate limiting and cleanup
     try:
@@ -69,14 +90,9 @@ async def convert_wav_to_mp3(
         print(f"📁 Input path: {input_path}")
         print(f"📁 Output path: {output_path}")
         
-        # Read and save uploaded file
-        print("📥 Reading uploaded file...")
-        content = await file.read()
-        print(f"✅ File read successfully, size: {len(content)} bytes")
-        
-        # Save to disk
+        # Save to disk chunk by chunk (the upload is never fully in memory)
         print("💾 Saving file to disk...")
-        await write_file(input_path, content)
+        await save_upload(file, input_path, max_bytes=MAX_AUDIO_SIZE)
         
         # Verify file was saved
         if not os.path.exists(input_path):
@@ -85,9 +101,27 @@ async def convert_wav_to_mp3(
         file_size = os.path.getsize(input_path)
         print(f"✅ File saved successfully, size on disk: {file_size} bytes")
         
+        if stream:
+            print("🔄 Streaming WAV to MP3 conversion...")
+            async def mp3_chunks():
+                try:
+                    async for chunk in stream_wav_to_mp3(input_path, mp3_bitrate, vbr_quality):
+                        yield chunk
+                finally:
+                    if os.path.exists(input_path):
+                        os.remove(input_path)
+                        print("🗑️ Input file cleaned up")
+            
+            return StreamingResponse(
+                mp3_chunks(),
+                media_type="audio/mpeg",
+                headers={"Content-Disposition": 'attachment; filename="converted_audio.mp3"'}
+            )
+        
         # Convert WAV to MP3
         print("🔄 Starting WAV to MP3 conversion...")
-        success = await wav_to_mp3_converter(input_path, output_path)
+        waveform_path = peaks_path_for(output_path)
+        success = await wav_to_mp3_converter(input_path, output_path, mp3_bitrate, vbr_quality, waveform_path)
         
         if not success:
             print("❌ Conversion function returned False")
@@ -113,7 +147,8 @@ async def convert_wav_to_mp3(
         response = {
             "message": "WAV converted to MP3 successfully",
             "download_url": f"/download/{output_filename}",
-            "filename": output_filename
+            "filename": output_filename,
+            "waveform_url": f"/download/{os.path.basename(waveform_path)}" if os.path.exists(waveform_path) else None
         }
         print(f"✅ Returning success response: {response}")
         return response
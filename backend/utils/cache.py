@@ -0,0 +1,146 @@
+# utils/cache.py - Size-bounded LRU caches in memory and on disk
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU cache bounded by the total size of its values"""
+
+    def __init__(self, max_bytes: int, sizeof: Callable[[Any], int] = len):
+        self.max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: str, value: Any) -> None:
+        size = self._sizeof(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+class DiskCache:
+    """
+    Directory of cached files bounded by total size
+
+    Entries are plain files named after their key, so callers can hand the
+    path to anything that reads files. Reads refresh the modification time
+    and eviction removes the least recently used files first.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def path(self, key: str, suffix: str = "") -> str:
+        """Path an entry is stored at (whether or not it exists)"""
+        safe_key = "".join(c if c.isalnum() or c in "-_." else "_" for c in key)
+        return os.path.join(self.directory, f"{safe_key}{suffix}")
+
+    def get_path(self, key: str, suffix: str = "") -> Optional[str]:
+        """Return the entry's path and mark it recently used, or None"""
+        path = self.path(key, suffix)
+        try:
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def put_bytes(self, key: str, data: bytes, suffix: str = "") -> str:
+        path = self.path(key, suffix)
+        # Write under a temporary name so readers never see a partial file
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self._commit(temp_path, path)
+
+    def put_file(self, key: str, source_path: str, suffix: str = "") -> str:
+        path = self.path(key, suffix)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(source_path, "rb") as src, open(temp_path, "wb") as dst:
+            while chunk := src.read(1024 * 1024):
+                dst.write(chunk)
+        return self._commit(temp_path, path)
+
+    def _commit(self, temp_path: str, path: str) -> str:
+        size = os.path.getsize(temp_path)
+        with self._lock:
+            try:
+                self._bytes -= os.path.getsize(path)
+            except OSError:
+                pass
+            os.replace(temp_path, path)
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self) -> None:
+        """Remove least recently used files until the cache fits (lock held)"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+
+        self._bytes = sum(size for _, size, _ in entries)
+        # Keep some headroom so the next few writes don't rescan the directory
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self._bytes <= target:
+                break
+            try:
+                os.remove(path)
+                self._bytes -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            "directory": self.directory,
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes
+        }
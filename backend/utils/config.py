@@ -3,6 +3,9 @@ import os
 
 # Configuration - UPDATED for video support
 UPLOAD_DIR = "uploads"
+# Runtime caches live next to the upload directory, never inside it, so
+# /download cannot serve them
+CACHE_DIR = "cache"
 MAX_FILE_SIZE = 5 * 1024 * 1024 * 1024  # FIXED: 5GB for videos (was 50MB)
 MAX_IMAGE_SIZE = 100 * 1024 * 1024  # 100MB for images
 MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # 50MB for documents
@@ -33,6 +36,46 @@ CONVERSION_TIMEOUTS = {
     'audio': 300    # 5 minutes for audio
 }
 
+# Image resizing - reduced-resolution decoding keeps the decoded image at
+# least this many times larger than the resize target
+IMAGE_REDUCING_GAP = 3.0
+
+# Batch image conversion
+IMAGE_BATCH_MAX_FILES = 500
+IMAGE_BATCH_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+
+# Responsive image variants (widths x formats generated from one decode)
+IMAGE_VARIANT_WIDTHS = [320, 640, 1280]
+IMAGE_VARIANT_FORMATS = ['webp', 'avif', 'jpg']
+IMAGE_VARIANT_QUALITY = 80
+
+# Large raster images - above LARGE_IMAGE_PIXELS, TIFF/PNG/JPEG inputs are
+# processed in bands of LARGE_IMAGE_BAND_ROWS rows instead of one full decode
+LARGE_IMAGE_PIXELS = 50_000_000
+MAX_LARGE_IMAGE_PIXELS = 2_000_000_000
+LARGE_IMAGE_BAND_ROWS = 256
+
+# Animated GIF/WebP/APNG conversion
+ANIMATION_PALETTE_SAMPLES = 16  # frames sampled to build the shared GIF palette
+ANIMATION_DEFAULT_FRAME_MS = 100  # used when a frame has no (or zero) duration
+ANIMATION_MP4_FPS = 30
+
+# Background removal inference (rembg / ONNX Runtime). Each model gets a pool
+# of BG_REMOVAL_SESSIONS sessions; concurrent requests are grouped into
+# batches of up to BG_REMOVAL_MAX_BATCH images per model run
+BG_REMOVAL_SESSIONS = max(1, (os.cpu_count() or 2) // 4)
+BG_REMOVAL_INTRA_OP_THREADS = max(1, (os.cpu_count() or 2) // BG_REMOVAL_SESSIONS)
+BG_REMOVAL_INTER_OP_THREADS = 1
+BG_REMOVAL_MAX_BATCH = 4
+BG_REMOVAL_BATCH_WAIT_MS = 10
+BG_REMOVAL_WARMUP_MODELS = ['isnet-general-use']
+
+# Segmentation masks cached by image content hash, so trying several
+# backgrounds on one photo runs the model once
+BG_MASK_CACHE_DIR = os.path.join(CACHE_DIR, "masks")
+BG_MASK_MEMORY_BYTES = 256 * 1024 * 1024
+BG_MASK_DISK_BYTES = 2 * 1024 * 1024 * 1024
+
 # Ensure upload directory exists
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
@@ -40,10 +83,91 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 FFMPEG_PATH = None  # Will be detected automatically
 FFMPEG_THREADS = 0  # Use all available cores
 
+# ffprobe results cached by content fingerprint (converters/media_analysis.py)
+MEDIA_ANALYSIS_CACHE_DIR = os.path.join(CACHE_DIR, "media_analysis")
+MEDIA_ANALYSIS_MEMORY_ENTRIES = 1024
+MEDIA_ANALYSIS_DISK_BYTES = 64 * 1024 * 1024
+
+# Segmented (chunked) video encoding - videos at least VIDEO_CHUNK_MIN_DURATION
+# seconds long are split at keyframes and the segments encoded by
+# VIDEO_CHUNK_WORKERS parallel FFmpeg processes
+VIDEO_CHUNK_MIN_DURATION = 300
+VIDEO_CHUNK_WORKERS = max(1, (os.cpu_count() or 2) // 4)
+VIDEO_CHUNK_MIN_SEGMENT_SECONDS = 30
+VIDEO_CHUNK_TIMEOUT = 1800  # per FFmpeg process
+VIDEO_CHUNK_CLAIM_TIMEOUT = 3600  # re-queue segments claimed by a worker host that went quiet
+
+# HLS/DASH bitrate ladder (converters/video_streaming.py), tallest rung first.
+# Rungs taller than the source are skipped.
+VIDEO_STREAMING_LADDER = [
+    {'height': 1080, 'video_bitrate': '5000k', 'audio_bitrate': '128k'},
+    {'height': 720, 'video_bitrate': '2800k', 'audio_bitrate': '128k'},
+    {'height': 480, 'video_bitrate': '1400k', 'audio_bitrate': '96k'},
+    {'height': 360, 'video_bitrate': '800k', 'audio_bitrate': '96k'},
+]
+VIDEO_STREAMING_SEGMENT_SECONDS = 6
+
+# Video previews (converters/video_preview.py), decoded from keyframes only
+VIDEO_PREVIEW_POSTERS = 4
+VIDEO_PREVIEW_POSTER_WIDTH = 1280
+VIDEO_PREVIEW_THUMB_WIDTH = 160
+VIDEO_PREVIEW_SPRITE_COLUMNS = 10
+VIDEO_PREVIEW_MAX_THUMBS = 100  # one sprite sheet
+VIDEO_PREVIEW_MIN_INTERVAL = 2  # seconds between sprite thumbnails
+VIDEO_PREVIEW_ANIMATION_FRAMES = 24
+VIDEO_PREVIEW_ANIMATION_FPS = 6
+VIDEO_PREVIEW_ANIMATION_WIDTH = 320
+
 # Quality presets for video conversion
 VIDEO_QUALITY_PRESETS = {
     'high': {'crf': 18, 'preset': 'medium'},
     'medium': {'crf': 23, 'preset': 'fast'},
     'low': {'crf': 28, 'preset': 'veryfast'},
     'web': {'crf': 25, 'preset': 'fast'}
-}
\ No newline at end of file
+}
+
+# Automatic quality (quality="auto", converters/video_rate_control.py): a few
+# short samples are encoded at candidate CRFs and the highest CRF whose SSIM
+# against the source reaches the target is used
+VIDEO_AUTO_SSIM_TARGET = 0.975
+VIDEO_AUTO_SAMPLE_COUNT = 3
+VIDEO_AUTO_SAMPLE_SECONDS = 2
+VIDEO_AUTO_CRF_RANGES = {
+    'libx264': (18, 32),
+    'libx265': (20, 34),
+    'libvpx-vp9': (24, 44)
+}
+# Target-size (two-pass) mode: downscale rather than spend fewer bits per pixel than this
+VIDEO_MIN_BITS_PER_PIXEL = 0.04
+# EBU R128 loudness normalization (converters/loudness.py). Targets are
+# integrated loudness (LUFS), true peak (dBTP) and loudness range (LU)
+LOUDNESS_TARGETS = {
+    'podcast': {'I': -16.0, 'TP': -1.5, 'LRA': 11.0},
+    'streaming': {'I': -14.0, 'TP': -1.0, 'LRA': 11.0},
+    'broadcast': {'I': -23.0, 'TP': -1.0, 'LRA': 15.0},
+}
+# First-pass measurements cached by content hash, so only the second pass reruns
+LOUDNESS_CACHE_DIR = os.path.join(CACHE_DIR, "loudness")
+LOUDNESS_MEMORY_ENTRIES = 1024
+LOUDNESS_DISK_BYTES = 16 * 1024 * 1024
+
+# Waveform peaks written next to audio outputs (converters/waveform.py):
+# min/max per bucket of WAVEFORM_SAMPLES_PER_PIXEL samples, one level per
+# zoom step. Levels with more than WAVEFORM_MAX_BUCKETS buckets are left out
+WAVEFORM_SAMPLE_RATE = 44100
+WAVEFORM_SAMPLES_PER_PIXEL = [256, 1024, 4096, 16384]
+WAVEFORM_MAX_BUCKETS = 65536
+
+# Synthesized speech segments (converters/speech_cache.py), cached before
+# effects by (normalized text, language, engine, voice)
+VOICE_SEGMENT_CACHE_DIR = os.path.join(CACHE_DIR, "speech")
+VOICE_SEGMENT_MEMORY_BYTES = 64 * 1024 * 1024
+VOICE_SEGMENT_DISK_BYTES = 1024 * 1024 * 1024
+# Long texts are split at sentence boundaries and the sentences synthesized
+# by up to VOICE_SYNTHESIS_WORKERS concurrent TTS calls, then joined with a
+# short crossfade. Sentences shorter than VOICE_SENTENCE_MIN_CHARS are
+# merged into the next one
+VOICE_SYNTHESIS_WORKERS = 4
+VOICE_SENTENCE_MIN_CHARS = 20
+VOICE_SENTENCE_MAX_CHARS = 300
+VOICE_CROSSFADE_MS = 20
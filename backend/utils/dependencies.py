@@ -1,6 +1,7 @@
 # utils/dependencies.py - CORRECTED with FFmpeg detection
 import importlib.util
 import os
+import shutil
 import time
 import subprocess
 import logging
@@ -349,6 +350,12 @@ def cleanup_old_files():
                         os.remove(filepath)
                         cleanup_count += 1
                         print(f"Cleaned up old file: {filename}")
+                elif filename.startswith(("stream_", "preview_")) and os.path.isdir(filepath):
+                    # HLS/DASH packages and video previews live in their own directory
+                    if current_time - os.path.getctime(filepath) > 3600:
+                        shutil.rmtree(filepath, ignore_errors=True)
+                        cleanup_count += 1
+                        print(f"Cleaned up old package directory: {filename}")
             except Exception as e:
                 print(f"Failed to cleanup file {filename}: {e}")
         
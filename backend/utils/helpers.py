@@ -3,7 +3,8 @@ import uuid
 import os
 import time
 import logging
-from typing import Optional
+import zipfile
+from typing import Optional, AsyncIterator, Tuple, Union
 from fastapi import UploadFile, HTTPException
 from .config import (
     MAX_FILE_SIZE, MAX_IMAGE_SIZE, MAX_DOCUMENT_SIZE, MAX_AUDIO_SIZE,
@@ -136,6 +137,41 @@ async def write_file(file_path: str, content: bytes):
         logger.error(f"Failed to write file {file_path}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
 
+async def save_upload(file: UploadFile, file_path: str, max_bytes: Optional[int] = None,
+                      chunk_size: int = 1024 * 1024) -> int:
+    """
+    Copy an upload to disk chunk by chunk and return its size
+
+    Unlike write_file(path, await file.read()) only one chunk is in memory
+    at a time. Uploads larger than max_bytes are rejected with 413 (the
+    size isn't always known before reading).
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    written = 0
+    try:
+        with open(file_path, 'wb') as f:
+            while True:
+                chunk = await file.read(chunk_size)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if max_bytes and written > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large. Maximum size is {max_bytes // (1024 * 1024)}MB"
+                    )
+                f.write(chunk)
+    except HTTPException:
+        cleanup_file(file_path)
+        raise
+    except Exception as e:
+        cleanup_file(file_path)
+        logger.error(f"Failed to save upload {file_path}: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to save file: {str(e)}")
+
+    logger.info(f"Upload saved: {file_path} ({written} bytes)")
+    return written
+
 def cleanup_file(file_path: str):
     """Safely cleanup a file"""
     try:
@@ -181,4 +217,67 @@ def is_image_file(filename: str) -> bool:
         'tiff', 'ico', 'heic', 'svg'
     ]
     
-    extension = filename.split('.')[-1].lower()
\ No newline at end of file
+    extension = filename.split('.')[-1].lower()
+
+class ZipStreamBuffer:
+    """Write-only, non-seekable sink for zipfile that hands out bytes as they are written"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+async def stream_zip(
+    entries: AsyncIterator[Tuple[str, Union[str, bytes]]],
+    chunk_size: int = 1024 * 1024
+) -> AsyncIterator[bytes]:
+    """
+    Build a ZIP archive incrementally and yield it in chunks
+
+    entries yields (arcname, source) pairs where source is a file path or
+    raw bytes. Only one chunk of one file is held in memory at a time, so
+    the response can start before the last entry is ready. entries is
+    closed when the archive ends, including when the consumer stops early.
+    """
+    buffer = ZipStreamBuffer()
+    try:
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+            async for arcname, source in entries:
+                if isinstance(source, bytes):
+                    zip_file.writestr(arcname, source)
+                else:
+                    with open(source, 'rb') as src, zip_file.open(arcname, 'w', force_zip64=True) as dest:
+                        while True:
+                            chunk = src.read(chunk_size)
+                            if not chunk:
+                                break
+                            dest.write(chunk)
+                            data = buffer.drain()
+                            if data:
+                                yield data
+
+                data = buffer.drain()
+                if data:
+                    yield data
+    finally:
+        # Stop the entry producer (and its cleanup) even if the client
+        # disconnected before the archive was finished
+        aclose = getattr(entries, "aclose", None)
+        if aclose is not None:
+            await aclose()
+
+    # Central directory
+    data = buffer.drain()
+    if data:
+        yield data
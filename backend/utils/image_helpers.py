@@ -0,0 +1,126 @@
+# utils/image_helpers.py - Shared Pillow helpers for resize and thumbnail paths
+from typing import Optional, Tuple, TYPE_CHECKING
+
+from .config import IMAGE_REDUCING_GAP
+
+if TYPE_CHECKING:
+    from PIL import Image as PILImage
+
+# EXIF orientation tag and the values that swap width/height
+EXIF_ORIENTATION_TAG = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def fit_dimensions(
+    original_size: Tuple[int, int],
+    width: Optional[int] = None,
+    height: Optional[int] = None,
+    maintain_aspect_ratio: bool = True
+) -> Tuple[int, int]:
+    """Calculate target dimensions for a resize request"""
+    original_width, original_height = original_size
+
+    if maintain_aspect_ratio:
+        if width and height:
+            # Use the smaller ratio to fit within bounds
+            ratio = min(width / original_width, height / original_height)
+            new_width = int(original_width * ratio)
+            new_height = int(original_height * ratio)
+        elif width:
+            new_width = width
+            new_height = int(original_height * (width / original_width))
+        elif height:
+            new_width = int(original_width * (height / original_height))
+            new_height = height
+        else:
+            return original_size
+    else:
+        # Use exact dimensions (may distort image)
+        new_width = width or original_width
+        new_height = height or original_height
+
+    # Ensure minimum size
+    return max(1, new_width), max(1, new_height)
+
+
+def is_exif_transposed(img: 'PILImage.Image') -> bool:
+    """Check whether EXIF orientation will swap width and height"""
+    try:
+        return img.getexif().get(EXIF_ORIENTATION_TAG) in TRANSPOSED_ORIENTATIONS
+    except Exception:
+        return False
+
+
+def draft_for_size(
+    img: 'PILImage.Image',
+    target_size: Tuple[int, int],
+    reducing_gap: float = IMAGE_REDUCING_GAP,
+    respect_exif: bool = True
+) -> bool:
+    """
+    Configure reduced-resolution (DCT domain) decoding for an unloaded image
+
+    JPEG decoders can scale by 1/2, 1/4 or 1/8 while decoding, which skips
+    most of the IDCT work and memory for images that are about to be
+    downscaled anyway. The decoded image is kept at least ``reducing_gap``
+    times larger than the target so the final LANCZOS pass keeps its quality.
+
+    Must be called right after ``Image.open`` and before the pixel data is
+    accessed. Returns True if the image will be decoded at reduced size.
+    """
+    if getattr(img, 'format', None) != 'JPEG' or not target_size:
+        return False
+
+    target_width, target_height = target_size
+    # target_size is expressed in display orientation; the decoder works on
+    # the stored orientation
+    if respect_exif and is_exif_transposed(img):
+        target_width, target_height = target_height, target_width
+
+    requested = (
+        max(1, int(target_width * reducing_gap)),
+        max(1, int(target_height * reducing_gap))
+    )
+    if requested[0] >= img.width and requested[1] >= img.height:
+        return False
+
+    try:
+        original_size = img.size
+        img.draft(img.mode, requested)
+        if img.size != original_size:
+            print(f"Reduced JPEG decode: {original_size} -> {img.size} (target {target_size})")
+            return True
+    except Exception as e:
+        print(f"Reduced decode not applied: {e}")
+    return False
+
+
+def resize_image(
+    img: 'PILImage.Image',
+    size: Tuple[int, int],
+    reducing_gap: float = IMAGE_REDUCING_GAP
+) -> 'PILImage.Image':
+    """Resize with LANCZOS, using a fast integer pre-reduction for large downscales"""
+    from PIL import Image
+
+    if img.size == tuple(size):
+        return img
+
+    # reducing_gap only applies when shrinking; it makes Pillow run a cheap
+    # box reduce() first and LANCZOS on the already smaller image
+    if size[0] < img.width and size[1] < img.height:
+        return img.resize(size, Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def open_image_for_size(
+    image_path: str,
+    target_size: Tuple[int, int],
+    reducing_gap: float = IMAGE_REDUCING_GAP
+) -> 'PILImage.Image':
+    """Open an image, decoding JPEGs at reduced resolution when the target is much smaller"""
+    from PIL import Image
+
+    img = Image.open(image_path)
+    draft_for_size(img, target_size, reducing_gap)
+    return img